@@ -0,0 +1,10 @@
+"""
+A reproducible benchmark suite for the flaskr endpoints.
+
+    python -m benchmarks run --users 100 --posts 100000 --output results.json
+    python -m benchmarks compare before.json after.json
+
+run seeds a throwaway database with synthetic users and posts (seed.py), then drives the app through the Flask test
+client and through a real WSGI server on localhost (runner.py). It reports latency percentiles, throughput and peak RSS
+per endpoint, and writes them as JSON so two runs, e.g. from two commits, can be compared.
+"""
@@ -0,0 +1,142 @@
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.runner import SCENARIOS, run_all
+from benchmarks.seed import seed
+from flaskr import create_app
+
+METRICS = ('rps', 'p50_ms', 'p95_ms', 'p99_ms', 'peak_rss_kb')
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL, universal_newlines=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_setting(value):
+    """ Parses a --set KEY=VALUE option. VALUE is read as JSON if it can be (true, 64, "x"), as a string otherwise. """
+    key, sep, raw = value.partition('=')
+
+    if not sep:
+        raise argparse.ArgumentTypeError('expected KEY=VALUE, got {0!r}'.format(value))
+
+    try:
+        return key, json.loads(raw)
+    except ValueError:
+        return key, raw
+
+
+def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        config = {
+            # Any database given with --database is wiped by seeding, point it at a throwaway one.
+            'DATABASE': args.database or os.path.join(tmp, 'bench.sqlite'),
+            'SECRET_KEY': 'benchmark',
+            # Every benchmark client comes from 127.0.0.1 and would share one budget. --set RATELIMIT_ENABLED=true
+            # measures the limiter itself.
+            'RATELIMIT_ENABLED': False,
+        }
+        config.update(args.settings)
+        app = create_app(config)
+
+        began = time.perf_counter()
+        seed(app, users=args.users, posts=args.posts, body_size=args.body_size, seed=args.seed)
+        seed_seconds = time.perf_counter() - began
+
+        results = run_all(
+            app, args.endpoints, transports=args.transports,
+            requests=args.requests, concurrency=args.concurrency, users=args.users,
+        )
+
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'backend': 'postgresql' if args.database and args.database.startswith('postgres') else 'sqlite',
+            'users': args.users,
+            'posts': args.posts,
+            'body_size': args.body_size,
+            'seed': args.seed,
+            'seed_seconds': round(seed_seconds, 3),
+            'settings': dict(args.settings),
+        },
+        'results': results,
+    }
+
+    for r in results:
+        print('{transport:>10} {endpoint:<16} {rps:>9} req/s  p50 {p50_ms:>8} ms  p95 {p95_ms:>8} ms  '
+              'p99 {p99_ms:>8} ms  errors {errors}  rss {peak_rss_kb} KiB'.format(**r), file=sys.stderr)
+
+    if args.output == '-':
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+def compare(args):
+    """ Prints the relative change of every metric between two result files, matched by transport and endpoint. """
+    with open(args.before) as f:
+        before = {(r['transport'], r['endpoint']): r for r in json.load(f)['results']}
+    with open(args.after) as f:
+        after = json.load(f)['results']
+
+    for r in after:
+        old = before.get((r['transport'], r['endpoint']))
+        if old is None:
+            continue
+
+        changes = []
+        for metric in METRICS:
+            if old.get(metric) and r.get(metric) is not None:
+                changes.append('{0} {1:+.1f}%'.format(metric, (r[metric] - old[metric]) * 100.0 / old[metric]))
+
+        print('{0:>10} {1:<16} {2}'.format(r['transport'], r['endpoint'], '  '.join(changes)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__)
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    p = commands.add_parser('run', help='seed a database and benchmark the endpoints')
+    p.add_argument('--database', help='a throwaway postgresql:// URL, defaults to a temporary SQLite file')
+    p.add_argument('--users', type=int, default=100)
+    p.add_argument('--posts', type=int, default=10000)
+    p.add_argument('--body-size', type=int, default=500, help='approximate characters per post body')
+    p.add_argument('--seed', type=int, default=0, help='random seed for the synthetic data')
+    p.add_argument('--requests', type=int, default=1000, help='requests per endpoint and transport')
+    p.add_argument('--concurrency', type=int, default=4)
+    p.add_argument('--endpoints', nargs='+', choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    p.add_argument('--transports', nargs='+', choices=('testclient', 'wsgi'), default=['testclient', 'wsgi'])
+    p.add_argument('--set', dest='settings', metavar='KEY=VALUE', type=parse_setting, action='append', default=[],
+                   help='override an app setting, e.g. --set WRITE_BEHIND=true')
+    p.add_argument('--output', '-o', default='-', help='JSON results file, defaults to stdout')
+    p.set_defaults(func=run)
+
+    p = commands.add_parser('compare', help='compare two result files')
+    p.add_argument('before')
+    p.add_argument('after')
+    p.set_defaults(func=compare)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
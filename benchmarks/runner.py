@@ -0,0 +1,224 @@
+import contextlib
+import functools
+import http.cookiejar
+import math
+import resource
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from benchmarks.seed import PASSWORD, username
+from flaskr.db import get_db
+
+
+class TestClientSession(object):
+    """ Sends requests through the Flask test client: measures the app alone, without any network or server. """
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        return self.client.open(path, method=method, data=data).status_code
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # A redirect is the response being measured, following it would time a second request.
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpSession(object):
+    """ Sends real HTTP requests to a server on localhost, keeping cookies like a browser. """
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect
+        )
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode('ascii') if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+
+        try:
+            with self.opener.open(req) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+
+
+def login(session, user_number):
+    return session.request('POST', '/auth/login', {'username': username(user_number), 'password': PASSWORD})
+
+
+def own_post_ids(app, user_number):
+    with app.app_context():
+        return [row[0] for row in get_db().execute(
+            'SELECT id FROM post WHERE author_id = (SELECT id FROM "user" WHERE username = ?) LIMIT 100',
+            (username(user_number),)
+        )]
+
+
+# Every scenario is (logged_in, expected statuses, make_step). make_step(app, user_number) returns a function that
+# sends one request with a session and returns its status.
+SCENARIOS = {
+    'index': (False, (200,), lambda app, n: lambda s, i: s.request('GET', '/')),
+    'index_logged_in': (True, (200,), lambda app, n: lambda s, i: s.request('GET', '/')),
+    'login': (False, (302,), lambda app, n: lambda s, i: login(s, n)),
+    'create': (True, (302,), lambda app, n: lambda s, i: s.request(
+        'POST', '/create', {'title': 'benchmark {0}'.format(i), 'body': 'created by the benchmark'}
+    )),
+    'update': (True, (302,), lambda app, n: _update_step(app, n)),
+}
+
+
+def _update_step(app, user_number):
+    ids = own_post_ids(app, user_number)
+
+    def step(session, i):
+        if not ids:
+            return None
+        post_id = ids[i % len(ids)]
+        return session.request('POST', '/{0}/update'.format(post_id), {'title': 'updated {0}'.format(i), 'body': 'x'})
+
+    return step
+
+
+def percentile(sorted_values, p):
+    """ Nearest-rank percentile of an already sorted list. """
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(p / 100.0 * len(sorted_values)) - 1)]
+
+
+def reset_peak_rss():
+    """
+    Lowers the process's peak RSS (VmHWM) to its current RSS, so the next reading is the peak of one scenario only.
+    Returns False where that is not possible (no /proc, or Linux older than 4.0).
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_kb():
+    """ VmHWM from /proc, or ru_maxrss (the peak of the whole process so far) where there is none. In KiB. """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+
+    # KiB on Linux, bytes on macOS.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_scenario(app, make_session, name, requests=1000, concurrency=4, users=1):
+    """
+    Runs `requests` requests of a scenario spread over `concurrency` threads, each with its own session logged in as
+    a different user, and returns a dict of results. Latencies are in milliseconds.
+    """
+    logged_in, expected, make_step = SCENARIOS[name]
+    per_thread = max(1, requests // concurrency)
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    sessions, steps = [], []
+
+    for t in range(concurrency):
+        session = make_session()
+        if logged_in:
+            login(session, t % users)
+        sessions.append(session)
+        steps.append(make_step(app, t % users))
+
+    start_barrier = threading.Barrier(concurrency + 1)
+
+    def worker(t):
+        start_barrier.wait()
+        for i in range(per_thread):
+            began = time.perf_counter()
+            status = steps[t](sessions[t], i)
+            latencies[t].append((time.perf_counter() - began) * 1000.0)
+            if status not in expected:
+                errors[t] += 1
+
+    threads = [threading.Thread(target=worker, args=(t,)) for t in range(concurrency)]
+    for thread in threads:
+        thread.start()
+
+    per_scenario = reset_peak_rss()
+    start_barrier.wait()
+    began = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - began
+
+    values = sorted(v for thread_values in latencies for v in thread_values)
+
+    return {
+        'endpoint': name,
+        'requests': len(values),
+        'concurrency': concurrency,
+        'errors': sum(errors),
+        'seconds': round(elapsed, 4),
+        'rps': round(len(values) / elapsed, 2) if elapsed else None,
+        'p50_ms': round(percentile(values, 50), 3),
+        'p95_ms': round(percentile(values, 95), 3),
+        'p99_ms': round(percentile(values, 99), 3),
+        'peak_rss_kb': peak_rss_kb(),
+        # 'process' where the peak could not be reset: it is then the peak of every scenario run so far.
+        'peak_rss_scope': 'scenario' if per_scenario else 'process',
+    }
+
+
+class _QuietHandler(WSGIRequestHandler):
+    # Logging every request to stderr would be part of what is measured.
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class LocalServer(object):
+    """ Serves the app with werkzeug's threaded WSGI server on a free localhost port for the duration of a block. """
+
+    def __init__(self, app):
+        self.server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=_QuietHandler)
+        self.base_url = 'http://127.0.0.1:{0}'.format(self.server.server_port)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.thread.join()
+
+
+def run_all(app, scenarios, transports=('testclient', 'wsgi'), requests=1000, concurrency=4, users=1):
+    results = []
+
+    for transport in transports:
+        with contextlib.ExitStack() as stack:
+            if transport == 'wsgi':
+                server = stack.enter_context(LocalServer(app))
+                make_session = functools.partial(HttpSession, server.base_url)
+            else:
+                make_session = functools.partial(TestClientSession, app)
+
+            for name in scenarios:
+                result = run_scenario(app, make_session, name, requests, concurrency, users)
+                result['transport'] = transport
+                results.append(result)
+
+    return results
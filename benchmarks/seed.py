@@ -0,0 +1,63 @@
+import random
+import string
+
+from werkzeug.security import generate_password_hash
+
+from flaskr.bulk import import_rows, reset_sequence
+from flaskr.db import init_db
+
+PASSWORD = 'benchmark'
+
+
+def username(n):
+    return 'user{0}'.format(n)
+
+
+def words(rng, size):
+    """ Returns roughly `size` characters of random lowercase words. """
+    out, length = [], 0
+
+    while length < size:
+        word = ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 10)))
+        out.append(word)
+        length += len(word) + 1
+
+    return ' '.join(out)
+
+
+def seed(app, users=100, posts=10000, body_size=500, seed=0, batch_size=10000):
+    """
+    Creates a fresh schema in app's database and fills it with `users` users and `posts` posts of about `body_size`
+    characters, spread over the users and over the last few years. The same seed always produces the same data.
+
+    Every user has the password PASSWORD. It is hashed once with the app's PASSWORD_HASH_METHOD and reused, so seeding
+    stays fast while logins still cost what they cost in production.
+    """
+    rng = random.Random(seed)
+
+    with app.app_context():
+        init_db()
+        pwhash = generate_password_hash(PASSWORD, app.config['PASSWORD_HASH_METHOD'])
+
+        import_rows('users', (
+            {'id': n + 1, 'username': username(n), 'password': pwhash} for n in range(users)
+        ), batch_size)
+
+        # A pool of bodies is reused so generating the text does not dominate seeding large databases.
+        bodies = [words(rng, body_size) for _ in range(min(posts, 1000))] or ['']
+
+        import_rows('posts', (
+            {
+                'id': n + 1,
+                'author_id': rng.randint(1, users),
+                'created': '{0:04d}-{1:02d}-{2:02d} {3:02d}:{4:02d}:{5:02d}'.format(
+                    rng.randint(2015, 2019), rng.randint(1, 12), rng.randint(1, 28),
+                    rng.randint(0, 23), rng.randint(0, 59), rng.randint(0, 59),
+                ),
+                'title': words(rng, 30),
+                'body': rng.choice(bodies),
+            } for n in range(posts)
+        ), batch_size)
+
+        reset_sequence('users')
+        reset_sequence('posts')
@@ -11,9 +11,19 @@
 #   tests/      a directory containing test modules
 #
 
+import contextlib
+import importlib
 import os
+import time
 
-from flask import Flask
+import click
+from flask import Flask, current_app, redirect, url_for
+from flask.cli import with_appcontext
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+
+# The blueprint modules BLUEPRINTS may list.
+BLUEPRINTS = ('auth', 'search', 'blog')
 
 
 def create_app(test_config=None):
@@ -21,7 +31,6 @@ def create_app(test_config=None):
     # create_app is also known as "the application factory function."
 
     app = Flask(__name__, instance_relative_config=True)
-    print(" * ( Current Module Name ) __name__ [ ", __name__," ]")
     """
     app = Flask(__name__, instance_relative_config=True) creates the Flask instance.
         *   __name__ is the name of the current Python module. The app needs to know where it’s located to set up 
@@ -34,8 +43,81 @@ def create_app(test_config=None):
     app.config.from_mapping(
         SECRET_KEY='dev',
         DATABASE=os.path.join(app.instance_path, 'flaskr.sqlite'),
+        DATABASE_POOL_SIZE=8,
+        DATABASE_POOL_TIMEOUT=30.0,
+        DATABASE_PRAGMAS={
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'mmap_size': 256 * 1024 * 1024,
+            'cache_size': -16000,
+            'busy_timeout': 5000,
+        },
+        POSTS_PER_PAGE=20,
+        POST_AUTHOR_DENORMALIZED=True,
+        AUTHORS_PER_PAGE=50,
+        STREAM_INDEX=False,
+        INDEX_CACHE_SIZE=256,
+        INDEX_CACHE_TTL=60,
+        USER_CACHE_SIZE=1024,
+        USER_CACHE_TTL=300,
+        PASSWORD_HASH_METHOD='pbkdf2:sha256:600000',
+        PASSWORD_HASH_WORKERS=1,
+        PASSWORD_HASH_QUEUE=4,
+        PASSWORD_HASH_TIMEOUT=10,
+        SEARCH_RESULTS_PER_PAGE=20,
+        RATELIMIT_ENABLED=True,
+        RATELIMIT_BUDGETS={
+            'POST auth.login': (10, 60),
+            'POST auth.register': (5, 60),
+            'POST blog.create': (30, 60),
+            'POST blog.update': (60, 60),
+            'POST blog.delete': (60, 60),
+            'search.search': (60, 60),
+        },
+        RATELIMIT_DEFAULT=None,
+        RATELIMIT_STORE='memory',
+        RATELIMIT_STORE_SIZE=10000,
+        RATELIMIT_STORE_PATH=None,
+        SESSION_STORE=None,
+        SESSION_STORE_PATH=None,
+        SESSION_MAX_PER_USER=10,
+        SESSION_SWEEP_INTERVAL=300,
+        MIGRATION_BATCH_SIZE=5000,
+        MIGRATION_BATCH_PAUSE=0.05,
+        WRITE_BEHIND=False,
+        WRITE_BATCH_SIZE=64,
+        WRITE_BATCH_DELAY_MS=2,
+        WRITE_TIMEOUT=10,
+        INSTRUMENT=False,
+        INSTRUMENT_WINDOW=1000,
+        INSTRUMENT_N_PLUS_ONE=5,
+        INSTRUMENT_PROFILE_SLOW_MS=None,
+        INSTRUMENT_STATS_HOSTS=('127.0.0.1', '::1'),
+        ASGI_HOST='127.0.0.1',
+        ASGI_PORT=8000,
+        ASGI_WORKERS=os.cpu_count() or 1,
+        ASGI_THREADS=8,
+        ASGI_KEEP_ALIVE=75,
+        TEMPLATE_BYTECODE_CACHE=True,
+        TEMPLATE_CACHE_DIR=None,
+        TEMPLATE_PRELOAD=False,
+        STATIC_BUILD_DIR=None,
+        STATIC_COMPRESS_MIN_SIZE=256,
+        STATIC_MAX_AGE=365 * 24 * 60 * 60,
+        HTML_COMPRESS_MIN_SIZE=1024,
+        HTML_COMPRESS_LEVEL=6,
+        WSGI_PRELOAD=True,
+        WSGI_BIND='127.0.0.1:8000',
+        WSGI_WORKERS=os.cpu_count() or 1,
+        WSGI_THREADS=4,
+        WSGI_TIMEOUT=30,
+        WSGI_GRACEFUL_TIMEOUT=30,
+        WSGI_KEEP_ALIVE=5,
+        WSGI_MAX_REQUESTS=0,
+        TRUSTED_PROXIES=0,
+        LOG_LEVEL='WARNING',
+        BLUEPRINTS=BLUEPRINTS,
     )
-    print(" * app.instance_path ==>> [ ", app.instance_path, " ]")
 
     """
     app.config.from_mapping() sets some default configuration that the app will use:
@@ -44,6 +126,46 @@ def create_app(test_config=None):
         *   DATABASE is the path where the SQLite database file will be saved. It’s under app.instance_path, which 
             is the path that Flask has chosen for the instance folder. You’ll learn more about the database in the 
             next section.
+        *   DATABASE_POOL_SIZE and DATABASE_POOL_TIMEOUT bound the pool of SQLite connections that is kept open 
+            across requests, and DATABASE_PRAGMAS are applied once to every connection the pool opens.
+        *   POSTS_PER_PAGE is how many posts the blog index and the per-author pages show per page.
+        *   POST_AUTHOR_DENORMALIZED reads the author's name from the post.author_name copy instead of joining the 
+            user table, see authors.sql. Databases created before that column existed need `flask db upgrade`.
+        *   AUTHORS_PER_PAGE is how many authors the /authors summary shows per page.
+        *   STREAM_INDEX renders the blog index with stream_template() so the first bytes are sent before the 
+            whole page is rendered.
+        *   INDEX_CACHE_SIZE is how many rendered blog index pages each worker keeps (0 turns the cache off), and 
+            INDEX_CACHE_TTL is how many seconds a cached page may be served before it is rendered again. A write in 
+            any worker drops the pages it changed in all of them, see flaskr.cache.
+        *   USER_CACHE_SIZE and USER_CACHE_TTL bound the cache of logged in user records behind g.user.
+        *   PASSWORD_HASH_* choose the password hash method and cost and size the process pool that computes 
+            hashes, see flaskr.hashing. Every server worker has a pool of its own, so the default of one hashing 
+            process per worker keeps the host at one per core with the default WSGI_WORKERS and ASGI_WORKERS.
+        *   SEARCH_RESULTS_PER_PAGE is how many matches the /search view shows per page.
+        *   RATELIMIT_* limit how often one client may log in, register, write and search, and where the token 
+            buckets are kept, see flaskr.ratelimit.
+        *   SESSION_STORE = 'sqlite' keeps sessions on the server instead of in the cookie, so they can be capped 
+            per user and revoked, see flaskr.sessions for the other SESSION_* settings.
+        *   MIGRATION_BATCH_SIZE and MIGRATION_BATCH_PAUSE pace the batched backfills of `flask db upgrade`, see 
+            flaskr.migrate.
+        *   WRITE_BEHIND sends the blog's writes through one writer thread that commits them in batches, see 
+            flaskr.writer for the other WRITE_* settings.
+        *   INSTRUMENT turns on per request timing, SQL recording, the Server-Timing header and /_debug/stats, 
+            see flaskr.instrument for the other INSTRUMENT_* settings.
+        *   ASGI_* configure `python -m flaskr.asgi`: where it listens, how many worker processes it starts, how many 
+            requests each worker handles at once and how long idle keep-alive connections stay open.
+        *   TEMPLATE_BYTECODE_CACHE, TEMPLATE_CACHE_DIR and TEMPLATE_PRELOAD control how templates are compiled, 
+            see flaskr.templating.
+        *   STATIC_* configure `flask build-static` and how the files it builds are served, HTML_COMPRESS_* which 
+            HTML responses are gzipped on the fly (None turns that off), see flaskr.assets.
+        *   WSGI_PRELOAD warms up flaskr.wsgi when it is imported, so workers forked after `gunicorn --preload` 
+            share the warmed memory, see flaskr.wsgi.
+        *   WSGI_BIND, WSGI_WORKERS, WSGI_THREADS, WSGI_TIMEOUT, WSGI_GRACEFUL_TIMEOUT, WSGI_KEEP_ALIVE and 
+            WSGI_MAX_REQUESTS configure gunicorn when it is started with the gunicorn.conf.py of the project, see there.
+        *   TRUSTED_PROXIES is how many reverse proxies sit in front of the app. Their X-Forwarded-* headers are 
+            trusted, so request.remote_addr is the real client again (the rate limits depend on it).
+        *   LOG_LEVEL is the level of app.logger. Startup steps are logged at DEBUG, the total startup time at INFO.
+        *   BLUEPRINTS lists the blueprint modules to import and register, any of auth, search and blog.
     """
 
     if test_config is None:
@@ -57,20 +179,25 @@ def create_app(test_config=None):
                 This is so the tests you’ll write later in the tutorial can be configured independently of any 
                 development values you have configured.
         """
+
+        # FLASK_SECRET_KEY=... overrides SECRET_KEY and so on, which is how the container is configured. Values that
+        # parse as JSON (numbers, true, lists) are loaded as such, anything else as a string.
+        app.config.from_prefixed_env()
     else:
         # load the test config if passed in
         app.config.from_mapping(test_config)
 
+    app.logger.setLevel(app.config['LOG_LEVEL'])
+    app.logger.debug('Instance folder: %s', app.instance_path)
+
     # ensure the instance folder exists
-    try:
-        os.makedirs(app.instance_path)
-        """
-        os.makedirs():
-            *   ensures that app.instance_path exists. Flask doesn’t create the instance folder automatically, 
-                but it needs to be created because your project will create the SQLite database file there.
-        """
-    except OSError:
-        pass
+    os.makedirs(app.instance_path, exist_ok=True)
+    """
+    os.makedirs():
+        *   ensures that app.instance_path exists. Flask doesn’t create the instance folder automatically, 
+            but it needs to be created because your project will create the SQLite database file there.
+            exist_ok=True makes it a no-op when the folder is already there.
+    """
 
     # a simple page that says hello
     """
@@ -83,17 +210,70 @@ def create_app(test_config=None):
     def hello():
         return 'Hello, World!'
 
-    print(" * Registering with application - calling init_app(app)")
-    from . import db
-    db.init_app(app)
+    # /healthz and /readyz, for the health checks of the container and the load balancer, see flaskr.health.
+    from . import health
+    health.init_app(app)
+
+    if app.config['TRUSTED_PROXIES']:
+        hops = app.config['TRUSTED_PROXIES']
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops, x_host=hops)
+
+    # Every step below is timed. The report is kept on the app, logged at INFO and printed by `flask startup-report`.
+    report = app.extensions['flaskr.startup'] = []
+
+    # The template bytecode cache has to be set up before anything touches app.jinja_env.
+    with _timed(app, report, 'templating'):
+        from . import templating
+        templating.init_app(app)
+
+    # Instrumentation goes first so its hooks wrap everything the other parts of the app register.
+    with _timed(app, report, 'instrument'):
+        from . import instrument
+        instrument.init_app(app)
+
+    with _timed(app, report, 'static files'):
+        from . import assets
+        assets.init_app(app)
+
+    # Registered before the blueprints, so a request over its budget is turned away before any of their hooks run.
+    with _timed(app, report, 'rate limits'):
+        from . import ratelimit
+        ratelimit.init_app(app)
+
+    with _timed(app, report, 'db'):
+        from . import db, migrate
+        db.init_app(app)
+        migrate.init_app(app)
 
-    print(" * Registering with application - auth Blueprint")
-    from . import auth
-    app.register_blueprint(auth.bp)
+    with _timed(app, report, 'sessions'):
+        from . import sessions
+        sessions.init_app(app)
+
+    with _timed(app, report, 'export and import commands'):
+        from . import bulk
+        bulk.init_app(app)
+
+    # Only the blueprints listed in BLUEPRINTS are imported and registered, e.g. a worker that only serves the API of
+    # another blueprint never imports blog or search. Any subset of the three works: the templates only link to the
+    # views that are registered, see has_endpoint() below.
+    unknown = [name for name in app.config['BLUEPRINTS'] if name not in BLUEPRINTS]
+
+    if unknown:
+        raise ValueError('Unknown BLUEPRINTS {0}, choose from {1}.'.format(', '.join(unknown), ', '.join(BLUEPRINTS)))
+
+    # g.user is read by base.html and by the views of every blueprint, so the lazy g that loads it is installed
+    # whether or not the auth blueprint is registered, see auth.LazyUserGlobals.
+    with _timed(app, report, 'lazy user'):
+        from .auth import LazyUserGlobals
+        app.app_ctx_globals_class = LazyUserGlobals
+
+    app.jinja_env.globals['has_endpoint'] = lambda endpoint: endpoint in app.view_functions
+
+    for name in app.config['BLUEPRINTS']:
+        with _timed(app, report, 'blueprint ' + name):
+            module = importlib.import_module('.' + name, __name__)
+            app.register_blueprint(module.bp)
 
-    print(" * Registering with application - blog Blueprint")
-    from . import blog
-    app.register_blueprint(blog.bp)
     """
     Unlike the auth blueprint, the blog blueprint does not have a url_prefix ( for auth it is /auth ). 
     So the index view will be at /, the create view at /create, and so on. The blog is the main feature of Flask, so it 
@@ -109,6 +289,38 @@ def create_app(test_config=None):
     In another application you might give the blog blueprint a url_prefix and define a separate index view in the 
     application factory, similar to the hello view. Then the index and blog.index endpoints and URLs would be different. 
     """
-    app.add_url_rule('/', endpoint='index')
-    print(" * Returning App")
+    if 'blog' in app.config['BLUEPRINTS']:
+        app.add_url_rule('/', endpoint='index')
+    else:
+        # Logging in and out still redirects to 'index', which is the search page or /hello without the blog.
+        home = 'search.search' if 'search' in app.config['BLUEPRINTS'] else 'hello'
+        app.add_url_rule('/', endpoint='index', view_func=lambda: redirect(url_for(home)))
+
+    if app.config['TEMPLATE_PRELOAD']:
+        with _timed(app, report, 'preload templates'):
+            templating.preload_templates(app)
+
+    app.cli.add_command(startup_report_command)
+    app.logger.info('Created app in %.1f ms', sum(ms for _, ms in report))
     return app
+
+
+@contextlib.contextmanager
+def _timed(app, report, step):
+    began = time.perf_counter()
+    yield
+    ms = (time.perf_counter() - began) * 1000.0
+    report.append((step, ms))
+    app.logger.debug('Registered %s in %.1f ms', step, ms)
+
+
+@click.command('startup-report')
+@with_appcontext
+def startup_report_command():
+    """Show how long each step of create_app took, imports included."""
+    report = current_app.extensions['flaskr.startup']
+
+    for step, ms in report:
+        click.echo('{0:>9.1f} ms  {1}'.format(ms, step))
+
+    click.echo('{0:>9.1f} ms  total'.format(sum(ms for _, ms in report)))
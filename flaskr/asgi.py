@@ -0,0 +1,45 @@
+"""
+ASGI serving mode (pip install flaskr[asgi]).
+
+    python -m flaskr.asgi
+    uvicorn flaskr.asgi:app --workers 4
+
+uvicorn holds every client connection in an asyncio event loop, so idle keep-alive connections cost a few kilobytes
+each instead of a thread each, and one node can keep thousands of them open. Only requests that are actually being
+handled occupy one of the ASGI_THREADS threads of a worker, where the Flask app runs as usual.
+
+The views themselves stay synchronous. Flask runs an `async def` view by starting an event loop for it inside the
+request thread, which adds overhead without letting the thread serve anything else in the meantime. The parts that
+really block, the database and password hashing, are already bounded by the connection pool and the hashing
+process pool.
+
+python -m flaskr.asgi starts ASGI_WORKERS processes listening on ASGI_HOST:ASGI_PORT, each importing this module and
+building its own app, so nothing (connections, caches, hashing pool) is shared between them.
+"""
+from a2wsgi import WSGIMiddleware
+
+from flaskr import create_app
+
+flask_app = create_app()
+
+# a2wsgi runs each request of the WSGI app in its own thread pool of ASGI_THREADS threads and streams the response
+# back to the event loop, so stream_template() pages still go out as they are rendered.
+app = WSGIMiddleware(flask_app, workers=flask_app.config['ASGI_THREADS'])
+
+
+def main():
+    import uvicorn
+
+    config = flask_app.config
+    uvicorn.run(
+        'flaskr.asgi:app',
+        host=config['ASGI_HOST'],
+        port=config['ASGI_PORT'],
+        workers=config['ASGI_WORKERS'],
+        timeout_keep_alive=config['ASGI_KEEP_ALIVE'],
+        proxy_headers=True,
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+import time
+
+import click
+from flask import current_app, request, send_from_directory
+from flask.cli import with_appcontext
+from werkzeug.exceptions import NotFound
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, pip install flaskr[static]
+    brotli = None
+
+"""
+The static file pipeline.
+
+`flask build-static` copies every file of the static folder to STATIC_BUILD_DIR (instance_path/static by default)
+under a name that contains a hash of its content, e.g. style.css becomes style.3f2a1b9c5d7e.css, and writes gzip and,
+if the brotli package is installed, brotli compressed copies of the text files next to it. manifest.json maps the
+original names to the hashed ones.
+
+When the app starts with a manifest:
+
+    *   url_for('static', filename='style.css') returns the hashed name, so templates do not change.
+    *   A hashed file can never change under the same name, so it is served with Cache-Control: immutable and a max-age
+        of a year: browsers stop revalidating it, and a new deploy changes the name instead.
+    *   The compressed copy the browser accepts (Accept-Encoding) is sent as is, so nothing is compressed per request.
+
+Files missing from the manifest, and every file in debug mode (so edits show up without a rebuild), are served by
+Flask's own static view as before.
+
+Independently of the above, HTML responses of at least HTML_COMPRESS_MIN_SIZE bytes are gzipped on the fly for clients
+that accept it. Their ETag becomes weak, since the bytes sent are no longer the bytes the ETag was computed for.
+"""
+
+MANIFEST = 'manifest.json'
+
+# Types worth compressing. Images and fonts are compressed already.
+COMPRESSIBLE = ('text/', 'application/javascript', 'application/json', 'image/svg+xml', 'application/xml')
+
+# (Accept-Encoding token, file suffix), best first.
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def get_build_dir(app):
+    return app.config['STATIC_BUILD_DIR'] or os.path.join(app.instance_path, 'static')
+
+
+def is_compressible(mimetype):
+    return mimetype is not None and mimetype.startswith(COMPRESSIBLE)
+
+
+def fingerprint(name, content):
+    """ Returns name with the first 12 hex digits of the content's SHA-256 before its extension. """
+    root, ext = os.path.splitext(name)
+    return '{0}.{1}{2}'.format(root, hashlib.sha256(content).hexdigest()[:12], ext)
+
+
+def build_static(app):
+    """
+    Writes the fingerprinted and compressed copies of every static file and the manifest, replacing any previous
+    build. Returns the manifest.
+    """
+    source, target = app.static_folder, get_build_dir(app)
+    min_size = app.config['STATIC_COMPRESS_MIN_SIZE']
+    manifest = {}
+
+    # Built into a new directory that then replaces the old one, so a running app never sees half a build.
+    staging = target + '.new'
+    shutil.rmtree(staging, ignore_errors=True)
+
+    for directory, _, files in os.walk(source):
+        for filename in files:
+            path = os.path.join(directory, filename)
+            name = os.path.relpath(path, source).replace(os.sep, '/')
+
+            with open(path, 'rb') as f:
+                content = f.read()
+
+            hashed = fingerprint(name, content)
+            out = os.path.join(staging, hashed)
+            os.makedirs(os.path.dirname(out), exist_ok=True)
+            shutil.copy2(path, out)
+            manifest[name] = hashed
+
+            if len(content) < min_size or not is_compressible(mimetypes.guess_type(name)[0]):
+                continue
+
+            # mtime=0 keeps the gzip bytes identical from one build to the next.
+            with open(out + '.gz', 'wb') as f:
+                f.write(gzip.compress(content, compresslevel=9, mtime=0))
+
+            if brotli is not None:
+                with open(out + '.br', 'wb') as f:
+                    f.write(brotli.compress(content, quality=11))
+
+    with open(os.path.join(staging, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(staging, target)
+    return manifest
+
+
+def load_manifest(app):
+    try:
+        with open(os.path.join(get_build_dir(app), MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+class StaticFiles(object):
+    """ Rewrites static URLs to the hashed names of the manifest and serves those files. """
+
+    def __init__(self, app, manifest):
+        self.directory = get_build_dir(app)
+        self.max_age = app.config['STATIC_MAX_AGE']
+        self.manifest = manifest
+        self.hashed = {hashed: name for name, hashed in manifest.items()}
+        self.fallback = app.view_functions['static']
+
+        app.url_defaults(self.url_defaults)
+        app.view_functions['static'] = self.serve
+
+    def url_defaults(self, endpoint, values):
+        if endpoint == 'static' and values.get('filename') in self.manifest:
+            values['filename'] = self.manifest[values['filename']]
+
+    def serve(self, filename):
+        if filename not in self.hashed:
+            return self.fallback(filename=filename)
+
+        mimetype = mimetypes.guess_type(self.hashed[filename])[0] or 'application/octet-stream'
+        name, encoding = filename, None
+
+        for token, suffix in ENCODINGS:
+            if request.accept_encodings[token] and os.path.exists(os.path.join(self.directory, filename + suffix)):
+                name, encoding = filename + suffix, token
+                break
+
+        try:
+            response = send_from_directory(self.directory, name, mimetype=mimetype, max_age=self.max_age)
+        except NotFound:
+            # Built by another deploy and gone since, e.g. the manifest of a worker that has not restarted yet.
+            return self.fallback(filename=self.hashed[filename])
+
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+
+def compress_html(response):
+    """ after_request hook: gzips HTML responses of at least HTML_COMPRESS_MIN_SIZE bytes if the client accepts it. """
+    config = current_app.config
+
+    if (
+        response.status_code != 200
+        or response.mimetype != 'text/html'
+        or response.direct_passthrough
+        or response.is_streamed
+        or 'Content-Encoding' in response.headers
+    ):
+        return response
+
+    response.vary.add('Accept-Encoding')
+
+    if not request.accept_encodings['gzip']:
+        return response
+
+    body = response.get_data()
+
+    if len(body) < config['HTML_COMPRESS_MIN_SIZE']:
+        return response
+
+    response.set_data(gzip.compress(body, compresslevel=config['HTML_COMPRESS_LEVEL']))
+    response.headers['Content-Encoding'] = 'gzip'
+
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        response.set_etag(etag, weak=True)
+
+    return response
+
+
+@click.command('build-static')
+@with_appcontext
+def build_static_command():
+    """Fingerprint and precompress the static files."""
+    app = current_app._get_current_object()
+    start = time.monotonic()
+    manifest = build_static(app)
+    click.echo('Built {0} static files into {1} in {2:.2f}s{3}.'.format(
+        len(manifest), get_build_dir(app), time.monotonic() - start,
+        '' if brotli is not None else ' (gzip only, install brotli for .br files)'
+    ))
+
+
+def init_app(app):
+    app.cli.add_command(build_static_command)
+
+    if app.config['HTML_COMPRESS_MIN_SIZE'] is not None:
+        app.after_request(compress_html)
+
+    manifest = load_manifest(app)
+
+    if manifest is not None and not app.debug:
+        app.extensions['flaskr.assets'] = StaticFiles(app, manifest)
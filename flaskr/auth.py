@@ -1,11 +1,15 @@
 import functools
 
 from flask import (
-    Blueprint, flash, g, redirect, render_template, request, session, url_for
+    Blueprint, abort, current_app, flash, g, has_request_context, redirect, render_template, request, session, url_for
 )
-from werkzeug.security import check_password_hash, generate_password_hash
+from flask.ctx import _AppCtxGlobals
 
+from flaskr.cache import get_user_cache
 from flaskr.db import get_db
+from flaskr.hashing import HashPoolBusy, check_password, hash_password, needs_rehash
+from flaskr.instrument import phase
+from flaskr.sessions import get_store as get_session_store
 
 bp = Blueprint('auth', __name__, url_prefix='/auth')
 
@@ -47,7 +51,7 @@ def register():
         elif not password:                                              # Validates that password is not empty
             error = 'Password is required.'
         elif db.execute(
-                'SELECT id FROM user WHERE username = ?', (username,)
+                'SELECT id FROM "user" WHERE username = ?', (username,)
         ).fetchone() is not None:
             # Validate that username is not already registered by querying the database and checking if a result is
             # returned.
@@ -62,12 +66,12 @@ def register():
 
         if error is None:
             # If validation succeeds, insert the new user data into the database. For security, passwords should
-            # never be stored in the database directly. Instead, generate_password_hash() is used to securely hash
-            # the password, and that hash is stored. Since this query modifies data, db.commit() needs to be called
-            # afterwards to save the changes.
+            # never be stored in the database directly. Instead, hash_password() is used to securely hash
+            # the password (in the hashing process pool, see flaskr.hashing), and that hash is stored. Since this
+            # query modifies data, db.commit() needs to be called afterwards to save the changes.
             db.execute(
-                'INSERT INTO user (username, password) VALUES (?, ?)',
-                (username, generate_password_hash(password))
+                'INSERT INTO "user" (username, password) VALUES (?, ?)',
+                (username, hash_password(password))
             )
             db.commit()
 
@@ -99,17 +103,28 @@ def login():
 
         # The user is queried first and stored in a variable for later use.
         user = db.execute(
-            'SELECT * FROM user WHERE username = ?', (username,)
+            'SELECT * FROM "user" WHERE username = ?', (username,)
         ).fetchone()
 
         if user is None:
             error = 'Incorrect username'
-        elif not check_password_hash(user['password'], password):
-            # check_password_hash() hashes the submitted password in the same way as the stored hash and
+        elif not check_password(user['password'], password):
+            # check_password() hashes the submitted password in the same way as the stored hash and
             # securely compares them. If they match, the password is valid.
             error = 'Incorrect password'
 
         if error is None:
+            # The plain password is only known right now, so this is when a hash made with an older method or cost
+            # is replaced by one made with PASSWORD_HASH_METHOD. If the hashing pool is busy it is left for next time.
+            if needs_rehash(user['password']):
+                try:
+                    db.execute(
+                        'UPDATE "user" SET password = ? WHERE id = ?', (hash_password(password), user['id'])
+                    )
+                    db.commit()
+                except HashPoolBusy:
+                    pass
+
             # session is a dict that stores data across requests. When validation succeeds:
             #   *   the user’s id is stored
             #
@@ -118,9 +133,15 @@ def login():
             #   *   The browser then sends it back with subsequent requests.
             #
             # Flask securely signs the data so that it can’t be tampered with.
+            #
+            # With server side sessions (see flaskr.sessions) the cookie only carries a session id, and the user's
+            # row is kept next to the session so the next requests do not have to look it up.
             session.clear()
             session['user_id'] = user['id']
 
+            if hasattr(session, 'cache_user'):
+                session.cache_user({'id': user['id'], 'username': user['username']})
+
             return redirect(url_for('index'))
 
         flash(error)
@@ -129,27 +150,87 @@ def login():
 
 
 # Now that the user's id is stored in the session, it will be available on subsequent requests.
-# At the beginning of each request, if a user is logged in their information should be loaded and made
-# available to other views
+# If a user is logged in their information should be loaded and made available to other views.
 #
-# bp.before_app_first_request() - registers a function that runs before the view function, no matter what URL is
-# requested.
-@bp.before_app_request
+# Instead of loading the user in a bp.before_app_request() function, which runs before every view no matter what URL
+# is requested, g.user is loaded the first time something reads it. Requests that never look at g.user (static files,
+# /hello) never touch the database, and the ones that do are usually served from the user cache.
+def get_user(user_id):
+    """
+    Returns the columns of a user that views and templates use (id and username, never the password hash) as a dict,
+    or None if there is no such user. Records are kept in a bounded LRU cache for USER_CACHE_TTL seconds.
+    """
+    cache = get_user_cache()
+    user = cache.get(user_id) if cache is not None else None
+
+    if user is None:
+        row = get_db().execute(
+            'SELECT id, username FROM "user" WHERE id = ?', (user_id,)
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        user = dict(row)
+
+        if cache is not None:
+            cache.set(user_id, user)
+
+    return user
+
+
+def invalidate_user(user_id=None):
+    """
+    Drops a cached user record, here and in server side sessions, or every one of them when user_id is None. Call it
+    whenever a user's row changes.
+    """
+    cache = get_user_cache()
+
+    if cache is not None:
+        if user_id is None:
+            cache.clear()
+        else:
+            cache.pop(user_id)
+
+    store = get_session_store()
+
+    if store is not None:
+        store.forget_user(user_id)
+
+
 def load_logged_in_user():
     """
-    Checks if a user id is stored in the session and gets that user's data from the database, storing it on g.user,
-    which lasts for the length of the request.
+    Checks if a user id is stored in the session and gets that user's data, storing it on g.user, which lasts for the
+    length of the request.
 
     If there is no user id, or if the id does not exist, g.user will be None.
     """
-    user_id = session.get('user_id')
+    user_id = session.get('user_id') if has_request_context() else None
+    # A server side session carries a copy of the user's row, which saves the lookup altogether.
+    cached = getattr(session, 'user', None) if user_id is not None else None
 
     if user_id is None:
         g.user = None
+    elif cached is not None and cached['id'] == user_id:
+        g.user = cached
     else:
-        g.user = get_db().execute(
-            'SELECT * FROM user WHERE id = ?', (user_id,)
-        ).fetchone()
+        with phase('user'):
+            g.user = get_user(user_id)
+
+        if g.user is not None and hasattr(session, 'cache_user'):
+            session.cache_user(g.user)
+
+    return g.user
+
+
+class LazyUserGlobals(_AppCtxGlobals):
+    """ The class of g, installed by create_app(). Reading g.user before it is set calls load_logged_in_user(). """
+
+    def __getattr__(self, name):
+        if name == 'user':
+            return load_logged_in_user()
+
+        return super(LazyUserGlobals, self).__getattr__(name)
 
 
 @bp.route('/logout')
@@ -164,6 +245,9 @@ def login_required(view):
     def wrapped_view(**kwargs):
         """ This new function checks if a user is loaded and redirects to the login page otherwise. """
         if g.user is None:
+            # Without the auth blueprint this worker has no login page to send the user to.
+            if 'auth.login' not in current_app.view_functions:
+                abort(401)
             return redirect(url_for('auth.login'))
 
         return view(**kwargs)
@@ -0,0 +1,30 @@
+-- Denormalized author data and the indexes behind the per-author views.
+--
+-- post.author_name is a copy of the author's username and user.post_count the number of posts they wrote. The
+-- triggers below keep both in step with every change, so listings can skip the JOIN to user and the authors summary
+-- can skip a COUNT(*) over post. Run by migration 0004_authors, which also fills in both columns for existing rows.
+
+-- Serves /user/<username>: the posts of one author, newest first, as an index range scan.
+CREATE INDEX IF NOT EXISTS post_author_created_id ON post (author_id, created, id);
+
+-- Serves /authors: authors ordered by how much they wrote.
+CREATE INDEX IF NOT EXISTS user_post_count ON user (post_count, id);
+
+CREATE TRIGGER IF NOT EXISTS post_author_insert AFTER INSERT ON post BEGIN
+  UPDATE post SET author_name = (SELECT username FROM user WHERE id = new.author_id) WHERE id = new.id;
+  UPDATE user SET post_count = post_count + 1 WHERE id = new.author_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS post_author_delete AFTER DELETE ON post BEGIN
+  UPDATE user SET post_count = post_count - 1 WHERE id = old.author_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS post_author_update AFTER UPDATE OF author_id ON post BEGIN
+  UPDATE post SET author_name = (SELECT username FROM user WHERE id = new.author_id) WHERE id = new.id;
+  UPDATE user SET post_count = post_count - 1 WHERE id = old.author_id;
+  UPDATE user SET post_count = post_count + 1 WHERE id = new.author_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_rename AFTER UPDATE OF username ON user BEGIN
+  UPDATE post SET author_name = new.username WHERE author_id = new.id;
+END;
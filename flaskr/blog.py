@@ -1,26 +1,272 @@
 import functools
 
+import click
 from flask import (
-    Blueprint, flash, g, redirect, render_template, request, url_for
+    Blueprint, current_app, flash, g, make_response, redirect, render_template, request, session, stream_template,
+    url_for
 )
+from flask.cli import with_appcontext
 from werkzeug.exceptions import abort
 
 from flaskr.auth import login_required
-from flaskr.db import get_db
+from flaskr.cache import CHANGES_QUERY, get_index_cache, index_changed, make_page
+from flaskr.db import get_db, get_pool
+from flaskr.search import strip_marks
+from flaskr.writer import write
 
 bp = Blueprint('blog', __name__)
 
 
+# The index is paginated with a keyset (cursor) rather than OFFSET: each page asks for the rows strictly older (or
+# newer) than the (created, id) pair of the last row the reader saw. Together with the post_created_id index (see
+# migration 0002) every page is an index range scan, so page 1 and page 10,000 cost the same and the worker never
+# holds more than POSTS_PER_PAGE + 1 rows in memory. A per-author page does the same on post_author_created_id, see
+# authors.sql.
+POST_PAGE_QUERY = (
+    'SELECT p.id, title, body, created, author_id, {username} AS username, CAST(p.created AS TEXT) AS created_key '
+    'FROM {source} '
+    '{where} '
+    'ORDER BY p.created {order}, p.id {order} '
+    'LIMIT ?'
+)
+
+
+def post_source():
+    """
+    Returns the (username column, FROM clause) a post query reads the author's name from. With
+    POST_AUTHOR_DENORMALIZED it is the author_name copy kept on every post, which saves a lookup in user per row.
+    """
+    if current_app.config['POST_AUTHOR_DENORMALIZED']:
+        return 'p.author_name', 'post p'
+
+    return 'u.username', 'post p JOIN "user" u ON p.author_id = u.id'
+
+
+def encode_cursor(post):
+    """ Builds the opaque cursor for a post row: its raw created text and its id. """
+    return '{0},{1}'.format(post['created_key'], post['id'])
+
+
+def decode_cursor(cursor):
+    created, _, post_id = cursor.rpartition(',')
+
+    if not created or not post_id.isdigit():
+        abort(400, 'Invalid page cursor.')
+
+    return created, int(post_id)
+
+
+def posts_page_query(before=None, after=None, per_page=20, author_id=None):
+    """ Builds the SQL and parameters get_posts_page() runs. Also used by `flask blog check-plans`. """
+    conditions, params = [], []
+
+    if author_id is not None:
+        conditions.append('p.author_id = ?')
+        params.append(author_id)
+
+    if after is not None:
+        # Walking backwards: read the rows just newer than the cursor in ascending order, then flip them.
+        conditions.append('(p.created, p.id) > (?, ?)')
+        order = 'ASC'
+        params.extend(decode_cursor(after))
+    elif before is not None:
+        conditions.append('(p.created, p.id) < (?, ?)')
+        order = 'DESC'
+        params.extend(decode_cursor(before))
+    else:
+        order = 'DESC'
+
+    where = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+    username, source = post_source()
+    params.append(per_page + 1)
+
+    return POST_PAGE_QUERY.format(username=username, source=source, where=where, order=order), params
+
+
+def get_posts_page(before=None, after=None, per_page=20, author_id=None):
+    """
+    Returns one page of posts, newest first, together with the cursors of the neighbouring pages.
+
+    *   before      -   cursor of the last post on the previous (newer) page; the page holds the posts older than it.
+    *   after       -   cursor of the first post on the next (older) page; the page holds the posts newer than it.
+    *   author_id   -   only the posts of this author.
+
+    One extra row is fetched to know whether another page exists in the direction of travel, without a COUNT(*).
+    """
+    posts = get_db().execute(*posts_page_query(before, after, per_page, author_id)).fetchall()
+    return cut_page(posts, before, after, per_page, encode_cursor)
+
+
+def cut_page(rows, before, after, per_page, encode):
+    """
+    Turns the per_page + 1 rows of a keyset query into (rows, prev_cursor, next_cursor). Rows read backwards from an
+    `after` cursor are flipped into display order, and the extra row only tells whether there is another page.
+    """
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if after is not None:
+        rows.reverse()
+        has_prev, has_next = more, True
+    else:
+        has_prev, has_next = before is not None, more
+
+    prev_cursor = encode(rows[0]) if rows and has_prev else None
+    next_cursor = encode(rows[-1]) if rows and has_next else None
+
+    return rows, prev_cursor, next_cursor
+
+
 @bp.route('/')
 def index():
-    db = get_db()
-    posts = db.execute(
-        'SELECT p.id, title, body, created, author_id, username '
-        'FROM post p JOIN user u ON p.author_id = u.id ' 
-        'ORDER BY created DESC'
-    ).fetchall()
+    stream = current_app.config['STREAM_INDEX']
+    cache = None if stream else get_index_cache()
+
+    # The page differs by viewer (the nav bar and the Edit links), so the viewer is part of the key. Pages are not
+    # cached while a flashed message is pending, since rendering the page consumes it. sync() first drops the pages
+    # that writes made since the last request changed, in this process or any other.
+    if cache is not None and '_flashes' not in session:
+        key = (request.args.get('before'), request.args.get('after'), g.user['id'] if g.user else None)
+        seen = cache.sync(get_db())
+        page = cache.get(key)
+    else:
+        key = page = None
+
+    if page is None:
+        posts, prev_cursor, next_cursor = get_posts_page(
+            before=request.args.get('before'),
+            after=request.args.get('after'),
+            per_page=current_app.config['POSTS_PER_PAGE'],
+        )
+        context = dict(posts=posts, prev_cursor=prev_cursor, next_cursor=next_cursor)
+
+        # stream_template() renders the page as a generator, so the head of the document is sent to the client
+        # while the rest of the posts are still being rendered.
+        if stream:
+            return current_app.response_class(stream_template('blog/index.html', **context))
+
+        page = make_page(render_template('blog/index.html', **context), posts, is_head=prev_cursor is None)
+
+        if key is not None:
+            cache.set_current(key, page, seen)
+
+    # ETag and Last-Modified let a browser revalidate with If-None-Match / If-Modified-Since, and make_conditional()
+    # answers 304 Not Modified without a body when its copy is still current.
+    response = make_response(page.body)
+    response.set_etag(page.etag)
+    response.last_modified = page.last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response.make_conditional(request)
+
+
+# The per-author page. The author is looked up by username through the UNIQUE index on user.username, and their
+# posts are paged with the same cursors as the index, on the post_author_created_id index.
+@bp.route('/user/<username>')
+def author(username):
+    user = get_db().execute(AUTHOR_QUERY, (username,)).fetchone()
+
+    if user is None:
+        abort(404, 'User {0} does not exist.'.format(username))
+
+    posts, prev_cursor, next_cursor = get_posts_page(
+        before=request.args.get('before'),
+        after=request.args.get('after'),
+        per_page=current_app.config['POSTS_PER_PAGE'],
+        author_id=user['id'],
+    )
+
+    return render_template(
+        'blog/author.html', author=user, posts=posts, prev_cursor=prev_cursor, next_cursor=next_cursor
+    )
 
-    return render_template('blog/index.html', posts=posts)
+
+# The summary of who wrote how much. user.post_count is kept up to date by the triggers in authors.sql, so the list
+# is read in order from the user_post_count index without touching post. It is paged with (post_count, id) cursors
+# like the index, so every page is a range scan of the index however far down the list it is.
+AUTHORS_QUERY = (
+    'SELECT id, username, post_count FROM "user" '
+    'WHERE {where} '
+    'ORDER BY post_count {order}, id {order} '
+    'LIMIT ?'
+)
+# Reads every author's entry in user_post_count, so the result is kept in the index cache until the next write.
+AUTHORS_TOTALS_QUERY = (
+    'SELECT COUNT(*) AS authors, COALESCE(SUM(post_count), 0) AS posts FROM "user" WHERE post_count > 0'
+)
+
+
+def encode_author_cursor(author):
+    return '{0},{1}'.format(author['post_count'], author['id'])
+
+
+def decode_author_cursor(cursor):
+    post_count, _, user_id = cursor.partition(',')
+
+    if not post_count.isdigit() or not user_id.isdigit():
+        abort(400, 'Invalid page cursor.')
+
+    return int(post_count), int(user_id)
+
+
+def authors_page_query(before=None, after=None, per_page=50):
+    """ Builds the SQL and parameters get_authors_page() runs. Also used by `flask blog check-plans`. """
+    conditions, params = ['post_count > 0'], []
+
+    if after is not None:
+        # Cursors come from authors with posts, so this bound already excludes the others. Adding post_count > 0
+        # would make SQLite start the range from there instead of from the cursor.
+        conditions = ['(post_count, id) > (?, ?)']
+        order = 'ASC'
+        params.extend(decode_author_cursor(after))
+    elif before is not None:
+        conditions.append('(post_count, id) < (?, ?)')
+        order = 'DESC'
+        params.extend(decode_author_cursor(before))
+    else:
+        order = 'DESC'
+
+    params.append(per_page + 1)
+    return AUTHORS_QUERY.format(where=' AND '.join(conditions), order=order), params
+
+
+def get_authors_page(before=None, after=None, per_page=50):
+    """ Returns a page of authors, most posts first, and the cursors around it, like get_posts_page(). """
+    authors = get_db().execute(*authors_page_query(before, after, per_page)).fetchall()
+    return cut_page(authors, before, after, per_page, encode_author_cursor)
+
+
+def get_authors_totals():
+    """ Returns (authors, posts), from the index cache when it has them, see IndexCache.aggregates. """
+    cache = get_index_cache()
+
+    if cache is None:
+        return tuple(get_db().execute(AUTHORS_TOTALS_QUERY).fetchone())
+
+    seen = cache.sync(get_db())
+    totals = cache.aggregates.get('authors totals')
+
+    if totals is None:
+        totals = tuple(get_db().execute(AUTHORS_TOTALS_QUERY).fetchone())
+        cache.set_aggregate('authors totals', totals, seen)
+
+    return totals
+
+
+@bp.route('/authors')
+def authors():
+    rows, prev_cursor, next_cursor = get_authors_page(
+        before=request.args.get('before'),
+        after=request.args.get('after'),
+        per_page=current_app.config['AUTHORS_PER_PAGE'],
+    )
+    authors_total, posts_total = get_authors_totals()
+
+    return render_template(
+        'blog/authors.html', authors=rows, authors_total=authors_total, posts_total=posts_total,
+        prev_cursor=prev_cursor, next_cursor=next_cursor
+    )
 
 
 # The create VIEW works the same as the auth register view.
@@ -33,8 +279,8 @@ def index():
 @login_required
 def create():
     if request.method == 'POST':
-        title = request.form['title']
-        body = request.form['body']
+        title = strip_marks(request.form['title'])
+        body = strip_marks(request.form['body'])
         error = None
 
         if not title:
@@ -43,13 +289,14 @@ def create():
         if error is not None:
             flash(error)
         else:
-            db = get_db()
-            db.execute(
+            # write() commits on this request's connection, or through the group commit writer with WRITE_BEHIND,
+            # together with the record that tells every worker's index cache about the new post.
+            write(
                 'INSERT INTO post (title, body, author_id) '
                 'VALUES (?, ?, ?)',
-                (title, body, g.user['id'])
+                (title, body, g.user['id']),
+                before=index_changed()
             )
-            db.commit()
             return redirect(url_for('blog.index'))
 
     return render_template('blog/create.html')
@@ -57,13 +304,13 @@ def create():
 
 # Both the Update and Delete views will need to fetch a post by id and check if the author matched the logged in user.
 # To avoid duplicating code, you can write a function to get the post and call it from each view.
+POST_QUERY = 'SELECT p.id, title, body, created, author_id, {username} AS username FROM {source} WHERE p.id = ?'
+AUTHOR_QUERY = 'SELECT id, username, post_count FROM "user" WHERE username = ?'
+
+
 def get_post(id, check_author=True):
-    post = get_db().execute(
-        'SELECT p.id, title, body, created, author_id, username '
-        'FROM post p JOIN user u ON p.author_id = u.id '
-        'WHERE p.id = ?',
-        (id,)
-    ).fetchone()
+    username, source = post_source()
+    post = get_db().execute(POST_QUERY.format(username=username, source=source), (id,)).fetchone()
 
     if post is None:
         # abort() will raise a special exception that returns an HTTP status code. It takes an optional message to show
@@ -97,8 +344,8 @@ def update(id):
     post = get_post(id)
 
     if request.method == 'POST':
-        title = request.form['title']
-        body = request.form['body']
+        title = strip_marks(request.form['title'])
+        body = strip_marks(request.form['body'])
         error = None
 
         if not title:
@@ -107,13 +354,12 @@ def update(id):
         if error is not None:
             flash(error)
         else:
-            db = get_db()
-            db.execute(
+            write(
                 'UPDATE post SET title = ?, body = ? '
                 'WHERE id = ?',
-                (title, body, id)
+                (title, body, id),
+                before=index_changed(id)
             )
-            db.commit()
             return redirect(url_for('blog.index'))
 
     return render_template('blog/update.html', post=post)
@@ -125,7 +371,62 @@ def update(id):
 @login_required
 def delete(id):
     get_post(id)
-    db = get_db()
-    db.execute('DELETE FROM post WHERE id = ?', (id,))
-    db.commit()
+    write('DELETE FROM post WHERE id = ?', (id,), before=index_changed(id))
     return redirect(url_for('blog.index'))
+
+
+def check_query_plans():
+    """
+    Runs EXPLAIN QUERY PLAN on every query behind the listing views and returns a list of (name, plan step) for the
+    steps that would get slower as the tables grow: a SCAN, which walks a whole table or index, or a temporary B-tree
+    built to sort the rows. An empty list means every view is answered by an index search.
+
+    The first index page is the one exception allowed to SCAN: it walks post_created_id newest first and stops after
+    POSTS_PER_PAGE + 1 rows, so it never reads further than it returns.
+    """
+    cursor = '2018-01-01 00:00:00,1'
+    username, source = post_source()
+    queries = [
+        ('index', posts_page_query(), True),
+        ('index older', posts_page_query(before=cursor), False),
+        ('index newer', posts_page_query(after=cursor), False),
+        ('author', posts_page_query(author_id=1), False),
+        ('author older', posts_page_query(before=cursor, author_id=1), False),
+        ('author newer', posts_page_query(after=cursor, author_id=1), False),
+        ('author lookup', (AUTHOR_QUERY, ('test',)), False),
+        ('authors', authors_page_query(), True),
+        ('authors fewer posts', authors_page_query(before='1,1'), False),
+        ('authors more posts', authors_page_query(after='1,1'), False),
+        ('authors totals', (AUTHORS_TOTALS_QUERY, ()), False),
+        ('post', (POST_QUERY.format(username=username, source=source), (1,)), False),
+        ('index changes', (CHANGES_QUERY, (0,)), False),
+    ]
+    db = get_db()
+    problems = []
+
+    for name, (sql, params), may_scan in queries:
+        for row in db.execute('EXPLAIN QUERY PLAN ' + sql, params):
+            detail = row['detail']
+            if (detail.startswith('SCAN') and not may_scan) or 'TEMP B-TREE' in detail:
+                problems.append((name, detail))
+
+    return problems
+
+
+# `flask blog check-plans`, run it after changing a listing query or an index.
+@bp.cli.command('check-plans')
+@with_appcontext
+def check_query_plans_command():
+    """Fail if a listing query would scan a whole table or sort without an index."""
+    if get_pool().dialect != 'sqlite':
+        raise click.ClickException('check-plans reads SQLite query plans.')
+
+    problems = check_query_plans()
+
+    for name, detail in problems:
+        click.echo('{0}: {1}'.format(name, detail), err=True)
+
+    if problems:
+        raise click.ClickException('{0} query plan step(s) without an index.'.format(len(problems)))
+
+    click.echo('Every listing query uses an index.')
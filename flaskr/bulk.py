@@ -0,0 +1,289 @@
+import csv
+import itertools
+import json
+import os
+import sqlite3
+import time
+
+import click
+from flask.cli import with_appcontext
+
+from flaskr.db import get_db, get_pool, stream_query
+from flaskr.search import strip_marks
+
+"""
+flask export and flask import move users and posts in and out of the database in bulk, as JSON Lines or CSV.
+
+Both stream: export iterates the cursor and import reads the file one record at a time, so memory stays flat no matter
+how many rows there are. Import inserts with executemany() in one transaction per batch, which turns one fsync per row
+into one per --batch-size rows.
+
+After each batch is committed, the number of records done is written to FILE.progress. If an import is interrupted,
+running it again skips what was already committed. Rows that carry an id are inserted with ON CONFLICT DO NOTHING, so
+replaying a batch never duplicates them.
+
+Import users before their posts: the triggers in authors.sql copy the author's name onto each post, and count it, as
+the post is inserted.
+"""
+
+TABLES = {
+    'users': {
+        'table': '"user"',
+        'columns': ('id', 'username', 'password'),
+        'select': 'SELECT id, username, password FROM "user" ORDER BY id',
+        'insert': 'INSERT INTO "user" (id, username, password) VALUES (?, ?, ?) ON CONFLICT DO NOTHING',
+    },
+    'posts': {
+        'table': 'post',
+        'columns': ('id', 'author_id', 'created', 'title', 'body'),
+        # created is exported as the stored text, not as the datetime PARSE_DECLTYPES would build from it.
+        'select': 'SELECT id, author_id, CAST(created AS TEXT), title, body FROM post ORDER BY id',
+        'insert': (
+            'INSERT INTO post (id, author_id, created, title, body) '
+            'VALUES (?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?, ?) ON CONFLICT DO NOTHING'
+        ),
+        # Cleaned like the blog's create and update views do, see search.strip_marks().
+        'text': ('title', 'body'),
+    },
+}
+
+FORMATS = ('jsonl', 'csv')
+
+
+def guess_format(filename, fmt):
+    if fmt is not None:
+        return fmt
+
+    ext = os.path.splitext(filename)[1].lower().lstrip('.')
+
+    if ext in ('json', 'jsonl', 'ndjson'):
+        return 'jsonl'
+    if ext == 'csv':
+        return 'csv'
+
+    raise click.UsageError('Cannot tell the format of {0}, pass --format.'.format(filename))
+
+
+def export_rows(table, out, fmt, arraysize=1000):
+    """ Writes every row of table to the file out and returns how many were written. """
+    spec = TABLES[table]
+    cursor = stream_query(get_db(), spec['select'])
+    cursor.arraysize = arraysize
+    count = 0
+
+    if fmt == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(spec['columns'])
+
+    for row in cursor:
+        if fmt == 'csv':
+            writer.writerow(tuple(row))
+        else:
+            out.write(json.dumps(dict(zip(spec['columns'], row)), ensure_ascii=False))
+            out.write('\n')
+        count += 1
+
+    return count
+
+
+def read_records(f, fmt):
+    """ Yields one dict per record of a JSON Lines or CSV file. """
+    if fmt == 'csv':
+        for record in csv.DictReader(f):
+            yield record
+    else:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def record_values(columns, record, text=()):
+    # CSV has no NULL, so empty strings are read as "not given" (e.g. no id lets SQLite assign one).
+    values = (record.get(column) if record.get(column) != '' else None for column in columns)
+    return tuple(strip_marks(value) if column in text else value for column, value in zip(columns, values))
+
+
+def import_rows(table, records, batch_size=10000, skip=0, on_batch=None):
+    """
+    Inserts records into table, batch_size rows per transaction, after skipping the first `skip` of them.
+    on_batch(done) is called after each commit with the number of records done so far, including the skipped ones.
+    """
+    spec = TABLES[table]
+    db = get_db()
+    done = skip
+    records = itertools.islice(records, skip, None)
+
+    while True:
+        text = spec.get('text', ())
+        batch = [record_values(spec['columns'], record, text) for record in itertools.islice(records, batch_size)]
+
+        if not batch:
+            return done
+
+        try:
+            with db:
+                db.executemany(spec['insert'], batch)
+        except integrity_errors() as e:
+            raise click.ClickException(describe_failed_batch(table, batch, done, e))
+
+        done += len(batch)
+
+        if on_batch is not None:
+            on_batch(done)
+
+
+def integrity_errors():
+    if get_pool().dialect == 'postgresql':
+        import psycopg2
+        return psycopg2.IntegrityError
+
+    return sqlite3.IntegrityError
+
+
+def describe_failed_batch(table, batch, done, error):
+    """
+    Says which batch a constraint stopped, by record numbers, since nothing of it was committed and the import resumes
+    from its start. For posts it also names the author ids that have no user: the triggers in authors.sql cannot copy a
+    missing author's name onto the post, so that is what usually fails.
+    """
+    message = 'The batch of records {0} to {1} was not imported: {2}'.format(done + 1, done + len(batch), error)
+
+    if table != 'posts':
+        return message
+
+    author_ids = sorted({row[1] for row in batch if row[1] is not None}, key=str)
+    found = {
+        str(row[0]) for row in get_db().execute(
+            'SELECT id FROM "user" WHERE id IN ({0})'.format(', '.join('?' * len(author_ids))), author_ids
+        )
+    } if author_ids else set()
+    missing = [author_id for author_id in author_ids if str(author_id) not in found]
+
+    if missing:
+        message += '\nNo user has the author_id {0}. Import the users first.'.format(
+            ', '.join(str(author_id) for author_id in missing)
+        )
+
+    return message
+
+
+def reset_sequence(table):
+    """
+    Rows imported with their id do not move a PostgreSQL SERIAL sequence, so the next INSERT without an id would
+    collide with them. Move the sequence past the highest id. SQLite needs nothing, it always uses max(id) + 1.
+    """
+    if get_pool().dialect != 'postgresql':
+        return
+
+    name = TABLES[table]['table']
+
+    with get_db() as db:
+        db.execute(
+            "SELECT setval(pg_get_serial_sequence('{0}', 'id'), COALESCE(MAX(id), 1)) FROM {0}".format(name)
+        )
+
+
+def invalidate_caches(table):
+    """
+    Drops the cached copies of what an import wrote: user records for users, index pages for posts. The posts may be
+    on any page, so every server process is told to drop all of its index pages.
+    """
+    if table == 'users':
+        from flaskr.auth import invalidate_user
+        invalidate_user()
+    else:
+        from flaskr.cache import EVERY_POST, index_changed
+
+        with get_db() as db:
+            for sql, parameters in index_changed(EVERY_POST):
+                db.execute(sql, parameters)
+
+
+def read_checkpoint(path):
+    try:
+        with open(path) as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def write_checkpoint(path, done):
+    # Written to a temporary file and renamed, so an interruption never leaves a half written checkpoint.
+    with open(path + '.tmp', 'w') as f:
+        f.write(str(done))
+    os.replace(path + '.tmp', path)
+
+
+@click.command('export')
+@click.argument('table', type=click.Choice(sorted(TABLES)))
+@click.option('--output', '-o', type=click.File('w', encoding='utf-8'), default='-', help='Defaults to stdout.')
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default=None, help='Defaults to the --output extension.')
+@with_appcontext
+def export_command(table, output, fmt):
+    """Stream all users or posts to a JSON Lines or CSV file."""
+    if fmt is None and output.name == '<stdout>':
+        fmt = 'jsonl'
+
+    fmt = guess_format(output.name, fmt)
+    start = time.monotonic()
+    count = export_rows(table, output, fmt)
+    elapsed = time.monotonic() - start
+    click.echo('Exported {0} {1} in {2:.1f}s.'.format(count, table, elapsed), err=True)
+
+
+@click.command('import')
+@click.argument('table', type=click.Choice(sorted(TABLES)))
+@click.argument('filename', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default=None, help='Defaults to the file extension.')
+@click.option('--batch-size', default=10000, show_default=True, help='Rows inserted per transaction.')
+@click.option('--resume/--restart', default=True, show_default=True,
+              help='Continue after the last committed batch recorded in FILENAME.progress.')
+@click.option('--defer-search-index', is_flag=True,
+              help='Drop the full-text search triggers while importing posts and rebuild the index at the end.')
+@with_appcontext
+def import_command(table, filename, fmt, batch_size, resume, defer_search_index):
+    """Load users or posts from a JSON Lines or CSV file in batched transactions."""
+    fmt = guess_format(filename, fmt)
+    checkpoint = filename + '.progress'
+    skip = read_checkpoint(checkpoint) if resume else 0
+    start = time.monotonic()
+
+    if skip:
+        click.echo('Resuming after {0} records.'.format(skip), err=True)
+
+    if get_pool().dialect != 'sqlite':
+        defer_search_index = False
+
+    if defer_search_index and table == 'posts':
+        # Keeping the FTS index in step row by row is most of the cost of a posts import. If the import stops half
+        # way, the triggers stay dropped until the next import or `flask search rebuild` puts them back.
+        with get_db() as db:
+            for trigger in ('post_fts_insert', 'post_fts_update', 'post_fts_delete'):
+                db.execute('DROP TRIGGER IF EXISTS {0}'.format(trigger))
+
+    def progress(done):
+        write_checkpoint(checkpoint, done)
+        elapsed = time.monotonic() - start
+        rate = (done - skip) / elapsed if elapsed else 0
+        click.echo('{0} records imported ({1:,.0f} rows/s)'.format(done, rate), err=True)
+
+    with open(filename, newline='', encoding='utf-8') as f:
+        done = import_rows(table, read_records(f, fmt), batch_size, skip, progress)
+
+    reset_sequence(table)
+    invalidate_caches(table)
+
+    if defer_search_index and table == 'posts':
+        from flaskr.search import rebuild_index
+        click.echo('Rebuilding the search index.', err=True)
+        rebuild_index()
+
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+    click.echo('Imported {0} {1} in {2:.1f}s.'.format(done - skip, table, time.monotonic() - start), err=True)
+
+
+def init_app(app):
+    app.cli.add_command(export_command)
+    app.cli.add_command(import_command)
@@ -0,0 +1,233 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timezone
+
+from flask import current_app
+
+from flaskr.db import get_pool
+
+"""
+In-process caches shared by the threads of one worker.
+
+Every process keeps its own copy. The user cache only sees the invalidations made by its own process, and its ttl
+bounds how long another worker can keep serving a copy that is out of date.
+
+The index page cache is kept in step across processes through the index_change table (see migration 0005). A write
+that changes what the index shows records a row there in the same transaction, and before a cached page is served
+the process applies the rows recorded since it last looked, whichever process wrote them. That is one search of the
+table's primary key per request, and it finds nothing unless someone wrote in between. Rows are deleted again after
+CHANGE_RETENTION seconds, and a cache that has not looked for half of that starts over empty.
+"""
+
+# How long index_change rows are kept, in seconds.
+CHANGE_RETENTION = 3600
+
+# The changes a cache has not applied yet, a search of the primary key.
+CHANGES_QUERY = 'SELECT id, post_id FROM index_change WHERE id > ? ORDER BY id'
+
+# The post_id recorded for a change that may touch any page, such as `flask import`. Post ids start at 1.
+EVERY_POST = 0
+
+
+class LRUCache(object):
+    """
+    A thread safe mapping bounded to `maxsize` entries. When it is full, the least recently used entry is evicted.
+    If `ttl` is given, entries older than `ttl` seconds are treated as missing.
+    """
+
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+
+            if item is not None and self.ttl is not None and time.monotonic() - item[0] > self.ttl:
+                del self._data[key]
+                item = None
+
+            if item is None:
+                self.misses += 1
+                return None
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+            return item[1] if item is not None else None
+
+    def discard_where(self, predicate):
+        """ Removes every entry whose value matches predicate(value) and returns how many were removed. """
+        with self._lock:
+            keys = [key for key, (_, value) in self._data.items() if predicate(value)]
+            for key in keys:
+                del self._data[key]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+class IndexCache(LRUCache):
+    """
+    The LRUCache of rendered index pages, which also applies the changes recorded in index_change, see above.
+    `seen` is the id of the last change applied, None until the cache first looks.
+
+    `aggregates` holds values computed over every post, such as the totals of /authors. Any change drops them.
+    """
+
+    def __init__(self, maxsize=128, ttl=None):
+        super(IndexCache, self).__init__(maxsize, ttl)
+        self.aggregates = {}
+        self.seen = None
+        self.synced = 0.0
+        self._sync_lock = threading.RLock()
+
+    def sync(self, db):
+        """ Applies the changes recorded since the last call and returns the id of the last one. """
+        with self._sync_lock:
+            if self.seen is None or time.monotonic() - self.synced > CHANGE_RETENTION / 2:
+                # The changes since the last look may have been deleted already, so nothing cached is trusted.
+                self.clear()
+                self.seen = db.execute('SELECT COALESCE(MAX(id), 0) FROM index_change').fetchone()[0]
+            else:
+                for change_id, post_id in db.execute(CHANGES_QUERY, (self.seen,)).fetchall():
+                    self.discard_changed(post_id)
+                    self.seen = change_id
+
+            self.synced = time.monotonic()
+            return self.seen
+
+    def set_current(self, key, page, seen):
+        """
+        Caches a page rendered after sync() returned `seen`, unless changes were applied since: the page may have been
+        rendered before one of them was written, and discarding it would have come too early.
+        """
+        with self._sync_lock:
+            if self.seen == seen:
+                self.set(key, page)
+
+    def set_aggregate(self, key, value, seen):
+        """ Keeps a value computed after sync() returned `seen`, on the same terms as set_current(). """
+        with self._sync_lock:
+            if self.seen == seen:
+                self.aggregates[key] = value
+
+    def discard_changed(self, post_id):
+        """
+        Drops the pages a change can affect.
+
+        *   post_id is None         -   a post was created. It is the newest post, so it only shows up on head pages.
+        *   post_id is EVERY_POST   -   anything may have changed.
+        *   otherwise               -   a post was updated or deleted, which only changes the pages that show it.
+        """
+        self.aggregates.clear()
+
+        if post_id is None:
+            self.discard_where(lambda page: page.is_head)
+        elif post_id == EVERY_POST:
+            self.clear()
+        else:
+            self.discard_where(lambda page: post_id in page.post_ids)
+
+    def clear(self):
+        # Starting over also means looking up where the changes are at again.
+        with self._sync_lock:
+            self.seen = None
+            self.aggregates.clear()
+            super(IndexCache, self).clear()
+
+
+# A rendered blog index page.
+#   *   post_ids    -   the posts shown on it, so an update or delete only drops the pages that show that post.
+#   *   is_head     -   True when there is no newer page, which is the only kind of page a new post can appear on.
+CachedPage = namedtuple('CachedPage', 'body etag last_modified post_ids is_head')
+
+
+def make_page(body, posts, is_head):
+    return CachedPage(
+        body=body,
+        etag=hashlib.sha1(body.encode('utf-8')).hexdigest(),
+        last_modified=datetime.now(timezone.utc).replace(microsecond=0),
+        post_ids=frozenset(post['id'] for post in posts),
+        is_head=is_head,
+    )
+
+
+def get_cache(name, size_key, ttl_key, app=None, cls=LRUCache):
+    """ Returns the app's LRUCache called `name`, sized from app.config, or None if its size is configured as 0. """
+    app = app or current_app._get_current_object()
+
+    if not app.config[size_key]:
+        return None
+
+    cache = app.extensions.get(name)
+
+    if cache is None:
+        cache = app.extensions.setdefault(name, cls(app.config[size_key], app.config[ttl_key]))
+
+    return cache
+
+
+def get_index_cache(app=None):
+    """ Returns the blog index page cache, an IndexCache, or None if INDEX_CACHE_SIZE is 0. """
+    return get_cache('flaskr.cache', 'INDEX_CACHE_SIZE', 'INDEX_CACHE_TTL', app, IndexCache)
+
+
+def get_user_cache(app=None):
+    """ Returns the cache of logged in user records, or None if USER_CACHE_SIZE is 0. """
+    return get_cache('flaskr.users', 'USER_CACHE_SIZE', 'USER_CACHE_TTL', app)
+
+
+def index_changed(post_id=None):
+    """
+    Returns the statements that record a write the index pages of every process have to see, to be committed in the
+    same transaction as the write itself (see writer.write). post_id is what IndexCache.discard_changed() expects.
+    Returns no statements when INDEX_CACHE_SIZE is 0, as there are no pages to drop then.
+    """
+    if get_index_cache() is None:
+        return []
+
+    statements = []
+
+    if get_pool().dialect == 'postgresql':
+        # Change ids come from a sequence, in the order the transactions started. The lock makes them commit in that
+        # order too, so a process never applies change 11 before change 10 is visible and skips 10 for good.
+        statements.append(('LOCK TABLE index_change IN SHARE ROW EXCLUSIVE MODE', ()))
+
+    now = time.time()
+    statements.append(('DELETE FROM index_change WHERE created < ?', (now - CHANGE_RETENTION,)))
+    statements.append(('INSERT INTO index_change (post_id, created) VALUES (?, ?)', (post_id, now)))
+    return statements
@@ -1,4 +1,6 @@
 import sqlite3
+import threading
+import time
 
 import click
 from flask import current_app, g
@@ -16,34 +18,206 @@ from flask.cli import with_appcontext
 """
 
 
+class ConnectionPool(object):
+    """
+    Keeps SQLite connections open across requests instead of connecting and closing once per request, so the schema
+    is parsed once, the page cache stays warm and sqlite3's statement cache is actually reused.
+
+    Subclasses override connect() to pool connections to another database, see flaskr.postgres.
+
+    Each worker thread gets back the connection it used last when it is idle. Otherwise any idle connection is handed
+    out, a new one is opened while fewer than `size` exist, or the caller waits up to `timeout` seconds for a release.
+
+    *   hits    -   acquisitions served by an already open connection.
+    *   opens   -   new connections that had to be opened.
+    *   waits   -   acquisitions that had to block because every connection was in use.
+    """
+
+    dialect = 'sqlite'
+
+    def __init__(self, database, size=8, timeout=30.0, pragmas=None):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = pragmas or {}
+        self._idle = []
+        self._opened = 0
+        self._local = threading.local()
+        self._lock = threading.Condition()
+        self.hits = self.opens = self.waits = 0
+
+    def connect(self):
+        # check_same_thread is off because a connection may move to another thread once its owner releases it.
+        # The pool guarantees only one thread uses it at a time.
+        db = sqlite3.connect(self.database, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+        db.row_factory = sqlite3.Row
+
+        # PRAGMAs are per connection, so they are paid once here instead of on every request.
+        for name, value in self.pragmas.items():
+            db.execute('PRAGMA {0} = {1}'.format(name, value))
+
+        return db
+
+    def acquire(self):
+        with self._lock:
+            db = getattr(self._local, 'db', None)
+            # One deadline for the whole wait, however many times another thread takes the released connection first.
+            deadline = time.monotonic() + self.timeout
+            waited = False
+
+            while True:
+                if db is not None and db in self._idle:
+                    self._idle.remove(db)
+                    break
+                if self._idle:
+                    db = self._idle.pop()
+                    break
+                if self._opened < self.size:
+                    self._opened += 1
+                    db = None
+                    break
+                if not waited:
+                    self.waits += 1
+                    waited = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._lock.wait(remaining):
+                    raise RuntimeError('Timed out waiting for a database connection.')
+
+            if db is not None:
+                self.hits += 1
+                self._local.db = db
+                return db
+
+            self.opens += 1
+
+        try:
+            db = self.connect()
+        except Exception:
+            with self._lock:
+                self._opened -= 1
+                self._lock.notify()
+            raise
+
+        self._local.db = db
+        return db
+
+    def release(self, db):
+        # Never hand out a connection with a half finished transaction left over from a failed request.
+        if db.in_transaction:
+            db.rollback()
+
+        with self._lock:
+            self._idle.append(db)
+            self._lock.notify()
+
+    def close(self):
+        with self._lock:
+            for db in self._idle:
+                db.close()
+            self._opened -= len(self._idle)
+            self._idle = []
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'open': self._opened,
+                'idle': len(self._idle),
+                'hits': self.hits,
+                'opens': self.opens,
+                'waits': self.waits,
+            }
+
+
+_pool_lock = threading.Lock()
+
+
+def is_postgres_url(database):
+    return database.startswith(('postgresql://', 'postgres://'))
+
+
+def get_pool(app=None):
+    """
+    Returns the application's connection pool, creating it from app.config the first time it is needed.
+
+    DATABASE picks the backend: a postgresql:// URL uses PostgreSQL through flaskr.postgres (which needs psycopg2),
+    anything else is the path of an SQLite file.
+    """
+    app = app or current_app._get_current_object()
+    pool = app.extensions.get('flaskr.db')
+
+    if pool is None:
+        with _pool_lock:
+            pool = app.extensions.get('flaskr.db')
+            if pool is None:
+                pool_class = ConnectionPool
+
+                if is_postgres_url(app.config['DATABASE']):
+                    from flaskr.postgres import PostgresPool
+                    pool_class = PostgresPool
+
+                pool = app.extensions['flaskr.db'] = pool_class(
+                    app.config['DATABASE'],
+                    size=app.config['DATABASE_POOL_SIZE'],
+                    timeout=app.config['DATABASE_POOL_TIMEOUT'],
+                    pragmas=app.config['DATABASE_PRAGMAS'],
+                )
+
+    return pool
+
+
 def get_db():
     if 'db' not in g:
-        g.db = sqlite3.connect(current_app.config['DATABASE'], detect_types=sqlite3.PARSE_DECLTYPES)
-        g.db.row_factory = sqlite3.Row
+        g.db = get_pool().acquire()
+
+        # With INSTRUMENT on, the connection is wrapped to time every statement, see flaskr.instrument.
+        instrument = current_app.extensions.get('flaskr.instrument')
+        if instrument is not None:
+            g.db = instrument.wrap(g.db)
         """
-        sqlite3.connect()   establishes a connection to the file pointed at by the DATABASE configuration key. 
-                            This file doesn’t have to exist yet, and won’t until you initialize the database later.
-        sqlite3.Row         tells the connection to return rows that behave like dicts. This allows accessing the 
-                            columns by name.
+        get_pool().acquire()    hands out a pooled connection to the file pointed at by the DATABASE configuration
+                                key. This file doesn’t have to exist yet, and won’t until you initialize the database
+                                later.
+        sqlite3.Row             tells the connection to return rows that behave like dicts. This allows accessing
+                                the columns by name.
         """
 
     return g.db
 
-# ****************** Python functions that will run schema.sql SQL commands ******************
+
+def stream_query(db, sql, parameters=()):
+    """
+    Iterates over the rows of a query without reading the whole result into memory. sqlite3 cursors already fetch
+    lazily, the PostgreSQL connection needs a server side cursor for it.
+    """
+    if hasattr(db, 'stream'):
+        return db.stream(sql, parameters)
+
+    return db.execute(sql, parameters)
+
+# ****************** Python functions that create the tables ******************
 #   init_db()
 #   init_db_command()
 
 
 def init_db():
-    db = get_db()
+    """
+    Starts from an empty database: drops every table, then applies all the migrations in flaskr/migrations, see
+    flaskr.migrate. To change the schema of a database while keeping its data, use `flask db upgrade` instead.
+    """
+    from flaskr import migrate
+    from flaskr.auth import invalidate_user
+    from flaskr.cache import get_index_cache
 
-    with current_app.open_resource('schema.sql') as f:
-        """
-        open_resource()     opens a file relative to the flaskr package, which is useful since you won’t 
-                            necessarily know where that location is when deploying the application later. 
-        get_db              returns a database connection, which is used to execute the commands read from the file.
-        """
-        db.executescript(f.read().decode('utf8'))
+    migrate.reset()
+    migrate.upgrade()
+
+    # Every user and post is gone, and so must be the copies of them this process has cached.
+    invalidate_user()
+    cache = get_index_cache()
+
+    if cache is not None:
+        cache.clear()
 
 """
 click.command()     defines a command line command called init-db that calls the init_db function and shows 
@@ -61,13 +235,19 @@ def init_db_command():
 def close_db(e=None):
     """
     close_db    checks if a connection was created by checking if g.db was set. If the connection exists, it is
-                closed. Further down you will tell your application about the close_db function in the application
-                factory so that it is called after each request.
+                returned to the pool. Further down you will tell your application about the close_db function in the
+                application factory so that it is called after each request.
     """
     db = g.pop('db', None)
 
     if db is not None:
-        db.close()
+        # The pool hands out and takes back its own connections, not the wrapper INSTRUMENT puts around them.
+        from flaskr.instrument import InstrumentedConnection
+
+        if isinstance(db, InstrumentedConnection):
+            db = db.wrapped
+
+        get_pool().release(db)
 
 # ****************** Register with the Application ******************
 #   init_app()
@@ -0,0 +1,128 @@
+import functools
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+from flask import current_app
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import check_password_hash, generate_password_hash
+
+"""
+Password hashing is deliberately slow. Running it on the request thread lets a burst of logins hold every thread of a
+worker, so it runs in a small pool of processes instead, and requests that would have to queue behind too many others
+are turned away straight away with 503 Service Unavailable and a Retry-After header.
+
+    PASSWORD_HASH_METHOD        the werkzeug hash method and cost used for new hashes, e.g. 'pbkdf2:sha256:600000'.
+    PASSWORD_HASH_WORKERS       processes in the pool. 0 hashes inline on the request thread, e.g. when testing.
+    PASSWORD_HASH_QUEUE         hash jobs that may wait for a free process before new ones are rejected.
+    PASSWORD_HASH_TIMEOUT       seconds a request waits for its job before it gives up with a 503.
+
+The pool belongs to one server process, and so do both limits: gunicorn with WSGI_WORKERS workers, or
+`python -m flaskr.asgi` with ASGI_WORKERS, runs that many pools, plus one forkserver process each. A host hashes at
+most workers * PASSWORD_HASH_WORKERS passwords at once and holds (PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE) jobs
+per worker, so raise PASSWORD_HASH_WORKERS only when there are fewer server workers than cores.
+"""
+
+
+class HashPoolBusy(ServiceUnavailable):
+    description = 'The server is busy checking passwords. Please try again shortly.'
+
+
+class HashPool(object):
+
+    def __init__(self, workers, queue_size, timeout):
+        self.timeout = timeout
+        # The pool is started from a worker that already runs threads (gunicorn's gthread, a2wsgi). fork() would copy
+        # whatever locks those threads hold into the children, so they are started by a clean forkserver process.
+        self.executor = ProcessPoolExecutor(workers, mp_context=get_mp_context()) if workers else None
+        # One slot per job running in a worker plus one per job allowed to queue for it.
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self.completed = self.rejected = self.timeouts = 0
+
+    def run(self, func, *args):
+        if self.executor is None:
+            return func(*args)
+
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HashPoolBusy(retry_after=1)
+
+        try:
+            future = self.executor.submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        # The slot is given back when the job has left the executor (done, failed or cancelled), not when the request
+        # stops waiting for it: a job that timed out but is still queued or running keeps counting against the bound.
+        future.add_done_callback(lambda future: self._slots.release())
+
+        try:
+            result = future.result(self.timeout)
+        except TimeoutError:
+            # Nobody will read the result any more. If the job has not started yet it is dropped from the queue.
+            future.cancel()
+            self.timeouts += 1
+            raise HashPoolBusy(retry_after=int(self.timeout) or 1)
+
+        self.completed += 1
+        return result
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+    def stats(self):
+        return {
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'timeouts': self.timeouts,
+        }
+
+
+def get_mp_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+_pool_lock = threading.Lock()
+
+
+def get_hash_pool(app=None):
+    app = app or current_app._get_current_object()
+    pool = app.extensions.get('flaskr.hashing')
+
+    if pool is None:
+        with _pool_lock:
+            pool = app.extensions.get('flaskr.hashing')
+            if pool is None:
+                pool = app.extensions['flaskr.hashing'] = HashPool(
+                    app.config['PASSWORD_HASH_WORKERS'],
+                    app.config['PASSWORD_HASH_QUEUE'],
+                    app.config['PASSWORD_HASH_TIMEOUT'],
+                )
+
+    return pool
+
+
+def hash_password(password):
+    return get_hash_pool().run(generate_password_hash, password, current_app.config['PASSWORD_HASH_METHOD'])
+
+
+def check_password(pwhash, password):
+    return get_hash_pool().run(check_password_hash, pwhash, password)
+
+
+@functools.lru_cache(maxsize=8)
+def method_prefix(method):
+    """
+    Returns the method part of the hashes werkzeug makes for `method`. It fills in what the setting leaves out, e.g.
+    'pbkdf2:sha256' gives 'pbkdf2:sha256:1000000' and 'scrypt' gives 'scrypt:32768:8:1', so the setting cannot be
+    compared with stored hashes as written. Costs one hash per process and method.
+    """
+    return generate_password_hash('', method).split('$', 1)[0]
+
+
+def needs_rehash(pwhash):
+    """ True if a stored hash was made with another method or cost than PASSWORD_HASH_METHOD. """
+    return pwhash.split('$', 1)[0] != method_prefix(current_app.config['PASSWORD_HASH_METHOD'])
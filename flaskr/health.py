@@ -0,0 +1,100 @@
+import os
+import time
+
+from flask import current_app
+
+from flaskr.db import get_db, get_pool, is_postgres_url
+
+"""
+Health checks for the container and the load balancer in front of it.
+
+    /healthz    liveness: the process is up and answering requests. It touches nothing else, so a slow database never
+                gets a healthy worker killed.
+    /readyz     readiness: the worker can actually serve pages. Answers 200 when every check below passes and 503
+                with the failing ones otherwise, so the load balancer stops sending requests until it recovers.
+
+The readiness checks:
+
+    *   database    the SQLite file exists and the process may write to it and to its folder, where SQLite creates
+                    the -wal and -shm files. Skipped for PostgreSQL.
+    *   pool        a connection can be taken from the pool and answers SELECT 1.
+    *   schema      no migration is pending, i.e. `flask db upgrade` has run against this database.
+
+Both answer JSON and are never cached, rate limited or given a session cookie.
+"""
+
+
+def check_database(app):
+    path = app.config['DATABASE']
+
+    if is_postgres_url(path):
+        return 'postgresql'
+
+    if not os.path.exists(path):
+        raise RuntimeError('{0} does not exist, run `flask db upgrade`.'.format(path))
+
+    if not os.access(path, os.R_OK | os.W_OK) or not os.access(os.path.dirname(path) or '.', os.W_OK):
+        raise RuntimeError('{0} or its folder is not writable.'.format(path))
+
+    return path
+
+
+def check_pool(app):
+    # get_db() takes the request's connection from the pool, the teardown gives it back.
+    get_db().execute('SELECT 1').fetchone()
+    return get_pool(app).stats()
+
+
+def check_schema(app):
+    from flaskr.migrate import pending_migrations
+
+    pending = pending_migrations()
+
+    if pending:
+        raise RuntimeError('{0} migration(s) pending, run `flask db upgrade`.'.format(len(pending)))
+
+    return 'up to date'
+
+
+CHECKS = (
+    ('database', check_database),
+    ('pool', check_pool),
+    ('schema', check_schema),
+)
+
+
+def healthz():
+    return no_store({'status': 'ok'}, 200)
+
+
+def readyz():
+    app = current_app._get_current_object()
+    checks, ready = {}, True
+
+    for name, check in CHECKS:
+        began = time.perf_counter()
+        try:
+            checks[name] = {'ok': True, 'detail': check(app)}
+        except Exception as e:
+            checks[name] = {'ok': False, 'error': str(e) or type(e).__name__}
+            ready = False
+            # Later checks would only fail on the same cause, e.g. no schema in a database that does not exist.
+            break
+        finally:
+            checks[name]['ms'] = round((time.perf_counter() - began) * 1000.0, 2)
+
+    if not ready:
+        app.logger.warning('Not ready: %s', checks)
+
+    return no_store({'status': 'ok' if ready else 'unavailable', 'checks': checks}, 200 if ready else 503)
+
+
+def no_store(body, status):
+    response = current_app.make_response((body, status))
+    response.cache_control.no_store = True
+    return response
+
+
+def init_app(app):
+    app.add_url_rule('/healthz', 'healthz', healthz)
+    app.add_url_rule('/readyz', 'readyz', readyz)
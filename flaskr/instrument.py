@@ -0,0 +1,355 @@
+import contextlib
+import cProfile
+import logging
+import math
+import os
+import threading
+import time
+from collections import Counter, defaultdict, deque
+
+from flask import (
+    abort, appcontext_tearing_down, before_render_template, current_app, g, has_request_context, jsonify, request,
+    request_started, template_rendered
+)
+
+"""
+Opt-in request profiling, turned on with INSTRUMENT = True.
+
+For every request it records how long each phase took:
+
+    user        loading g.user (see auth.load_logged_in_user), unless the session carried a copy of it
+    write       waiting for the group commit writer (see flaskr.writer)
+    db          executing SQL and fetching the rows, over all statements
+    render      rendering the template
+    view        everything between the start of the request and the response, except render
+    teardown    closing the request and returning the connection to the pool
+
+and, for every SQL statement, its duration and how many rows were read. A statement that runs INSTRUMENT_N_PLUS_ONE
+times or more in one request is logged as a likely N+1 query.
+
+The numbers are sent back in a Server-Timing header (shown by the browser dev tools), and rolling windows of the last
+INSTRUMENT_WINDOW requests per endpoint are served as JSON at /_debug/stats to the addresses in INSTRUMENT_STATS_HOSTS.
+If INSTRUMENT_PROFILE_SLOW_MS is set, requests run under cProfile and the ones slower than that are dumped to
+instance_path/profiles, to be opened with pstats or snakeviz. Only one request per process is profiled at a time: from
+Python 3.12 on, cProfile hooks the whole interpreter and a second profiler cannot be enabled next to the first, so
+requests that start while another one is profiled run without it.
+"""
+
+log = logging.getLogger(__name__)
+
+HISTOGRAM_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+class InstrumentedCursor(object):
+    """ Wraps a sqlite3.Cursor to add the time spent fetching and the number of rows fetched to a query record. """
+
+    def __init__(self, cursor, record):
+        self._cursor = cursor
+        self._record = record
+
+    def _fetch(self, method, *args):
+        began = time.perf_counter()
+        result = getattr(self._cursor, method)(*args)
+        self._record['ms'] += (time.perf_counter() - began) * 1000.0
+
+        if method == 'fetchone':
+            self._record['rows'] += result is not None
+        else:
+            self._record['rows'] += len(result)
+
+        return result
+
+    def fetchone(self):
+        return self._fetch('fetchone')
+
+    def fetchmany(self, *args):
+        return self._fetch('fetchmany', *args)
+
+    def fetchall(self):
+        return self._fetch('fetchall')
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class InstrumentedConnection(object):
+    """
+    Wraps a pooled connection and records every statement run through it on the current request. The pooled connection
+    is `wrapped`, not `connection`, which PostgresConnection already uses for the psycopg2 connection it wraps itself.
+    """
+
+    def __init__(self, connection, stats):
+        self.wrapped = connection
+        self._stats = stats
+
+    def _run(self, sql, method, *args):
+        record = {'sql': sql, 'ms': 0.0, 'rows': 0}
+        began = time.perf_counter()
+        cursor = getattr(self.wrapped, method)(sql, *args)
+        record['ms'] = (time.perf_counter() - began) * 1000.0
+
+        if method == 'executemany':
+            record['rows'] = cursor.rowcount
+
+        self._stats.queries.append(record)
+        return InstrumentedCursor(cursor, record)
+
+    def execute(self, sql, *args):
+        return self._run(sql, 'execute', *args)
+
+    def executemany(self, sql, *args):
+        return self._run(sql, 'executemany', *args)
+
+    def executescript(self, sql):
+        return self._run(sql, 'executescript')
+
+    def commit(self):
+        self._timed('COMMIT', self.wrapped.commit)
+
+    def rollback(self):
+        self._timed('ROLLBACK', self.wrapped.rollback)
+
+    def _timed(self, sql, func):
+        began = time.perf_counter()
+        func()
+        self._stats.queries.append({'sql': sql, 'ms': (time.perf_counter() - began) * 1000.0, 'rows': 0})
+
+    def __enter__(self):
+        self.wrapped.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self.wrapped.__exit__(*exc_info)
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+
+class RequestStats(object):
+    """ What is recorded about one request. Lives on g while the request runs. """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.responded = None
+        self.endpoint = None
+        self.phases = defaultdict(float)
+        self.queries = []
+        self.render_started = None
+        self.profiler = None
+
+    def query_ms(self):
+        return sum(query['ms'] for query in self.queries)
+
+    def repeated_queries(self, threshold):
+        counts = Counter(query['sql'] for query in self.queries)
+        return {sql: count for sql, count in counts.items() if count >= threshold}
+
+
+@contextlib.contextmanager
+def phase(name):
+    """ Adds the time spent in the block to the named phase of the current request, if it is being instrumented. """
+    stats = g.get('_instrument') if has_request_context() else None
+
+    if stats is None:
+        yield
+        return
+
+    began = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.phases[name] += (time.perf_counter() - began) * 1000.0
+
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return round(sorted_values[max(0, math.ceil(p / 100.0 * len(sorted_values)) - 1)], 3)
+
+
+class Instrumentation(object):
+    """ Collects RequestStats into rolling per endpoint windows and hooks itself into the app. """
+
+    def __init__(self, app):
+        self.app = app
+        self.window = app.config['INSTRUMENT_WINDOW']
+        self.n_plus_one = app.config['INSTRUMENT_N_PLUS_ONE']
+        self.profile_slow_ms = app.config['INSTRUMENT_PROFILE_SLOW_MS']
+        self._lock = threading.Lock()
+        # Held by the request being profiled, see on_request_started().
+        self._profiling = threading.Lock()
+        self._requests = defaultdict(lambda: deque(maxlen=self.window))
+        self._statements = defaultdict(lambda: {'count': 0, 'ms': 0.0, 'rows': 0})
+        self._n_plus_one = Counter()
+
+        request_started.connect(self.on_request_started, app)
+        before_render_template.connect(self.on_before_render, app)
+        template_rendered.connect(self.on_rendered, app)
+        appcontext_tearing_down.connect(self.on_teardown, app)
+        app.after_request(self.on_after_request)
+
+    def wrap(self, connection):
+        stats = g.get('_instrument') if has_request_context() else None
+        return InstrumentedConnection(connection, stats) if stats is not None else connection
+
+    def on_request_started(self, sender, **extra):
+        g._instrument = stats = RequestStats()
+
+        if self.profile_slow_ms is not None and self._profiling.acquire(blocking=False):
+            stats.profiler = cProfile.Profile()
+            try:
+                stats.profiler.enable()
+            except ValueError:
+                # Another profiler outside this app is running, e.g. `python -m cProfile`.
+                stats.profiler = None
+                self._profiling.release()
+
+    def on_before_render(self, sender, **extra):
+        stats = g.get('_instrument')
+        if stats is not None:
+            stats.render_started = time.perf_counter()
+
+    def on_rendered(self, sender, **extra):
+        stats = g.get('_instrument')
+        if stats is not None and stats.render_started is not None:
+            stats.phases['render'] += (time.perf_counter() - stats.render_started) * 1000.0
+            stats.render_started = None
+
+    def on_after_request(self, response):
+        stats = g.get('_instrument')
+
+        if stats is None:
+            return response
+
+        stats.responded = time.perf_counter()
+        stats.endpoint = request.endpoint or '<unmatched>'
+        total = (stats.responded - stats.started) * 1000.0
+        stats.phases['view'] = total - stats.phases['render']
+        stats.phases['db'] = stats.query_ms()
+
+        response.headers['Server-Timing'] = ', '.join([
+            'user;dur={0:.2f}'.format(stats.phases['user']),
+            'db;dur={0:.2f};desc="{1} queries"'.format(stats.phases['db'], len(stats.queries)),
+            'view;dur={0:.2f}'.format(stats.phases['view']),
+            'render;dur={0:.2f}'.format(stats.phases['render']),
+            'total;dur={0:.2f}'.format(total),
+        ])
+        return response
+
+    def on_teardown(self, sender, **extra):
+        stats = g.pop('_instrument', None)
+
+        if stats is None:
+            return
+
+        # Stopped first, also for a request that failed before it responded, so the next one can be profiled.
+        if stats.profiler is not None:
+            stats.profiler.disable()
+            self._profiling.release()
+
+        if stats.responded is None:
+            return
+
+        ended = time.perf_counter()
+        stats.phases['teardown'] = (ended - stats.responded) * 1000.0
+        total = (ended - stats.started) * 1000.0
+        endpoint = stats.endpoint
+        repeated = stats.repeated_queries(self.n_plus_one)
+
+        for sql, count in repeated.items():
+            log.warning('Possible N+1 query on %s: ran %d times: %s', endpoint, count, sql)
+
+        with self._lock:
+            self._requests[endpoint].append((total, dict(stats.phases), len(stats.queries)))
+            self._n_plus_one[endpoint] += bool(repeated)
+
+            for query in stats.queries:
+                statement = self._statements[query['sql']]
+                statement['count'] += 1
+                statement['ms'] += query['ms']
+                statement['rows'] += query['rows']
+
+        if stats.profiler is not None and total >= self.profile_slow_ms:
+            self.dump_profile(stats.profiler, endpoint, total)
+
+    def dump_profile(self, profiler, endpoint, total):
+        directory = os.path.join(self.app.instance_path, 'profiles')
+        os.makedirs(directory, exist_ok=True)
+        filename = os.path.join(directory, '{0}-{1}-{2:.0f}ms.prof'.format(int(time.time() * 1000), endpoint, total))
+        profiler.dump_stats(filename)
+        log.info('Slow request on %s took %.0f ms, profile written to %s', endpoint, total, filename)
+
+    def snapshot(self):
+        """ Summarises the rolling windows: percentiles, a latency histogram and phase averages per endpoint. """
+        with self._lock:
+            requests = {endpoint: list(window) for endpoint, window in self._requests.items()}
+            statements = dict(self._statements)
+            n_plus_one = dict(self._n_plus_one)
+
+        endpoints = {}
+
+        for endpoint, window in requests.items():
+            totals = sorted(total for total, _, _ in window)
+            histogram = dict.fromkeys(['le_{0}'.format(b) for b in HISTOGRAM_BUCKETS_MS] + ['inf'], 0)
+
+            for total in totals:
+                bucket = next((b for b in HISTOGRAM_BUCKETS_MS if total <= b), None)
+                histogram['le_{0}'.format(bucket) if bucket is not None else 'inf'] += 1
+
+            phases = defaultdict(float)
+            for _, request_phases, _ in window:
+                for name, ms in request_phases.items():
+                    phases[name] += ms
+
+            endpoints[endpoint] = {
+                'count': len(window),
+                'p50_ms': _percentile(totals, 50),
+                'p95_ms': _percentile(totals, 95),
+                'p99_ms': _percentile(totals, 99),
+                'histogram_ms': histogram,
+                'avg_phase_ms': {name: round(ms / len(window), 3) for name, ms in phases.items()},
+                'avg_queries': round(sum(q for _, _, q in window) / float(len(window)), 2),
+                'n_plus_one_requests': n_plus_one.get(endpoint, 0),
+            }
+
+        slowest = sorted(statements.items(), key=lambda item: item[1]['ms'], reverse=True)[:20]
+
+        return {
+            'endpoints': endpoints,
+            'statements': [
+                dict(sql=sql, count=s['count'], total_ms=round(s['ms'], 3), avg_ms=round(s['ms'] / s['count'], 3),
+                     rows=s['rows'])
+                for sql, s in slowest
+            ],
+        }
+
+
+def debug_stats():
+    if request.remote_addr not in current_app.config['INSTRUMENT_STATS_HOSTS']:
+        abort(404)
+
+    from flaskr.db import get_pool
+
+    stats = current_app.extensions['flaskr.instrument'].snapshot()
+    stats['pool'] = get_pool().stats()
+
+    for name in ('flaskr.cache', 'flaskr.users', 'flaskr.hashing', 'flaskr.writer', 'flaskr.ratelimit'):
+        if name in current_app.extensions:
+            stats[name.split('.', 1)[1]] = current_app.extensions[name].stats()
+
+    return jsonify(stats)
+
+
+def init_app(app):
+    if not app.config['INSTRUMENT']:
+        return
+
+    app.extensions['flaskr.instrument'] = Instrumentation(app)
+    app.add_url_rule('/_debug/stats', 'debug_stats', debug_stats)
@@ -0,0 +1,341 @@
+import contextlib
+import fcntl
+import importlib
+import pkgutil
+import re
+import time
+from collections import namedtuple
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from flaskr.db import get_db, get_pool
+
+"""
+Versioned schema migrations.
+
+The schema is built by the numbered modules in flaskr/migrations, applied in order. Each one has an upgrade(m) and a
+downgrade(m) function that change the schema through m, a Migrator. The schema_version table records which ones have
+been applied, so `flask db upgrade` only runs the new ones and never touches the data already there.
+
+    flask db status             lists the migrations and which ones are applied.
+    flask db upgrade            applies every pending migration, or up to --to VERSION.
+    flask db downgrade          reverts the last migration, or down to --to VERSION.
+    flask init-db               drops everything and upgrades an empty database, see db.init_db().
+
+A database created before schema_version existed starts at version 0. The early migrations use IF NOT EXISTS, so
+upgrading it adopts the tables it already has instead of failing on them.
+
+Migrations have to be safe to run while the app is serving:
+
+    *   m.backfill() updates a large table in batches of MIGRATION_BATCH_SIZE rows, each in its own short transaction,
+        pausing MIGRATION_BATCH_PAUSE seconds in between so the app's writes get the lock in between batches.
+    *   m.create_index() builds an index CONCURRENTLY on PostgreSQL, which blocks neither reads nor writes. SQLite
+        builds it in one transaction: in WAL mode readers carry on meanwhile, only writers wait.
+    *   A migration that stops half way (a crash, a deploy) can simply be run again: every step checks what is already
+        there, and the version is only recorded once the whole migration is done.
+
+Only one process migrates at a time: the others wait on a lock and then find nothing left to do.
+"""
+
+Migration = namedtuple('Migration', 'version name module')
+
+MIGRATION_NAME = re.compile(r'^(\d{4})_(\w+)$')
+
+VERSION_TABLE = (
+    'CREATE TABLE IF NOT EXISTS schema_version ('
+    ' version INTEGER PRIMARY KEY,'
+    ' name TEXT NOT NULL,'
+    ' applied TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP'
+    ')'
+)
+
+# What init_db() drops before migrating an empty database. Triggers and indexes go with their tables.
+RESET = {
+    'sqlite': (
+        'DROP TABLE IF EXISTS post_fts;'
+        'DROP TABLE IF EXISTS post;'
+        'DROP TABLE IF EXISTS user;'
+        'DROP TABLE IF EXISTS schema_version;'
+        'DROP TABLE IF EXISTS index_change;'
+    ),
+    'postgresql': (
+        'DROP TABLE IF EXISTS post, "user", schema_version, index_change CASCADE;'
+        'DROP FUNCTION IF EXISTS post_author_sync(), user_rename_sync() CASCADE;'
+    ),
+}
+
+
+def load_migrations():
+    """ Returns every migration in flaskr/migrations, ordered by version. """
+    from flaskr import migrations
+
+    found = []
+
+    for info in pkgutil.iter_modules(migrations.__path__):
+        match = MIGRATION_NAME.match(info.name)
+        if match:
+            module = importlib.import_module('{0}.{1}'.format(migrations.__name__, info.name))
+            found.append(Migration(int(match.group(1)), match.group(2), module))
+
+    found.sort()
+
+    for previous, migration in zip(found, found[1:]):
+        if previous.version == migration.version:
+            raise RuntimeError('Two migrations are numbered {0:04d}.'.format(migration.version))
+
+    return found
+
+
+class Migrator(object):
+    """ What a migration's upgrade(m) and downgrade(m) use to change the schema. """
+
+    def __init__(self, db, dialect, batch_size=5000, batch_pause=0.0, echo=None):
+        self.db = db
+        self.dialect = dialect
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.echo = echo or (lambda message: None)
+
+    @property
+    def postgres(self):
+        return self.dialect == 'postgresql'
+
+    def execute(self, sql, parameters=()):
+        """ Runs one statement in its own transaction. """
+        with self.db:
+            return self.db.execute(sql, parameters)
+
+    def script(self, name):
+        """ Runs a .sql file of the flaskr package, e.g. search.sql. """
+        with current_app.open_resource(name) as f:
+            self.db.executescript(f.read().decode('utf8'))
+
+    def table_exists(self, table):
+        if self.postgres:
+            sql = 'SELECT 1 FROM information_schema.tables WHERE table_name = ?'
+        else:
+            sql = 'SELECT 1 FROM sqlite_master WHERE name = ?'
+
+        return self.db.execute(sql, (table,)).fetchone() is not None
+
+    def column_exists(self, table, column):
+        if self.postgres:
+            return self.db.execute(
+                'SELECT 1 FROM information_schema.columns WHERE table_name = ? AND column_name = ?', (table, column)
+            ).fetchone() is not None
+
+        return any(row['name'] == column for row in self.db.execute('PRAGMA table_info("{0}")'.format(table)))
+
+    def add_column(self, table, column, definition):
+        """
+        Adds a column unless it is there already. Give it a constant DEFAULT: both databases then add it without
+        rewriting the table, and the real values can be filled in afterwards with backfill().
+        """
+        if not self.column_exists(table, column):
+            self.execute('ALTER TABLE "{0}" ADD COLUMN {1} {2}'.format(table, column, definition))
+
+    def drop_column(self, table, column):
+        if self.column_exists(table, column):
+            self.execute('ALTER TABLE "{0}" DROP COLUMN {1}'.format(table, column))
+
+    def create_index(self, name, table, columns, using=None):
+        """
+        Creates an index unless it exists. On PostgreSQL it is built CONCURRENTLY, which cannot run inside a
+        transaction, so the connection is switched to autocommit for the duration.
+        """
+        columns = ', '.join(columns)
+
+        if not self.postgres:
+            self.execute('CREATE INDEX IF NOT EXISTS {0} ON "{1}" ({2})'.format(name, table, columns))
+            return
+
+        using = ' USING {0}'.format(using) if using else ''
+        self.db.commit()
+        self.db.connection.autocommit = True
+        try:
+            self.db.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS {0} ON "{1}"{2} ({3})'.format(
+                name, table, using, columns
+            ))
+        finally:
+            self.db.connection.autocommit = False
+
+    def drop_index(self, name):
+        self.execute('DROP INDEX IF EXISTS {0}'.format(name))
+
+    def backfill(self, table, assignments, where=None):
+        """
+        Runs UPDATE table SET assignments over every row, batch_size rows at a time in id order, committing and pausing
+        after each batch. The write lock is only held for one batch, and an interrupted backfill can be run again.
+        With `where`, only the rows of each batch that match it are updated.
+        """
+        last, done = 0, 0
+
+        while True:
+            with self.db:
+                row = self.db.execute(
+                    'SELECT MAX(id) AS upto, COUNT(*) AS n FROM ('
+                    ' SELECT id FROM "{0}" WHERE id > ? ORDER BY id LIMIT ?'
+                    ') batch'.format(table),
+                    (last, self.batch_size)
+                ).fetchone()
+
+                if not row['n']:
+                    return done
+
+                self.db.execute(
+                    'UPDATE "{0}" SET {1} WHERE id > ? AND id <= ?{2}'.format(
+                        table, assignments, ' AND ({0})'.format(where) if where else ''
+                    ),
+                    (last, row['upto'])
+                )
+
+            last, done = row['upto'], done + row['n']
+            self.echo('  {0}: {1} rows backfilled'.format(table, done))
+
+            if self.batch_pause:
+                time.sleep(self.batch_pause)
+
+
+def get_migrator(echo=None):
+    config = current_app.config
+    return Migrator(
+        get_db(), get_pool().dialect, config['MIGRATION_BATCH_SIZE'], config['MIGRATION_BATCH_PAUSE'], echo
+    )
+
+
+@contextlib.contextmanager
+def migration_lock(m):
+    """ Holds a lock that only one migrating process at a time can have, e.g. when several containers start at once. """
+    if m.postgres:
+        m.execute('SELECT pg_advisory_lock(hashtext(?))', ('flaskr.migrate',))
+        try:
+            yield
+        finally:
+            m.execute('SELECT pg_advisory_unlock(hashtext(?))', ('flaskr.migrate',))
+        return
+
+    with open(current_app.config['DATABASE'] + '.migrate.lock', 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def applied_versions(m):
+    """
+    Returns {version: when it was applied}. Only reads: it runs on every /readyz probe, and a database without the
+    schema_version table simply has nothing applied yet.
+    """
+    if not m.table_exists('schema_version'):
+        return {}
+
+    return {row['version']: row['applied'] for row in m.db.execute('SELECT version, applied FROM schema_version')}
+
+
+def current_version(m):
+    return max(applied_versions(m), default=0)
+
+
+def pending_migrations():
+    """ Returns the migrations not applied yet. """
+    m = get_migrator()
+    applied = applied_versions(m)
+    return [migration for migration in load_migrations() if migration.version not in applied]
+
+
+def upgrade(target=None, echo=None):
+    """ Applies the pending migrations up to version `target` (all of them by default). Returns how many ran. """
+    m = get_migrator(echo)
+    count = 0
+
+    with migration_lock(m):
+        m.execute(VERSION_TABLE)
+        applied = applied_versions(m)
+
+        for migration in load_migrations():
+            if migration.version in applied or (target is not None and migration.version > target):
+                continue
+
+            m.echo('Applying {0:04d} {1}'.format(migration.version, migration.name))
+            migration.module.upgrade(m)
+            m.execute('INSERT INTO schema_version (version, name) VALUES (?, ?)', (migration.version, migration.name))
+            count += 1
+
+    return count
+
+
+def downgrade(target, echo=None):
+    """ Reverts the applied migrations above version `target`, newest first. Returns how many ran. """
+    m = get_migrator(echo)
+    count = 0
+
+    with migration_lock(m):
+        applied = applied_versions(m)
+
+        for migration in reversed(load_migrations()):
+            if migration.version not in applied or migration.version <= target:
+                continue
+
+            m.echo('Reverting {0:04d} {1}'.format(migration.version, migration.name))
+            migration.module.downgrade(m)
+            m.execute('DELETE FROM schema_version WHERE version = ?', (migration.version,))
+            count += 1
+
+    return count
+
+
+def reset():
+    """ Drops every table of the app, data included. """
+    db = get_db()
+    db.executescript(RESET[get_pool().dialect])
+
+
+db_cli = AppGroup('db', help='Inspect and migrate the database schema.')
+
+
+@db_cli.command('status')
+def status_command():
+    """Show which migrations are applied."""
+    m = get_migrator()
+    applied = applied_versions(m)
+
+    for migration in load_migrations():
+        when = applied.get(migration.version)
+        click.echo('{0} {1:04d} {2}{3}'.format(
+            '[x]' if when is not None else '[ ]', migration.version, migration.name,
+            '  (applied {0})'.format(when) if when is not None else ''
+        ))
+
+    click.echo('Schema version {0}.'.format(max(applied, default=0)))
+
+
+@db_cli.command('upgrade')
+@click.option('--to', 'target', type=int, default=None, help='Stop after this version. Defaults to the latest.')
+def upgrade_command(target):
+    """Apply pending migrations."""
+    count = upgrade(target, echo=click.echo)
+    click.echo('Applied {0} migration(s), schema version {1}.'.format(count, current_version(get_migrator())))
+
+
+@db_cli.command('downgrade')
+@click.option('--to', 'target', type=int, default=None, help='Revert down to this version. Defaults to one step.')
+@click.option('--yes', is_flag=True, help='Do not ask for confirmation.')
+def downgrade_command(target, yes):
+    """Revert migrations. Columns and tables they added are dropped with their data."""
+    current = current_version(get_migrator())
+
+    if target is None:
+        target = max((migration.version for migration in load_migrations() if migration.version < current), default=0)
+
+    if not yes:
+        click.confirm('Revert the schema from version {0} to {1}?'.format(current, target), abort=True)
+
+    count = downgrade(target, echo=click.echo)
+    click.echo('Reverted {0} migration(s), schema version {1}.'.format(count, current_version(get_migrator())))
+
+
+def init_app(app):
+    app.cli.add_command(db_cli)
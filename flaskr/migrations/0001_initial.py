@@ -0,0 +1,44 @@
+"""
+The user and post tables of the tutorial. IF NOT EXISTS lets a database created by the old schema.sql, which has no
+schema_version table, be adopted as it is.
+"""
+
+SQLITE = (
+    'CREATE TABLE IF NOT EXISTS user ('
+    ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+    ' username TEXT UNIQUE NOT NULL,'
+    ' password TEXT NOT NULL'
+    ');'
+    'CREATE TABLE IF NOT EXISTS post ('
+    ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+    ' author_id INTEGER NOT NULL,'
+    ' created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,'
+    ' title TEXT NOT NULL,'
+    ' body TEXT NOT NULL,'
+    ' FOREIGN KEY (author_id) REFERENCES user (id)'
+    ');'
+)
+
+# "user" is quoted because USER is a reserved word in PostgreSQL.
+POSTGRES = (
+    'CREATE TABLE IF NOT EXISTS "user" ('
+    ' id SERIAL PRIMARY KEY,'
+    ' username TEXT UNIQUE NOT NULL,'
+    ' password TEXT NOT NULL'
+    ');'
+    'CREATE TABLE IF NOT EXISTS post ('
+    ' id SERIAL PRIMARY KEY,'
+    ' author_id INTEGER NOT NULL REFERENCES "user" (id),'
+    ' created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,'
+    ' title TEXT NOT NULL,'
+    ' body TEXT NOT NULL'
+    ');'
+)
+
+
+def upgrade(m):
+    m.db.executescript(POSTGRES if m.postgres else SQLITE)
+
+
+def downgrade(m):
+    m.db.executescript('DROP TABLE IF EXISTS post; DROP TABLE IF EXISTS "user";')
@@ -0,0 +1,12 @@
+"""
+Serves the keyset-paginated blog index: ORDER BY created DESC, id DESC and (created, id) < (?, ?) are both answered by
+a range scan of this index instead of sorting the whole post table.
+"""
+
+
+def upgrade(m):
+    m.create_index('post_created_id', 'post', ('created', 'id'))
+
+
+def downgrade(m):
+    m.drop_index('post_created_id')
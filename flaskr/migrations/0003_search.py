@@ -0,0 +1,42 @@
+"""
+The full-text index behind /search.
+
+SQLite gets the FTS5 table and triggers of search.sql, filled from the existing posts if it is new. PostgreSQL gets a
+generated tsvector column and a GIN index on it. Adding a generated column rewrites the post table under a lock that
+blocks its readers, so on a large PostgreSQL database run this one at a quiet time.
+"""
+
+SEARCH_COLUMN = (
+    "TSVECTOR GENERATED ALWAYS AS ("
+    " setweight(to_tsvector('english', title), 'A') || setweight(to_tsvector('english', body), 'B')"
+    ") STORED"
+)
+
+
+def upgrade(m):
+    if m.postgres:
+        # The column can never get out of step with title and body, so unlike FTS5 it needs no triggers.
+        m.add_column('post', 'search', SEARCH_COLUMN)
+        m.create_index('post_search', 'post', ('search',), using='GIN')
+        return
+
+    new = not m.table_exists('post_fts')
+    m.script('search.sql')
+
+    if new:
+        # 'rebuild' is an FTS5 command that indexes every row of the content table, the post table here.
+        m.execute("INSERT INTO post_fts (post_fts) VALUES ('rebuild')")
+
+
+def downgrade(m):
+    if m.postgres:
+        m.drop_index('post_search')
+        m.drop_column('post', 'search')
+        return
+
+    m.db.executescript(
+        'DROP TRIGGER IF EXISTS post_fts_insert;'
+        'DROP TRIGGER IF EXISTS post_fts_delete;'
+        'DROP TRIGGER IF EXISTS post_fts_update;'
+        'DROP TABLE IF EXISTS post_fts;'
+    )
@@ -0,0 +1,82 @@
+"""
+The denormalized author columns behind the per-author views: post.author_name, a copy of the author's username, and
+user.post_count. The triggers go in before the backfill, so posts written while it runs are already kept up to date,
+and the indexes before the post_count backfill, which counts each user's posts on post_author_created_id.
+"""
+
+# The PostgreSQL version of the triggers in authors.sql. A BEFORE trigger can set author_name on the new row itself,
+# where SQLite has to UPDATE the row again after inserting it.
+POSTGRES_TRIGGERS = """
+CREATE OR REPLACE FUNCTION post_author_sync() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    NEW.author_name := (SELECT username FROM "user" WHERE id = NEW.author_id);
+    UPDATE "user" SET post_count = post_count + 1 WHERE id = NEW.author_id;
+  END IF;
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    UPDATE "user" SET post_count = post_count - 1 WHERE id = OLD.author_id;
+  END IF;
+  IF TG_OP = 'DELETE' THEN
+    RETURN OLD;
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION user_rename_sync() RETURNS trigger AS $$
+BEGIN
+  UPDATE post SET author_name = NEW.username WHERE author_id = NEW.id;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS post_author_insert ON post;
+DROP TRIGGER IF EXISTS post_author_update ON post;
+DROP TRIGGER IF EXISTS post_author_delete ON post;
+DROP TRIGGER IF EXISTS user_rename ON "user";
+
+CREATE TRIGGER post_author_insert BEFORE INSERT ON post FOR EACH ROW EXECUTE FUNCTION post_author_sync();
+CREATE TRIGGER post_author_update BEFORE UPDATE OF author_id ON post FOR EACH ROW EXECUTE FUNCTION post_author_sync();
+CREATE TRIGGER post_author_delete AFTER DELETE ON post FOR EACH ROW EXECUTE FUNCTION post_author_sync();
+CREATE TRIGGER user_rename AFTER UPDATE OF username ON "user" FOR EACH ROW EXECUTE FUNCTION user_rename_sync();
+"""
+
+
+def upgrade(m):
+    m.add_column('post', 'author_name', "TEXT NOT NULL DEFAULT ''")
+    m.add_column('user', 'post_count', 'INTEGER NOT NULL DEFAULT 0')
+
+    if m.postgres:
+        m.create_index('post_author_created_id', 'post', ('author_id', 'created', 'id'))
+        m.create_index('user_post_count', 'user', ('post_count', 'id'))
+        m.db.executescript(POSTGRES_TRIGGERS)
+    else:
+        # authors.sql creates the same two indexes, then the triggers.
+        m.script('authors.sql')
+
+    m.backfill('post', 'author_name = (SELECT username FROM "user" u WHERE u.id = post.author_id)')
+    m.backfill('user', 'post_count = (SELECT COUNT(*) FROM post p WHERE p.author_id = "user".id)')
+
+
+def downgrade(m):
+    if m.postgres:
+        m.db.executescript(
+            'DROP TRIGGER IF EXISTS post_author_insert ON post;'
+            'DROP TRIGGER IF EXISTS post_author_update ON post;'
+            'DROP TRIGGER IF EXISTS post_author_delete ON post;'
+            'DROP TRIGGER IF EXISTS user_rename ON "user";'
+            'DROP FUNCTION IF EXISTS post_author_sync();'
+            'DROP FUNCTION IF EXISTS user_rename_sync();'
+        )
+    else:
+        m.db.executescript(
+            'DROP TRIGGER IF EXISTS post_author_insert;'
+            'DROP TRIGGER IF EXISTS post_author_delete;'
+            'DROP TRIGGER IF EXISTS post_author_update;'
+            'DROP TRIGGER IF EXISTS user_rename;'
+        )
+
+    m.drop_index('post_author_created_id')
+    m.drop_index('user_post_count')
+    m.drop_column('post', 'author_name')
+    m.drop_column('user', 'post_count')
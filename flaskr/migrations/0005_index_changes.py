@@ -0,0 +1,31 @@
+"""
+The index_change table, a short log of the writes that change the blog index. Every process reads it before serving a
+cached index page, so a write in one worker drops the stale pages of all of them, see flaskr.cache. The index on
+created serves the deletion of the rows older than CHANGE_RETENTION.
+"""
+
+
+def upgrade(m):
+    if m.postgres:
+        m.execute(
+            'CREATE TABLE IF NOT EXISTS index_change ('
+            ' id BIGSERIAL PRIMARY KEY,'
+            ' post_id INTEGER,'
+            ' created DOUBLE PRECISION NOT NULL'
+            ')'
+        )
+    else:
+        # AUTOINCREMENT, so an id is never handed out again once its row has been deleted.
+        m.execute(
+            'CREATE TABLE IF NOT EXISTS index_change ('
+            ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+            ' post_id INTEGER,'
+            ' created REAL NOT NULL'
+            ')'
+        )
+
+    m.create_index('index_change_created', 'index_change', ('created',))
+
+
+def downgrade(m):
+    m.execute('DROP TABLE IF EXISTS index_change')
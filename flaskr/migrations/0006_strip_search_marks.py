@@ -0,0 +1,27 @@
+"""
+Removes the characters /search marks its matches with (see search.MARK_START) from the titles and bodies of existing
+posts. New posts are saved without them, and a post that still had them could put <mark> tags in the search results.
+Only the posts that contain them are rewritten, so the full-text index of the others is left alone. Nothing to undo.
+"""
+
+import time
+
+MARKS = {
+    'sqlite': ("replace(replace({0}, char(2), ''), char(3), '')", "instr({0}, char(2)) > 0 OR instr({0}, char(3)) > 0"),
+    'postgresql': ("translate({0}, chr(2) || chr(3), '')", "strpos({0}, chr(2)) > 0 OR strpos({0}, chr(3)) > 0"),
+}
+
+
+def upgrade(m):
+    strip, contains = MARKS[m.dialect]
+    m.backfill(
+        'post',
+        'title = {0}, body = {1}'.format(strip.format('title'), strip.format('body')),
+        '{0} OR {1}'.format(contains.format('title'), contains.format('body'))
+    )
+    # The cached index pages of the running workers may show the old text, see flaskr.cache.
+    m.execute('INSERT INTO index_change (post_id, created) VALUES (0, ?)', (time.time(),))
+
+
+def downgrade(m):
+    pass
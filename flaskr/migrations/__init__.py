@@ -0,0 +1,12 @@
+"""
+The schema migrations, applied in order by flaskr.migrate.
+
+Every module is named NNNN_description.py, where NNNN is its version, and defines:
+
+    upgrade(m)      changes the schema from the previous version to this one.
+    downgrade(m)    changes it back.
+
+m is a flaskr.migrate.Migrator. m.postgres tells the two databases apart where their SQL differs. To change the schema,
+add a module with the next number. Never edit one that has been released: databases that already applied it would
+not see the change.
+"""
@@ -0,0 +1,96 @@
+import functools
+import re
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+
+from flaskr.db import ConnectionPool
+
+"""
+The PostgreSQL backend, used when DATABASE is a postgresql:// URL. It needs psycopg2 (pip install flaskr[postgres]).
+
+PostgresConnection makes a psycopg2 connection look like the sqlite3.Connection the rest of flaskr was written for:
+execute() takes ? placeholders, rows can be read by column name or by position, and the connection can be used as a
+transaction context manager. So the blog and auth queries run unchanged on either backend, as long as they stick to SQL
+both understand (for example "user" has to be quoted, as USER is a reserved word in PostgreSQL).
+"""
+
+# A ? placeholder, skipping anything inside a '...' string or a "..." identifier.
+_PLACEHOLDER = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|\?")
+
+
+@functools.lru_cache(maxsize=512)
+def translate(sql):
+    """ Rewrites sqlite3's qmark placeholders to psycopg2's %s, escaping any literal % on the way. """
+    sql = sql.replace('%', '%%')
+    return _PLACEHOLDER.sub(lambda m: '%s' if m.group(0) == '?' else m.group(0), sql)
+
+
+class PostgresConnection(object):
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def cursor(self, name=None):
+        return self.connection.cursor(name=name, cursor_factory=psycopg2.extras.DictCursor)
+
+    def execute(self, sql, parameters=()):
+        cursor = self.cursor()
+        cursor.execute(translate(sql), tuple(parameters))
+        return cursor
+
+    def executemany(self, sql, seq_of_parameters):
+        # execute_batch() sends many rows per round trip, where psycopg2's executemany() sends one.
+        cursor = self.cursor()
+        psycopg2.extras.execute_batch(cursor, translate(sql), seq_of_parameters, page_size=1000)
+        return cursor
+
+    def executescript(self, sql):
+        cursor = self.cursor()
+        cursor.execute(sql)
+        self.connection.commit()
+        return cursor
+
+    def stream(self, sql, parameters=(), size=1000):
+        """
+        Iterates over the rows of a query with a server side cursor, `size` rows per round trip. A plain psycopg2
+        cursor reads the whole result into memory before returning the first row.
+        """
+        cursor = self.cursor(name='flaskr_stream')
+        cursor.itersize = size
+        cursor.execute(translate(sql), tuple(parameters))
+        return cursor
+
+    @property
+    def in_transaction(self):
+        return self.connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Same as sqlite3: commit if the block succeeded, roll back if it raised.
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+
+class PostgresPool(ConnectionPool):
+    """ The same pool as for SQLite, opening psycopg2 connections instead. DATABASE_PRAGMAS do not apply. """
+
+    dialect = 'postgresql'
+
+    def connect(self):
+        return PostgresConnection(psycopg2.connect(self.database))
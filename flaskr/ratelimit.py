@@ -0,0 +1,242 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from flask import request, session
+from werkzeug.exceptions import TooManyRequests
+from werkzeug.utils import import_string
+
+"""
+Per client rate limits, so one client flooding /auth/login (every attempt is a slow password hash) or /create (every
+post takes the write lock) cannot slow the site down for everyone else.
+
+Every request whose endpoint has a budget takes one token from two token buckets: one for the client's IP address and,
+when someone is logged in, one for their user id. A bucket holds up to `limit` tokens and refills at `limit` per
+`period` seconds, so a client can burst up to `limit` requests and then sustain `limit` per `period`. A request that
+finds a bucket empty is answered 429 Too Many Requests, with a Retry-After header saying when the next token arrives.
+It takes no token from the other bucket either, so a user over their own budget does not use up the budget of the
+address they share with others.
+
+    RATELIMIT_ENABLED       turns the limiter on.
+    RATELIMIT_BUDGETS       maps 'METHOD endpoint' or 'endpoint' to (limit, period in seconds).
+    RATELIMIT_DEFAULT       (limit, period) for each endpoint without a budget, or None to leave them unlimited.
+    RATELIMIT_STORE         where buckets are kept: 'memory', 'sqlite', or 'package.module:factory', a callable that
+                            takes the app and returns an object with consume(keys, limit, period, now) and stats()
+                            like the stores below.
+    RATELIMIT_STORE_SIZE    buckets the memory store keeps before it evicts the least recently used.
+    RATELIMIT_STORE_PATH    the SQLite store's file, by default ratelimit.sqlite in the instance folder.
+
+The memory store is per process, so with N workers a client can get up to N times its budget. The SQLite store is
+shared by every worker on the host (and every container sharing the instance volume), at the cost of a small write
+per limited request. It is a separate file, so limiting never waits on the blog's write lock.
+
+The client address is request.remote_addr. Behind a reverse proxy that is the proxy, so set TRUSTED_PROXIES to see
+the real client.
+"""
+
+
+def take(tokens, updated, now, limit, period):
+    """
+    The token bucket itself. Given the bucket's tokens at time `updated` (None for a new, full bucket), refills it up
+    to `now` and tries to take one token. Returns the tokens left and how many seconds to wait, 0 if it was taken.
+    """
+    rate = limit / float(period)
+    tokens = limit if tokens is None else min(limit, tokens + (now - updated) * rate)
+
+    if tokens >= 1:
+        return tokens - 1, 0.0
+
+    return tokens, (1 - tokens) / rate
+
+
+def take_all(buckets, now, limit, period):
+    """
+    Takes one token from each of `buckets`, a list of (tokens, updated) as take() expects them, but only if every one
+    of them has a token to give. Returns the tokens each bucket has left and the longest wait, 0 if they were taken.
+    """
+    results = [take(tokens, updated, now, limit, period) for tokens, updated in buckets]
+    wait = max(wait for _, wait in results)
+
+    if wait:
+        # Rejected: the buckets that had a token get it back, keeping only their refill.
+        return [tokens + 1 if not bucket_wait else tokens for tokens, bucket_wait in results], wait
+
+    return [tokens for tokens, _ in results], 0.0
+
+
+class MemoryStore(object):
+    """
+    Buckets in a dict bounded to `maxsize` entries, evicting the least recently used. An evicted bucket comes back
+    full, which only ever favours the client, and the clients evicted first are the ones that have been quiet longest.
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    @classmethod
+    def from_app(cls, app):
+        return cls(app.config['RATELIMIT_STORE_SIZE'])
+
+    def consume(self, keys, limit, period, now):
+        """ Takes a token from the bucket of every key, or from none of them, see take_all(). Returns the wait. """
+        with self._lock:
+            buckets = [self._buckets.pop(key, (None, None)) for key in keys]
+            left, wait = take_all(buckets, now, limit, period)
+
+            for key, tokens in zip(keys, left):
+                self._buckets[key] = (tokens, now)
+
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+                self.evictions += 1
+
+        return wait
+
+    def stats(self):
+        return {'buckets': len(self._buckets), 'maxsize': self.maxsize, 'evictions': self.evictions}
+
+
+class SQLiteStore(object):
+    """
+    Buckets in a SQLite file, shared by every process that opens it. Each consume() reads and writes its buckets in one
+    IMMEDIATE transaction, so two workers cannot both take the last token.
+    """
+
+    # Buckets untouched for this long are full again whatever their budget was, so they can be deleted.
+    EXPIRE_AFTER = 24 * 60 * 60
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+
+    @classmethod
+    def from_app(cls, app):
+        return cls(app.config['RATELIMIT_STORE_PATH'] or os.path.join(app.instance_path, 'ratelimit.sqlite'))
+
+    def _connection(self):
+        # One connection per thread, opened on first use. isolation_level=None leaves transactions to consume().
+        db = getattr(self._local, 'db', None)
+
+        if db is None or self._local.pid != os.getpid():
+            db = self._local.db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self._local.pid = os.getpid()
+            # Losing the last few updates in a power cut only refills some buckets early, no need to sync every write.
+            db.execute('PRAGMA journal_mode = WAL')
+            db.execute('PRAGMA synchronous = OFF')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS rate_limit ('
+                ' key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL'
+                ')'
+            )
+
+        return db
+
+    def consume(self, keys, limit, period, now):
+        db = self._connection()
+        db.execute('BEGIN IMMEDIATE')
+
+        try:
+            buckets = []
+
+            for key in keys:
+                row = db.execute('SELECT tokens, updated FROM rate_limit WHERE key = ?', (key,)).fetchone()
+                buckets.append(tuple(row) if row else (None, None))
+
+            left, wait = take_all(buckets, now, limit, period)
+            db.executemany(
+                'INSERT INTO rate_limit (key, tokens, updated) VALUES (?, ?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated',
+                [(key, tokens, now) for key, tokens in zip(keys, left)]
+            )
+
+            # Every so often, clear out the buckets nobody has used for a day.
+            self._writes += 1
+            if self._writes % 1000 == 0:
+                db.execute('DELETE FROM rate_limit WHERE updated < ?', (now - self.EXPIRE_AFTER,))
+
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+
+        return wait
+
+    def stats(self):
+        return {'buckets': self._connection().execute('SELECT COUNT(*) FROM rate_limit').fetchone()[0]}
+
+
+STORES = {
+    'memory': MemoryStore.from_app,
+    'sqlite': SQLiteStore.from_app,
+}
+
+
+class RateLimiter(object):
+
+    def __init__(self, app):
+        self.budgets = app.config['RATELIMIT_BUDGETS']
+        self.default = app.config['RATELIMIT_DEFAULT']
+        factory = app.config['RATELIMIT_STORE']
+        self.store = STORES[factory](app) if factory in STORES else import_string(factory)(app)
+        self._lock = threading.Lock()
+        self.allowed = Counter()
+        self.rejected = Counter()
+
+    def budget(self, method, endpoint):
+        """ Returns (name, limit, period) of the budget that applies to a request, or None if it is not limited. """
+        for name in ('{0} {1}'.format(method, endpoint), endpoint):
+            if name in self.budgets:
+                return (name,) + tuple(self.budgets[name])
+
+        if self.default is not None:
+            return (endpoint,) + tuple(self.default)
+
+        return None
+
+    def check(self):
+        # Health checks come from the load balancer's address every few seconds and must never be turned away.
+        if request.endpoint in (None, 'static', 'healthz', 'readyz'):
+            return
+
+        budget = self.budget(request.method, request.endpoint)
+
+        if budget is None:
+            return
+
+        name, limit, period = budget
+        now = time.time()
+        # session['user_id'] rather than g.user, which would load the user from the database first.
+        clients = ['ip:{0}'.format(request.remote_addr)]
+
+        if session.get('user_id') is not None:
+            clients.append('user:{0}'.format(session['user_id']))
+
+        wait = self.store.consume(['{0}:{1}'.format(client, name) for client in clients], limit, period, now)
+
+        with self._lock:
+            (self.rejected if wait else self.allowed)[name] += 1
+
+        if wait:
+            raise TooManyRequests(retry_after=int(math.ceil(wait)))
+
+    def stats(self):
+        with self._lock:
+            stats = {'allowed': dict(self.allowed), 'rejected': dict(self.rejected)}
+
+        stats['store'] = self.store.stats()
+        return stats
+
+
+def init_app(app):
+    if not app.config['RATELIMIT_ENABLED']:
+        return
+
+    limiter = app.extensions['flaskr.ratelimit'] = RateLimiter(app)
+    app.before_request(limiter.check)
@@ -0,0 +1,121 @@
+import click
+from flask import Blueprint, current_app, render_template, request
+from flask.cli import with_appcontext
+from markupsafe import Markup, escape
+
+from flaskr.db import get_db, get_pool
+
+bp = Blueprint('search', __name__)
+
+# snippet() and highlight() wrap every matched term in these markers. Any request can send them in a post, so they are
+# removed from titles and bodies before they are saved (strip_marks below, and migration 0006 for older posts). Every
+# marker in a result is then one of ours, and once the text has been HTML escaped they are swapped for <mark> tags.
+MARK_START = '\x02'
+MARK_END = '\x03'
+
+
+def match_expression(query):
+    """
+    Turns what the user typed into an FTS5 MATCH expression. Every word is quoted as a string, so characters that
+    mean something to FTS5 (AND, OR, NEAR, *, :, ...) are searched for literally instead of raising a syntax error.
+    Words are implicitly ANDed.
+    """
+    return ' '.join('"{0}"'.format(term.replace('"', '""')) for term in query.split())
+
+
+def strip_marks(text):
+    """ Removes the match markers from the title or body of a post about to be saved. """
+    if text is None:
+        return None
+
+    return text.replace(MARK_START, '').replace(MARK_END, '')
+
+
+def highlight(text):
+    """ Escapes a snippet and turns the match markers into <mark> tags. """
+    text = str(escape(text))
+    return Markup(text.replace(MARK_START, '<mark>').replace(MARK_END, '</mark>'))
+
+
+# PostgreSQL has no FTS5, it searches the generated post.search tsvector column instead, see migration 0003_search.
+POSTGRES_SEARCH = (
+    'SELECT p.id, p.created, p.author_id, u.username, '
+    ' ts_headline(\'english\', p.title, q, ?) AS title, '
+    ' ts_headline(\'english\', p.body, q, ?) AS snippet '
+    'FROM post p JOIN "user" u ON p.author_id = u.id, plainto_tsquery(\'english\', ?) q '
+    'WHERE p.search @@ q '
+    'ORDER BY ts_rank(p.search, q) DESC, p.id DESC '
+    'LIMIT ? OFFSET ?'
+)
+
+
+def search_posts(query, page=1, per_page=20):
+    """
+    Returns one page of the posts matching query, best match first. `rank` is FTS5's built-in bm25() score, and
+    the MATCH is answered from the full-text index, so the cost depends on how many posts match, not on how many
+    posts there are. One extra row is fetched to know whether there is a next page.
+    """
+    limit, offset = per_page + 1, (page - 1) * per_page
+
+    if get_pool().dialect == 'postgresql':
+        marks = 'StartSel={0}, StopSel={1}'.format(MARK_START, MARK_END)
+        posts = get_db().execute(POSTGRES_SEARCH, (
+            marks + ', HighlightAll=true', marks + ', MaxWords=32, MinWords=16', query, limit, offset
+        )).fetchall()
+        return posts[:per_page], len(posts) > per_page
+
+    posts = get_db().execute(
+        'SELECT p.id, p.created, p.author_id, u.username, '
+        ' highlight(post_fts, 0, ?, ?) AS title, '
+        " snippet(post_fts, 1, ?, ?, '…', 32) AS snippet "
+        'FROM post_fts JOIN post p ON p.id = post_fts.rowid JOIN "user" u ON p.author_id = u.id '
+        'WHERE post_fts MATCH ? '
+        'ORDER BY rank '
+        'LIMIT ? OFFSET ?',
+        (MARK_START, MARK_END, MARK_START, MARK_END, match_expression(query), limit, offset)
+    ).fetchall()
+
+    return posts[:per_page], len(posts) > per_page
+
+
+@bp.route('/search')
+def search():
+    query = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
+
+    if page < 1:
+        page = 1
+
+    posts, has_next = [], False
+
+    if query:
+        posts, has_next = search_posts(query, page, current_app.config['SEARCH_RESULTS_PER_PAGE'])
+
+    return render_template(
+        'search/results.html', query=query, posts=posts, page=page, has_next=has_next, highlight=highlight
+    )
+
+
+def rebuild_index():
+    """ Creates the full-text index and its triggers if they are missing, then re-indexes every post. """
+    if get_pool().dialect == 'postgresql':
+        # The tsvector column is generated by PostgreSQL itself and is always up to date.
+        return
+
+    db = get_db()
+
+    with current_app.open_resource('search.sql') as f:
+        db.executescript(f.read().decode('utf8'))
+
+    # 'rebuild' is an FTS5 command that discards the index and rebuilds it from the post table.
+    db.execute("INSERT INTO post_fts (post_fts) VALUES ('rebuild')")
+    db.commit()
+
+
+# Blueprint commands are grouped under the blueprint name, so this is `flask search rebuild`.
+@bp.cli.command('rebuild')
+@with_appcontext
+def rebuild_index_command():
+    """Create the full-text search index if needed and re-index all posts."""
+    rebuild_index()
+    click.echo('Rebuilt the search index.')
@@ -0,0 +1,25 @@
+-- Full-text index over post.title and post.body, used by the /search view.
+--
+-- post_fts is an external content FTS5 table: it stores only the index and reads the text from the post table, so the
+-- post bodies are not stored twice. The triggers below keep it in step with every INSERT, UPDATE and DELETE on post.
+-- Run by migration 0003_search. Everything uses IF NOT EXISTS, so `flask search rebuild` can run it again too.
+
+CREATE VIRTUAL TABLE IF NOT EXISTS post_fts USING fts5(
+  title,
+  body,
+  content='post',
+  content_rowid='id'
+);
+
+CREATE TRIGGER IF NOT EXISTS post_fts_insert AFTER INSERT ON post BEGIN
+  INSERT INTO post_fts (rowid, title, body) VALUES (new.id, new.title, new.body);
+END;
+
+CREATE TRIGGER IF NOT EXISTS post_fts_delete AFTER DELETE ON post BEGIN
+  INSERT INTO post_fts (post_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+END;
+
+CREATE TRIGGER IF NOT EXISTS post_fts_update AFTER UPDATE OF title, body ON post BEGIN
+  INSERT INTO post_fts (post_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+  INSERT INTO post_fts (rowid, title, body) VALUES (new.id, new.title, new.body);
+END;
@@ -0,0 +1,305 @@
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+"""
+Optional server side sessions, turned on with SESSION_STORE = 'sqlite'.
+
+By default Flask keeps the whole session in a signed cookie. That cannot be taken back: a stolen or forgotten cookie
+stays valid until it expires, and there is no way to see or limit how many sessions a user has. With the server side
+store the cookie only carries a random session id, and the session itself is a row in sessions.sqlite in the instance
+folder, next to a copy of the user's row. `session` works exactly as before, and the views never notice the difference.
+
+    SESSION_STORE               None for Flask's signed cookie sessions, 'sqlite' for the store below.
+    SESSION_STORE_PATH          the store's file, by default sessions.sqlite in the instance folder.
+    SESSION_MAX_PER_USER        sessions a user may have at once. Logging in once more ends the oldest one.
+    SESSION_SWEEP_INTERVAL      seconds between deletions of expired sessions, done by whichever request comes next.
+
+Sessions expire PERMANENT_SESSION_LIFETIME after they were last saved. To avoid a write on every request, a session
+that did not change is only saved again once less than half of its lifetime is left.
+
+The store is a separate file from the blog database, so reading and saving sessions never waits on its write lock, and
+it is opened with mmap_size set so lookups are served straight from the memory mapped file.
+"""
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS session ('
+    ' id TEXT PRIMARY KEY,'
+    ' user_id INTEGER,'
+    ' data TEXT NOT NULL,'
+    ' user TEXT,'
+    ' created REAL NOT NULL,'
+    ' expires REAL NOT NULL'
+    ');'
+    'CREATE INDEX IF NOT EXISTS session_user ON session (user_id, created);'
+    'CREATE INDEX IF NOT EXISTS session_expires ON session (expires);'
+)
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """
+    The session of one request. Besides its data it carries its id in the store and `user`, the cached row of the
+    logged in user (see auth.load_logged_in_user), or None when it has not been cached yet.
+    """
+
+    def __init__(self, initial=None, sid=None, user=None, expires=None):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+
+        super(ServerSession, self).__init__(initial, on_update)
+        self.sid = sid
+        self.user = user
+        self.expires = expires
+        self.loaded_user_id = self.get('user_id')
+        self.modified = False
+        self.accessed = False
+
+    def __getitem__(self, key):
+        self.accessed = True
+        return super(ServerSession, self).__getitem__(key)
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return super(ServerSession, self).get(key, default)
+
+    def cache_user(self, user):
+        """ Keeps a copy of the user's row with the session, saved at the end of the request. """
+        self.user = user
+        self.modified = True
+
+
+class SessionStore(object):
+
+    def __init__(self, path, max_per_user, sweep_interval):
+        self.path = path
+        self.max_per_user = max_per_user
+        self.sweep_interval = sweep_interval
+        self.serializer = TaggedJSONSerializer()
+        self._local = threading.local()
+        self._next_sweep = 0
+
+    def _connection(self):
+        # One connection per thread and process, opened on first use. `with db:` commits its statements together.
+        db = getattr(self._local, 'db', None)
+
+        if db is None or self._local.pid != os.getpid():
+            db = self._local.db = sqlite3.connect(self.path, timeout=5)
+            self._local.pid = os.getpid()
+            db.execute('PRAGMA journal_mode = WAL')
+            db.execute('PRAGMA synchronous = NORMAL')
+            db.execute('PRAGMA mmap_size = {0}'.format(64 * 1024 * 1024))
+            db.executescript(SCHEMA)
+
+        return db
+
+    def load(self, sid, now):
+        row = self._connection().execute(
+            'SELECT data, user, expires FROM session WHERE id = ? AND expires > ?', (sid, now)
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        user = json.loads(row[1]) if row[1] is not None else None
+        return ServerSession(self.serializer.loads(row[0]), sid=sid, user=user, expires=row[2])
+
+    def save(self, session, expires, now):
+        """
+        Writes the session and returns its id. A session whose user changed (someone logged in or out) gets a new id,
+        so an id seen before the login is worth nothing after it.
+
+        Returns None when the session's row is gone: it was revoked or ended by SESSION_MAX_PER_USER while the request
+        was running, and saving it must not bring it back.
+        """
+        db = self._connection()
+        user_id = session.get('user_id')
+        new_sid = session.sid is None or user_id != session.loaded_user_id
+        sid = secrets.token_urlsafe(32) if new_sid else session.sid
+        user = json.dumps(session.user) if session.user is not None and session.user['id'] == user_id else None
+        data = self.serializer.dumps(dict(session))
+
+        with db:
+            if not new_sid:
+                updated = db.execute(
+                    'UPDATE session SET data = ?, user = ?, expires = ? WHERE id = ?', (data, user, expires, sid)
+                ).rowcount
+
+                if not updated:
+                    return None
+            else:
+                if session.sid is not None:
+                    db.execute('DELETE FROM session WHERE id = ?', (session.sid,))
+
+                db.execute(
+                    'INSERT INTO session (id, user_id, data, user, created, expires) VALUES (?, ?, ?, ?, ?, ?)',
+                    (sid, user_id, data, user, now, expires)
+                )
+
+            if new_sid and user_id is not None and self.max_per_user:
+                # Only the newest SESSION_MAX_PER_USER sessions of the user survive, found on the session_user index.
+                db.execute(
+                    'DELETE FROM session WHERE user_id = ? AND id NOT IN ('
+                    ' SELECT id FROM session WHERE user_id = ? ORDER BY created DESC LIMIT ?'
+                    ')',
+                    (user_id, user_id, self.max_per_user)
+                )
+
+        session.sid, session.loaded_user_id = sid, user_id
+        self.maybe_sweep(now)
+        return sid
+
+    def delete(self, sid):
+        with self._connection() as db:
+            db.execute('DELETE FROM session WHERE id = ?', (sid,))
+
+    def revoke_user(self, user_id, keep=None):
+        """ Ends every session of a user, except the one with id `keep`. Returns how many were ended. """
+        with self._connection() as db:
+            return db.execute(
+                'DELETE FROM session WHERE user_id = ? AND id IS NOT ?', (user_id, keep)
+            ).rowcount
+
+    def forget_user(self, user_id=None):
+        """ Drops the cached copies of a user's row (of every user's if user_id is None), so sessions read it again. """
+        with self._connection() as db:
+            if user_id is None:
+                db.execute('UPDATE session SET user = NULL WHERE user IS NOT NULL')
+            else:
+                db.execute('UPDATE session SET user = NULL WHERE user_id = ?', (user_id,))
+
+    def sweep(self, now=None):
+        """ Deletes the expired sessions and returns how many there were. """
+        with self._connection() as db:
+            return db.execute('DELETE FROM session WHERE expires <= ?', (now or time.time(),)).rowcount
+
+    def maybe_sweep(self, now):
+        if now >= self._next_sweep:
+            self._next_sweep = now + self.sweep_interval
+            self.sweep(now)
+
+    def count(self, user_id=None):
+        if user_id is None:
+            return self._connection().execute('SELECT COUNT(*) FROM session').fetchone()[0]
+
+        return self._connection().execute('SELECT COUNT(*) FROM session WHERE user_id = ?', (user_id,)).fetchone()[0]
+
+
+class ServerSessionInterface(SessionInterface):
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+
+        if sid:
+            session = self.store.load(sid, time.time())
+            if session is not None:
+                return session
+
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            # An emptied session (logout) is deleted from the store and its cookie cleared.
+            if session.sid is not None:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        now = time.time()
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        stale = session.expires is None or session.expires - now < lifetime / 2
+
+        if not session.modified and not stale:
+            return
+
+        sid = self.store.save(session, now + lifetime, now)
+
+        if sid is None:
+            # Revoked while the request ran: the browser's cookie is cleared and the session stays ended.
+            response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        response.set_cookie(
+            name, sid, expires=self.get_expiration_time(app, session), httponly=self.get_cookie_httponly(app),
+            domain=domain, path=path, secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app)
+        )
+
+
+def get_store(app=None):
+    """ Returns the app's SessionStore, or None when sessions are kept in cookies. """
+    app = app or current_app._get_current_object()
+    return app.extensions.get('flaskr.sessions')
+
+
+@click.group('sessions')
+def sessions_cli():
+    """Inspect and end server side sessions."""
+
+
+@sessions_cli.command('revoke')
+@click.argument('username')
+@with_appcontext
+def revoke_command(username):
+    """End every session of a user."""
+    from flaskr.db import get_db
+
+    store = get_store()
+
+    if store is None:
+        raise click.ClickException('SESSION_STORE is not set, sessions are kept in cookies.')
+
+    user = get_db().execute('SELECT id FROM "user" WHERE username = ?', (username,)).fetchone()
+
+    if user is None:
+        raise click.ClickException('No user called {0}.'.format(username))
+
+    click.echo('Ended {0} session(s) of {1}.'.format(store.revoke_user(user['id']), username))
+
+
+@sessions_cli.command('sweep')
+@with_appcontext
+def sweep_command():
+    """Delete expired sessions."""
+    store = get_store()
+
+    if store is None:
+        raise click.ClickException('SESSION_STORE is not set, sessions are kept in cookies.')
+
+    click.echo('Deleted {0} expired session(s), {1} left.'.format(store.sweep(), store.count()))
+
+
+def init_app(app):
+    app.cli.add_command(sessions_cli)
+
+    if app.config['SESSION_STORE'] is None:
+        return
+
+    if app.config['SESSION_STORE'] != 'sqlite':
+        raise ValueError('Unknown SESSION_STORE {0!r}.'.format(app.config['SESSION_STORE']))
+
+    store = app.extensions['flaskr.sessions'] = SessionStore(
+        app.config['SESSION_STORE_PATH'] or os.path.join(app.instance_path, 'sessions.sqlite'),
+        app.config['SESSION_MAX_PER_USER'],
+        app.config['SESSION_SWEEP_INTERVAL'],
+    )
+    app.session_interface = ServerSessionInterface(store)
@@ -0,0 +1,60 @@
+import os
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from jinja2 import FileSystemBytecodeCache
+
+"""
+Jinja compiles every template to Python code the first time it is rendered in a process. With many worker processes
+and frequent deploys that work is repeated by every worker and shows up as slow first requests.
+
+    TEMPLATE_BYTECODE_CACHE     stores the compiled templates on disk, in TEMPLATE_CACHE_DIR (instance_path/jinja_cache
+                                by default). All workers share it, so a template is compiled once per deploy instead of
+                                once per process. Jinja writes the files atomically and keys them by a checksum of the
+                                source, so a changed template is simply compiled again.
+    TEMPLATE_PRELOAD            loads every template while the app is created, before the first request arrives.
+
+`flask build-templates` fills the cache ahead of time, for example while building the Docker image.
+"""
+
+
+def get_cache_dir(app):
+    return app.config['TEMPLATE_CACHE_DIR'] or os.path.join(app.instance_path, 'jinja_cache')
+
+
+def init_app(app):
+    if app.config['TEMPLATE_BYTECODE_CACHE']:
+        directory = get_cache_dir(app)
+        os.makedirs(directory, exist_ok=True)
+        # jinja_options is read when app.jinja_env is first created, so this has to happen before any template use.
+        app.jinja_options = dict(app.jinja_options, bytecode_cache=FileSystemBytecodeCache(directory))
+
+    app.cli.add_command(build_templates_command)
+
+
+def preload_templates(app):
+    """ Loads (compiling, or reading from the bytecode cache) every template the app can find. Returns their names. """
+    names = app.jinja_env.list_templates()
+
+    for name in names:
+        app.jinja_env.get_template(name)
+
+    return names
+
+
+@click.command('build-templates')
+@with_appcontext
+def build_templates_command():
+    """Compile every template into the bytecode cache."""
+    app = current_app._get_current_object()
+
+    if not app.config['TEMPLATE_BYTECODE_CACHE']:
+        raise click.ClickException('TEMPLATE_BYTECODE_CACHE is off, there is no cache to build.')
+
+    start = time.monotonic()
+    names = preload_templates(app)
+    click.echo('Compiled {0} templates into {1} in {2:.2f}s.'.format(
+        len(names), get_cache_dir(app), time.monotonic() - start
+    ))
@@ -0,0 +1,245 @@
+import atexit
+import collections
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+from flask import current_app
+from werkzeug.exceptions import ServiceUnavailable
+
+from flaskr.db import get_db, get_pool
+from flaskr.instrument import phase
+
+"""
+Group commit for the blog's writes, turned on with WRITE_BEHIND = True.
+
+Without it every create, update and delete runs its statement and commits on the request thread. Each commit is a
+sync to disk, and with several requests writing at once they queue for SQLite's single write lock, each waiting for
+the previous one's sync, until busy_timeout runs out and they fail with "database is locked".
+
+With it, requests hand their statements to one writer thread per process and wait. The writer takes whatever is
+queued, up to WRITE_BATCH_SIZE jobs or whatever arrives within WRITE_BATCH_DELAY_MS of the first one, runs them in
+one transaction and commits once, so one sync covers the whole batch. Only then is each waiting request told its
+result, so a request that got a redirect knows its post is on disk. The writer's connection uses synchronous = FULL
+for that reason, where the pooled connections make do with NORMAL.
+
+Every job runs inside its own SAVEPOINT: a job that fails is rolled back on its own and its error is raised on its
+request thread, the rest of the batch still commits.
+
+    WRITE_BEHIND            send create, update and delete through the writer thread.
+    WRITE_BATCH_SIZE        most jobs committed in one transaction.
+    WRITE_BATCH_DELAY_MS    how long the writer waits for more jobs after the first one of a batch.
+    WRITE_TIMEOUT           seconds a request waits for its job to start before it gives up with a 503.
+"""
+
+log = logging.getLogger(__name__)
+
+WriteResult = collections.namedtuple('WriteResult', 'lastrowid rowcount')
+
+
+class WriterBusy(ServiceUnavailable):
+    description = 'The server is busy saving other changes. Please try again shortly.'
+
+
+class GroupCommitWriter(object):
+
+    def __init__(self, pool, batch_size, batch_delay_ms, timeout):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay_ms / 1000.0
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='flaskr-writer', daemon=True)
+        self._thread.start()
+        self.jobs = self.batches = self.failed = self.timeouts = 0
+
+    def submit(self, statements):
+        """
+        Queues a job, a list of (sql, parameters) run in order, and waits until the batch it went out in has been
+        committed. Returns the WriteResult of the last statement, or raises what the job raised.
+        """
+        future = Future()
+        self._queue.put((statements, future))
+
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            # cancel() only succeeds if the writer has not picked the job up yet, in which case it never will and the
+            # request can safely fail. Otherwise the job is being committed right now, and its outcome is waited for.
+            if future.cancel():
+                self.timeouts += 1
+                raise WriterBusy(retry_after=int(self.timeout) or 1)
+            return future.result()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.batch_delay
+
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    @property
+    def alive(self):
+        return self._thread.is_alive()
+
+    def _connect(self):
+        db = self.pool.connect()
+
+        if self.pool.dialect == 'sqlite':
+            db.execute('PRAGMA synchronous = FULL')
+
+        return db
+
+    def _run(self):
+        db = None
+
+        while True:
+            batch = self._next_batch()
+            # None is queued by shutdown(): commit what came before it, then stop.
+            stop = None in batch
+
+            # Jobs whose request already gave up are dropped here, see submit().
+            batch = [job for job in batch if job is not None and job[1].set_running_or_notify_cancel()]
+
+            if batch:
+                try:
+                    # Connected on first use, and again after a failure, so a database that was locked or
+                    # unreachable for a moment only fails the batch that ran into it and not every later one.
+                    if db is None:
+                        db = self._connect()
+                    self._process(db, batch)
+                except Exception as e:
+                    log.exception('Writer connection failed, reconnecting for the next batch')
+                    for _, future in batch:
+                        if not future.done():
+                            self.failed += 1
+                            future.set_exception(e)
+                    self._close(db)
+                    db = None
+
+            if stop:
+                self._close(db)
+                return
+
+    def _close(self, db):
+        if db is not None:
+            try:
+                db.close()
+            except Exception:
+                log.exception('Closing the writer connection failed')
+
+    def _process(self, db, batch):
+        try:
+            results = self._commit(db, batch)
+        except Exception as e:
+            log.exception('Group commit of %d writes failed', len(batch))
+            db.rollback()
+            self.failed += len(batch)
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.jobs += len(batch)
+
+        for (_, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                self.failed += 1
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def _commit(self, db, batch):
+        """ Runs every job of the batch in one transaction and returns a result or an exception per job. """
+        results = []
+
+        if self.pool.dialect == 'sqlite':
+            # Take the write lock up front, an implicit BEGIN would only take it at the first INSERT.
+            db.execute('BEGIN IMMEDIATE')
+
+        for statements, _ in batch:
+            db.execute('SAVEPOINT job')
+            try:
+                for sql, parameters in statements:
+                    cursor = db.execute(sql, parameters)
+            except Exception as e:
+                db.execute('ROLLBACK TO SAVEPOINT job')
+                db.execute('RELEASE SAVEPOINT job')
+                results.append(e)
+            else:
+                db.execute('RELEASE SAVEPOINT job')
+                results.append(WriteResult(cursor.lastrowid, cursor.rowcount))
+
+        db.commit()
+        return results
+
+    def shutdown(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def stats(self):
+        return {
+            'jobs': self.jobs,
+            'batches': self.batches,
+            'avg_batch': round(self.jobs / float(self.batches), 2) if self.batches else None,
+            'failed': self.failed,
+            'timeouts': self.timeouts,
+            'queued': self._queue.qsize(),
+        }
+
+
+_writer_lock = threading.Lock()
+
+
+def get_writer(app=None):
+    """
+    Returns the app's writer, starting it on first use. It is started lazily so a process that forks workers after
+    create_app() (gunicorn --preload) does not fork a copy of the thread, which would not survive the fork.
+    """
+    app = app or current_app._get_current_object()
+    writer = app.extensions.get('flaskr.writer')
+
+    if writer is None or not writer.alive:
+        with _writer_lock:
+            writer = app.extensions.get('flaskr.writer')
+            # A writer whose thread died would take every job and never run it, so it is replaced.
+            if writer is None or not writer.alive:
+                writer = app.extensions['flaskr.writer'] = GroupCommitWriter(
+                    get_pool(app),
+                    app.config['WRITE_BATCH_SIZE'],
+                    app.config['WRITE_BATCH_DELAY_MS'],
+                    app.config['WRITE_TIMEOUT'],
+                )
+                # Commit what is still queued when the process exits normally.
+                atexit.register(writer.shutdown)
+
+    return writer
+
+
+def write(sql, parameters=(), before=()):
+    """
+    Runs one INSERT, UPDATE or DELETE and commits it, through the writer thread when WRITE_BEHIND is on and on the
+    request's own connection otherwise. Returns a WriteResult either way.
+
+    `before` is a list of (sql, parameters) run first and committed in the same transaction, such as the record of
+    the change that cache.index_changed() returns.
+    """
+    statements = list(before) + [(sql, parameters)]
+
+    if not current_app.config['WRITE_BEHIND']:
+        db = get_db()
+        for sql, parameters in statements:
+            cursor = db.execute(sql, parameters)
+        db.commit()
+        return WriteResult(cursor.lastrowid, cursor.rowcount)
+
+    with phase('write'):
+        return get_writer().submit(statements)
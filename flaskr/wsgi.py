@@ -0,0 +1,33 @@
+"""
+WSGI entry point for pre-forking servers:
+
+    gunicorn --preload --workers 4 flaskr.wsgi:app
+    gunicorn                                        from the project folder, configured by gunicorn.conf.py
+
+With --preload the app is created once in the master process and the workers are forked from it, so they start with
+the modules imported, the app built and the templates compiled, and share those memory pages with the master instead
+of each building a private copy.
+
+Nothing in create_app opens a database connection or starts the password hashing pool; both are created lazily in
+each worker on first use, so no socket or process is shared across the fork.
+"""
+import gc
+
+from flaskr import create_app
+from flaskr.templating import preload_templates
+
+app = create_app()
+
+
+def preload(app):
+    """ Does the per-process warm up work once, before forking. """
+    preload_templates(app)
+
+    # Move everything allocated so far out of the garbage collector's reach. Otherwise the first collection in each
+    # worker writes to every object header, which copies the shared pages the fork was meant to save.
+    gc.collect()
+    gc.freeze()
+
+
+if app.config['WSGI_PRELOAD']:
+    preload(app)
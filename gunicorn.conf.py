@@ -0,0 +1,53 @@
+import os
+
+from flaskr import create_app
+
+"""
+gunicorn settings, read from the app's own config so the WSGI_* settings live with the others in create_app (and can
+be overridden in instance/config.py or with FLASK_WSGI_WORKERS=... like any other setting).
+
+gunicorn loads this file by itself when it is started from the project folder (pip install -e .[wsgi]):
+
+    gunicorn
+
+It starts WSGI_WORKERS processes of WSGI_THREADS threads each, listening on WSGI_BIND. With WSGI_PRELOAD on, the app
+is built once in the master process and the workers are forked from it, see flaskr.wsgi.
+
+Signals to the master process:
+
+    HUP     graceful reload: this file is read again, new workers are started with the new settings, and the old ones
+            finish the requests they are handling (for up to WSGI_GRACEFUL_TIMEOUT seconds) before they exit. No
+            request is dropped. With WSGI_PRELOAD off the new workers also build a new app, picking up a changed
+            instance/config.py; with it on they are forked from the app the master built at start.
+    TERM    graceful shutdown, what `docker stop` sends.
+    TTIN    one more worker, TTOU one fewer.
+"""
+
+# Not named `config`: gunicorn reads every name in this file that matches one of its settings, and that one does.
+settings = create_app().config
+
+wsgi_app = 'flaskr.wsgi:app'
+preload_app = settings['WSGI_PRELOAD']
+
+bind = settings['WSGI_BIND']
+workers = settings['WSGI_WORKERS']
+threads = settings['WSGI_THREADS']
+worker_class = 'gthread'
+
+# A worker that does not answer its heartbeat for this long is killed and replaced.
+timeout = settings['WSGI_TIMEOUT']
+graceful_timeout = settings['WSGI_GRACEFUL_TIMEOUT']
+keepalive = settings['WSGI_KEEP_ALIVE']
+
+# Replace a worker after this many requests (0 never does), spread out so they do not all restart at once.
+max_requests = settings['WSGI_MAX_REQUESTS']
+max_requests_jitter = max_requests // 10
+
+# The heartbeat file is written by every worker every second. In a container /tmp may be on the overlay filesystem,
+# where that write can block, /dev/shm is always in memory.
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+accesslog = '-'
+errorlog = '-'
+loglevel = settings['LOG_LEVEL'].lower()
@@ -3,12 +3,18 @@ from setuptools import find_packages, setup
 setup(
     name='flaskr',
     version='1.0.0',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     include_package_data=True,
     zip_safe=False,
     install_requires=[
-        'flask',
+        'flask>=2.2',
     ],
+    extras_require={
+        'postgres': ['psycopg2-binary'],
+        'asgi': ['a2wsgi', 'uvicorn[standard]'],
+        'static': ['brotli'],
+        'wsgi': ['gunicorn'],
+    },
 )
 
 # packages:
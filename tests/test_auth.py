@@ -0,0 +1,67 @@
+import json
+
+from flask import g, session
+
+from flaskr.auth import get_user
+from flaskr.cache import get_user_cache
+from flaskr.db import get_db, init_db
+
+
+def test_register(client, app):
+    assert client.get('/auth/register').status_code == 200
+    response = client.post('/auth/register', data={'username': 'a', 'password': 'a'})
+    assert response.headers['Location'].endswith('/auth/login')
+
+    with app.app_context():
+        assert get_db().execute('SELECT * FROM "user" WHERE username = ?', ('a',)).fetchone() is not None
+
+
+def test_login(client, auth):
+    assert client.get('/auth/login').status_code == 200
+    response = auth.login()
+    assert response.headers['Location'] == '/'
+
+    with client:
+        client.get('/')
+        assert session['user_id'] == 1
+        assert g.user['username'] == 'test'
+
+
+def test_login_validate_input(auth):
+    assert b'Incorrect username' in auth.login('a', 'test').data
+    assert b'Incorrect password' in auth.login('test', 'a').data
+
+
+def test_logout(client, auth):
+    auth.login()
+
+    with client:
+        auth.logout()
+        assert 'user_id' not in session
+
+
+def test_init_db_clears_the_user_cache(app):
+    with app.app_context():
+        assert get_user(1)['username'] == 'test'
+        assert get_user_cache().get(1) is not None
+
+        init_db()
+        db = get_db()
+        db.execute('INSERT INTO "user" (username, password) VALUES (?, ?)', ('fresh', 'x'))
+        db.commit()
+
+        assert get_user(1)['username'] == 'fresh'
+
+
+def test_import_users_clears_the_user_cache(app, runner, tmp_path):
+    with app.app_context():
+        get_user(1)
+
+    path = tmp_path / 'users.jsonl'
+    path.write_text(json.dumps({'id': 3, 'username': 'imported', 'password': 'x'}) + '\n')
+    result = runner.invoke(args=['import', 'users', str(path)])
+    assert result.exit_code == 0, result.output
+
+    with app.app_context():
+        assert get_user_cache().get(1) is None
+        assert get_user(3)['username'] == 'imported'
@@ -0,0 +1,188 @@
+import pytest
+
+from flaskr.blog import get_authors_page, get_posts_page
+from flaskr.db import get_db
+
+
+def test_index(client, auth):
+    response = client.get('/')
+    assert b'Log In' in response.data
+    assert b'Register' in response.data
+
+    auth.login()
+    response = client.get('/')
+    assert b'Log Out' in response.data
+    assert b'test title' in response.data
+    assert b'by <a href="/user/test">test</a> on' in response.data
+    assert b'2018-01-01' in response.data
+    assert b'href="/1/update"' in response.data
+
+
+@pytest.mark.parametrize('path', ('/create', '/1/update', '/1/delete'))
+def test_login_required(client, path):
+    response = client.post(path)
+    assert response.headers['Location'] == '/auth/login'
+
+
+def test_author_required(app, client, auth):
+    with app.app_context():
+        db = get_db()
+        db.execute('UPDATE post SET author_id = 2 WHERE id = 1')
+        db.commit()
+
+    auth.login()
+    assert client.post('/1/update').status_code == 403
+    assert client.post('/1/delete').status_code == 403
+    assert b'href="/1/update"' not in client.get('/').data
+
+
+@pytest.mark.parametrize('path', ('/2/update', '/2/delete'))
+def test_exists_required(client, auth, path):
+    auth.login()
+    assert client.post(path).status_code == 404
+
+
+def test_create(client, auth, app):
+    auth.login()
+    assert client.get('/create').status_code == 200
+    client.post('/create', data={'title': 'created', 'body': ''})
+
+    with app.app_context():
+        assert get_db().execute('SELECT COUNT(id) FROM post').fetchone()[0] == 2
+
+
+def test_update(client, auth, app):
+    auth.login()
+    assert client.get('/1/update').status_code == 200
+    client.post('/1/update', data={'title': 'updated', 'body': ''})
+
+    with app.app_context():
+        assert get_db().execute('SELECT title FROM post WHERE id = 1').fetchone()[0] == 'updated'
+
+
+@pytest.mark.parametrize('path', ('/create', '/1/update'))
+def test_create_update_validate(client, auth, path):
+    auth.login()
+    assert b'Title is required.' in client.post(path, data={'title': '', 'body': ''}).data
+
+
+def test_delete(client, auth, app):
+    auth.login()
+    assert client.post('/1/delete').headers['Location'] == '/'
+
+    with app.app_context():
+        assert get_db().execute('SELECT * FROM post WHERE id = 1').fetchone() is None
+
+
+@pytest.fixture
+def posts(app):
+    """ Seven posts in all, two of them sharing a created timestamp so only their ids tell them apart. """
+    with app.app_context():
+        db = get_db()
+        days = ('2019-01-01', '2019-01-02', '2019-01-02', '2019-01-03', '2019-01-04', '2019-01-05')
+        for n, created in enumerate(days):
+            db.execute(
+                'INSERT INTO post (title, body, author_id, created) VALUES (?, ?, ?, ?)',
+                ('post {0}'.format(n), '', 1 + n % 2, created + ' 00:00:00')
+            )
+        db.commit()
+        return [row[0] for row in db.execute('SELECT id FROM post ORDER BY created DESC, id DESC')]
+
+
+def walk(before=None, after=None, author_id=None):
+    """ Follows the cursors from one page to the end, returning the ids on each page. """
+    pages = []
+
+    while True:
+        posts, prev_cursor, next_cursor = get_posts_page(before, after, per_page=3, author_id=author_id)
+        pages.append([post['id'] for post in posts])
+
+        if after is not None:
+            if prev_cursor is None:
+                return pages[::-1]
+            before, after = None, prev_cursor
+        else:
+            if next_cursor is None:
+                return pages
+            before = next_cursor
+
+
+def test_paging_older_and_newer(app, posts):
+    with app.app_context():
+        pages = walk()
+        assert pages == [posts[0:3], posts[3:6], posts[6:7]]
+
+        # Walking back from page two gives page one again.
+        end_of_page_one = get_posts_page(per_page=3)[2]
+        page_two = get_posts_page(before=end_of_page_one, per_page=3)
+        assert [post['id'] for post in page_two[0]] == posts[3:6]
+        assert walk(after=page_two[1]) == [posts[0:3]]
+
+
+def test_paging_a_new_post_does_not_shift_pages(app, posts):
+    with app.app_context():
+        _, _, next_cursor = get_posts_page(per_page=3)
+
+        db = get_db()
+        db.execute("INSERT INTO post (title, body, author_id) VALUES ('newest', '', 1)")
+        db.commit()
+
+        # OFFSET paging would repeat the last post of page one here.
+        assert [post['id'] for post in get_posts_page(before=next_cursor, per_page=3)[0]] == posts[3:6]
+
+
+def test_paging_per_author(app, posts):
+    with app.app_context():
+        by_test = [row[0] for row in get_db().execute(
+            'SELECT id FROM post WHERE author_id = 1 ORDER BY created DESC, id DESC'
+        )]
+        assert sum(walk(author_id=1), []) == by_test
+
+
+def test_pager_links(app, client, posts):
+    app.config['POSTS_PER_PAGE'] = 3
+    response = client.get('/')
+    assert b'Older' in response.data
+    assert b'Newer' not in response.data
+
+    older = client.get('/?before=2019-01-02 00:00:00,{0}'.format(posts[2]))
+    assert b'Older' in older.data and b'Newer' in older.data
+
+
+@pytest.mark.parametrize('cursor', ('nonsense', ',', '2019-01-01,abc'))
+def test_invalid_cursor(client, cursor):
+    assert client.get('/', query_string={'before': cursor}).status_code == 400
+
+
+def test_authors_are_paged_with_cursors(app, client, posts):
+    app.config['AUTHORS_PER_PAGE'] = 1
+
+    with app.app_context():
+        first, _, next_cursor = get_authors_page(per_page=1)
+        second, prev_cursor, last_cursor = get_authors_page(before=next_cursor, per_page=1)
+        assert [author['username'] for author in first + second] == ['test', 'other']
+        assert last_cursor is None
+        assert [author['username'] for author in get_authors_page(after=prev_cursor, per_page=1)[0]] == ['test']
+
+    response = client.get('/authors')
+    assert b'7 posts by 2 authors.' in response.data
+    assert b'Fewer posts' in response.data and b'More posts' not in response.data
+
+    response = client.get('/authors', query_string={'before': next_cursor})
+    assert b'>other<' in response.data and b'More posts' in response.data
+
+
+def test_authors_totals_follow_writes(client, auth):
+    assert b'1 posts by 1 authors.' in client.get('/authors').data
+
+    auth.login()
+    client.post('/create', data={'title': 'another', 'body': ''})
+    assert b'2 posts by 1 authors.' in client.get('/authors').data
+
+    client.post('/1/delete')
+    assert b'1 posts by 1 authors.' in client.get('/authors').data
+
+
+@pytest.mark.parametrize('cursor', ('nonsense', '1', '1,x', '-1,2'))
+def test_invalid_authors_cursor(client, cursor):
+    assert client.get('/authors', query_string={'after': cursor}).status_code == 400
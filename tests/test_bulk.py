@@ -0,0 +1,44 @@
+import json
+
+from flaskr.db import get_db
+
+
+def write_jsonl(path, records):
+    path.write_text(''.join(json.dumps(record) + '\n' for record in records))
+    return str(path)
+
+
+def test_export_and_import_posts(app, runner, tmp_path):
+    result = runner.invoke(args=['export', 'posts', '-o', str(tmp_path / 'posts.jsonl')])
+    assert result.exit_code == 0, result.output
+
+    with app.app_context():
+        db = get_db()
+        db.execute('DELETE FROM post')
+        db.commit()
+
+    result = runner.invoke(args=['import', 'posts', str(tmp_path / 'posts.jsonl')])
+    assert result.exit_code == 0, result.output
+
+    with app.app_context():
+        assert get_db().execute('SELECT title, author_name FROM post').fetchone()[:] == ('test title', 'test')
+
+
+def test_import_posts_of_a_missing_author(app, runner, tmp_path):
+    path = write_jsonl(tmp_path / 'posts.jsonl', [
+        {'author_id': 1, 'title': 'fine', 'body': 'x'},
+        {'author_id': 42, 'title': 'orphan', 'body': 'x'},
+    ])
+    result = runner.invoke(args=['import', 'posts', path, '--batch-size', '1'])
+
+    assert result.exit_code == 1
+    assert 'records 2 to 2 was not imported' in result.output
+    assert 'No user has the author_id 42.' in result.output
+    assert isinstance(result.exception, SystemExit)
+
+    with app.app_context():
+        titles = [row[0] for row in get_db().execute('SELECT title FROM post ORDER BY id')]
+
+    # The first batch was committed, and the checkpoint lets a rerun start after it.
+    assert titles == ['test title', 'fine']
+    assert (tmp_path / 'posts.jsonl.progress').read_text() == '1'
@@ -0,0 +1,123 @@
+import pytest
+
+from flaskr import create_app
+from flaskr.cache import LRUCache, get_index_cache
+from flaskr.db import get_db, get_pool
+
+
+def test_lru_cache_evicts_the_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.stats()['evictions'] == 1
+
+
+def test_lru_cache_expires_entries(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('flaskr.cache.time.monotonic', lambda: now[0])
+    cache = LRUCache(maxsize=2, ttl=10)
+    cache.set('a', 1)
+
+    now[0] += 11
+    assert cache.get('a') is None
+
+
+def test_index_is_served_from_the_cache(app, client):
+    client.get('/')
+    client.get('/')
+
+    with app.app_context():
+        stats = get_index_cache().stats()
+
+    assert (stats['hits'], stats['misses'], stats['size']) == (1, 1, 1)
+
+
+def test_not_modified(client):
+    response = client.get('/')
+    etag = response.headers['ETag']
+
+    revalidated = client.get('/', headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.data == b''
+
+
+@pytest.mark.parametrize('write, shows', (
+    (('/create', {'title': 'fresh post', 'body': ''}), b'fresh post'),
+    (('/1/update', {'title': 'changed title', 'body': ''}), b'changed title'),
+    (('/1/delete', {}), None),
+))
+def test_writes_invalidate_the_index(client, auth, write, shows):
+    auth.login()
+    before = client.get('/')
+    assert b'test title' in before.data
+
+    path, data = write
+    assert client.post(path, data=data).status_code == 302
+
+    # The browser's copy is stale now, so it is sent the new page instead of a 304.
+    after = client.get('/', headers={'If-None-Match': before.headers['ETag']})
+    assert after.status_code == 200
+    assert after.headers['ETag'] != before.headers['ETag']
+
+    if shows is None:
+        assert b'test title' not in after.data
+    else:
+        assert shows in after.data
+
+
+def test_update_keeps_pages_without_the_post(app, client, auth):
+    auth.login()
+    client.get('/')
+    client.get('/?before=2000-01-01 00:00:00,1')
+
+    with app.app_context():
+        assert get_index_cache().stats()['size'] == 2
+
+    client.post('/1/update', data={'title': 'changed title', 'body': ''})
+
+    # The change is applied before the next page is served. Only the head page shows post 1; the empty older page
+    # stays cached.
+    with app.app_context():
+        cache = get_index_cache()
+        cache.sync(get_db())
+        assert cache.stats()['size'] == 1
+
+
+def test_cache_can_be_turned_off(make_app):
+    app = make_app(INDEX_CACHE_SIZE=0)
+    client = app.test_client()
+
+    assert client.get('/').status_code == 200
+
+    with app.app_context():
+        assert get_index_cache() is None
+
+
+@pytest.mark.parametrize('write, shows', (
+    (('/create', {'title': 'fresh post', 'body': ''}), b'fresh post'),
+    (('/1/update', {'title': 'changed title', 'body': ''}), b'changed title'),
+))
+def test_writes_in_another_worker_invalidate_the_index(app, client, auth, write, shows):
+    # A second app on the same database stands in for another worker process, with a cache of its own.
+    worker = create_app({'TESTING': True, 'DATABASE': app.config['DATABASE'], 'TEMPLATE_BYTECODE_CACHE': False})
+    reader = worker.test_client()
+
+    try:
+        before = reader.get('/')
+        assert b'test title' in before.data
+        assert reader.get('/', headers={'If-None-Match': before.headers['ETag']}).status_code == 304
+
+        auth.login()
+        path, data = write
+        assert client.post(path, data=data).status_code == 302
+
+        after = reader.get('/', headers={'If-None-Match': before.headers['ETag']})
+        assert after.status_code == 200
+        assert shows in after.data
+    finally:
+        get_pool(worker).close()
@@ -0,0 +1,119 @@
+import threading
+import time
+
+import pytest
+
+from flaskr import create_app
+from flaskr.db import ConnectionPool, get_db, get_pool
+
+
+def test_get_db_reuses_the_connection(app):
+    with app.app_context():
+        db = get_db()
+        assert db is get_db()
+
+    assert get_pool(app).stats()['idle'] == 1
+
+    with app.app_context():
+        assert get_db() is db
+
+
+def test_init_db_command(runner, monkeypatch):
+    called = []
+    monkeypatch.setattr('flaskr.db.init_db', lambda: called.append(True))
+    result = runner.invoke(args=['init-db'])
+    assert 'Initialized' in result.output
+    assert called
+
+
+class FakeCursor(object):
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, sql, parameters=()):
+        self.connection.status = self.connection.psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+
+    def fetchone(self):
+        return [1]
+
+
+class FakeConnection(object):
+    """ Just enough of a psycopg2 connection for PostgresConnection, which never reaches a server. """
+
+    def __init__(self, psycopg2):
+        self.psycopg2 = psycopg2
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        self.rollbacks = 0
+
+    def cursor(self, name=None, cursor_factory=None):
+        return FakeCursor(self)
+
+    def get_transaction_status(self):
+        return self.status
+
+    def commit(self):
+        self.status = self.psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = self.psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        pass
+
+
+@pytest.mark.parametrize('instrument', (False, True))
+def test_postgres_pool_takes_connections_back(monkeypatch, instrument):
+    psycopg2 = pytest.importorskip('psycopg2')
+    opened = []
+
+    def connect(dsn):
+        opened.append(FakeConnection(psycopg2))
+        return opened[-1]
+
+    monkeypatch.setattr(psycopg2, 'connect', connect)
+    app = create_app({
+        'TESTING': True,
+        'DATABASE': 'postgresql://flaskr@localhost/flaskr_test',
+        'DATABASE_POOL_SIZE': 1,
+        'DATABASE_POOL_TIMEOUT': 0.5,
+        'INSTRUMENT': instrument,
+        'RATELIMIT_ENABLED': False,
+    })
+    app.add_url_rule('/one', 'one', lambda: str(get_db().execute('SELECT 1').fetchone()[0]))
+    client = app.test_client()
+
+    # More requests than the pool has connections: each one has to get the connection of the one before it back.
+    for _ in range(3):
+        assert client.get('/one').data == b'1'
+
+    assert len(opened) == 1
+    # The transaction SELECT 1 opened was rolled back before the connection went back to the pool.
+    assert opened[0].rollbacks == 3
+    assert get_pool(app).stats()['idle'] == 1
+
+
+def test_pool_wait_is_bounded_by_the_timeout(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'pool.sqlite'), size=1, timeout=0.3)
+    held = pool.acquire()
+    stop = threading.Event()
+
+    # Keeps waking the waiting thread up without ever leaving it a connection.
+    def nudge():
+        while not stop.wait(0.05):
+            with pool._lock:
+                pool._lock.notify_all()
+
+    threading.Thread(target=nudge, daemon=True).start()
+    began = time.monotonic()
+
+    try:
+        with pytest.raises(RuntimeError):
+            pool.acquire()
+    finally:
+        stop.set()
+
+    assert time.monotonic() - began < 1.0
+    assert pool.stats()['waits'] == 1
+    pool.release(held)
@@ -0,0 +1,42 @@
+import pytest
+
+from flaskr import create_app
+
+
+def test_config():
+    assert not create_app().testing
+    assert create_app({'TESTING': True}).testing
+
+
+def test_hello(client):
+    response = client.get('/hello')
+    assert response.data == b'Hello, World!'
+
+
+@pytest.mark.parametrize('blueprints, pages', (
+    (('auth', 'blog'), ('/', '/auth/login', '/authors')),
+    (('auth', 'search'), ('/search', '/auth/login')),
+    (('blog', 'search'), ('/', '/search', '/authors')),
+    ((), ('/hello',)),
+))
+def test_any_blueprints_can_be_left_out(make_app, blueprints, pages):
+    app = make_app(BLUEPRINTS=blueprints)
+    client = app.test_client()
+
+    for page in pages:
+        assert client.get(page).status_code == 200, page
+
+    # Logging in still works and lands on a page that exists.
+    if 'auth' in blueprints:
+        response = client.post('/auth/login', data={'username': 'test', 'password': 'test'}, follow_redirects=True)
+        assert response.status_code == 200
+        assert b'test' in response.data
+
+    # A logged out user is not redirected to a login page this worker does not have.
+    if 'auth' not in blueprints and 'blog' in blueprints:
+        assert client.get('/create').status_code == 401
+
+
+def test_unknown_blueprints_are_rejected():
+    with pytest.raises(ValueError, match='Unknown BLUEPRINTS api'):
+        create_app({'TESTING': True, 'BLUEPRINTS': ('blog', 'api')})
@@ -0,0 +1,67 @@
+import os
+import time
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+from flaskr import create_app
+from flaskr.db import get_db
+from flaskr.hashing import HashPool, HashPoolBusy, needs_rehash
+
+
+@pytest.mark.parametrize('method', ('pbkdf2:sha256', 'pbkdf2:sha256:1000', 'scrypt'))
+def test_needs_rehash_with_short_methods(app, method):
+    app.config['PASSWORD_HASH_METHOD'] = method
+
+    with app.app_context():
+        assert not needs_rehash(generate_password_hash('secret', method))
+        assert needs_rehash('pbkdf2:sha256:50000$salt$hash')
+
+
+def test_login_keeps_a_current_hash(app, auth):
+    # A short form that werkzeug expands, see method_prefix().
+    app.config['PASSWORD_HASH_METHOD'] = 'scrypt'
+    auth.login()
+
+    with app.app_context():
+        rehashed = get_db().execute('SELECT password FROM "user" WHERE username = ?', ('test',)).fetchone()[0]
+
+    assert rehashed.startswith('scrypt:')
+    auth.logout()
+    auth.login()
+
+    with app.app_context():
+        assert get_db().execute('SELECT password FROM "user" WHERE username = ?', ('test',)).fetchone()[0] == rehashed
+
+
+def test_timed_out_jobs_keep_their_slots():
+    pool = HashPool(workers=1, queue_size=1, timeout=0.1)
+
+    try:
+        # Warm the worker up, so its start up does not count against the timeouts below.
+        assert pool.run(abs, -1) == 1
+
+        for _ in range(2):
+            with pytest.raises(HashPoolBusy):
+                pool.run(time.sleep, 0.5)
+
+        # Both jobs are still in the executor, so the next request is turned away at once instead of waiting.
+        began = time.monotonic()
+        with pytest.raises(HashPoolBusy):
+            pool.run(abs, -2)
+        assert time.monotonic() - began < 0.05
+        assert pool.stats()['rejected'] == 1
+
+        # Once they are done their slots are free again.
+        time.sleep(1.2)
+        assert pool.run(abs, -3) == 3
+    finally:
+        pool.shutdown()
+
+
+def test_default_pools_fit_the_cores():
+    # Every server worker starts its own pool, so the defaults must not multiply to more hashing processes than cores.
+    config = create_app().config
+
+    for server_workers in (config['WSGI_WORKERS'], config['ASGI_WORKERS']):
+        assert server_workers * config['PASSWORD_HASH_WORKERS'] <= (os.cpu_count() or 1)
@@ -0,0 +1,35 @@
+from flaskr import create_app
+from flaskr.migrate import load_migrations
+
+LATEST = max(migration.version for migration in load_migrations())
+
+
+def test_healthz(client):
+    response = client.get('/healthz')
+    assert response.status_code == 200
+    assert response.json == {'status': 'ok'}
+    assert response.headers['Cache-Control'] == 'no-store'
+
+
+def test_readyz(client):
+    response = client.get('/readyz')
+    assert response.status_code == 200
+    assert [check['ok'] for check in response.json['checks'].values()] == [True, True, True]
+
+
+def test_not_ready_without_a_database(tmp_path):
+    app = create_app({'TESTING': True, 'DATABASE': str(tmp_path / 'missing.sqlite')})
+    response = app.test_client().get('/readyz')
+
+    assert response.status_code == 503
+    assert response.json['checks']['database']['ok'] is False
+    # Nothing was created by looking.
+    assert not (tmp_path / 'missing.sqlite').exists()
+
+
+def test_not_ready_with_pending_migrations(app, runner, client):
+    runner.invoke(args=['db', 'downgrade', '--to', str(LATEST - 1), '--yes'])
+    response = client.get('/readyz')
+
+    assert response.status_code == 503
+    assert '1 migration(s) pending' in response.json['checks']['schema']['error']
@@ -0,0 +1,60 @@
+import os
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def profiled(make_app):
+    return make_app(INSTRUMENT=True, INSTRUMENT_PROFILE_SLOW_MS=0)
+
+
+def profiles(app):
+    directory = os.path.join(app.instance_path, 'profiles')
+    return os.listdir(directory) if os.path.isdir(directory) else []
+
+
+def test_server_timing(profiled):
+    response = profiled.test_client().get('/hello')
+    assert 'total;dur=' in response.headers['Server-Timing']
+
+
+def test_one_request_is_profiled_at_a_time(profiled, tmp_path):
+    profiled.instance_path = str(tmp_path)
+    entered, release = threading.Event(), threading.Event()
+
+    @profiled.route('/wait')
+    def wait():
+        entered.set()
+        release.wait(5)
+        return 'done'
+
+    results = []
+    first = threading.Thread(target=lambda: results.append(profiled.test_client().get('/wait').status_code))
+    first.start()
+    assert entered.wait(5)
+
+    # Starts while /wait holds the profiler, so it runs without one instead of failing.
+    assert profiled.test_client().get('/hello').status_code == 200
+
+    release.set()
+    first.join()
+    assert results == [200]
+    assert [name.split('-')[1] for name in profiles(profiled)] == ['wait']
+
+    # Once /wait is done the profiler is free again.
+    assert profiled.test_client().get('/hello').status_code == 200
+    assert len(profiles(profiled)) == 2
+
+
+def test_a_failed_request_frees_the_profiler(profiled, tmp_path):
+    profiled.instance_path = str(tmp_path)
+
+    @profiled.route('/fail')
+    def fail():
+        raise RuntimeError('failed')
+
+    profiled.testing = False
+    assert profiled.test_client().get('/fail').status_code == 500
+    assert profiled.test_client().get('/hello').status_code == 200
+    assert sorted(name.split('-')[1] for name in profiles(profiled)) == ['fail', 'hello']
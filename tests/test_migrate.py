@@ -0,0 +1,91 @@
+import sqlite3
+
+from flaskr import create_app
+from flaskr.db import get_db
+from flaskr.migrate import current_version, get_migrator, load_migrations, pending_migrations
+
+OLD_SCHEMA = """
+CREATE TABLE user (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE NOT NULL, password TEXT NOT NULL);
+CREATE TABLE post (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  author_id INTEGER NOT NULL,
+  created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  title TEXT NOT NULL,
+  body TEXT NOT NULL,
+  FOREIGN KEY (author_id) REFERENCES user (id)
+);
+INSERT INTO user (username, password) VALUES ('a', 'x'), ('b', 'y');
+INSERT INTO post (author_id, title, body) VALUES (1, 'hello', 'world'), (1, 'x', 'y'), (2, 'z', 'w');
+"""
+
+LATEST = max(migration.version for migration in load_migrations())
+
+
+def test_init_db_applies_every_migration(app):
+    with app.app_context():
+        assert pending_migrations() == []
+        assert current_version(get_migrator()) == LATEST
+
+
+def test_status(runner):
+    result = runner.invoke(args=['db', 'status'])
+    assert result.exit_code == 0
+    assert '[ ]' not in result.output
+    assert 'Schema version {0}.'.format(LATEST) in result.output
+
+
+def test_downgrade_and_upgrade(app, runner):
+    result = runner.invoke(args=['db', 'downgrade', '--to', '3', '--yes'])
+    assert result.exit_code == 0, result.output
+
+    with app.app_context():
+        m = get_migrator()
+        assert current_version(m) == 3
+        assert not m.column_exists('post', 'author_name')
+        assert [migration.version for migration in pending_migrations()] == [4, 5, 6]
+
+    result = runner.invoke(args=['db', 'upgrade'])
+    assert 'Applied 3 migration(s), schema version {0}.'.format(LATEST) in result.output
+
+    with app.app_context():
+        db = get_db()
+        # The backfill filled in the data that was already there.
+        assert db.execute('SELECT author_name FROM post WHERE id = 1').fetchone()[0] == 'test'
+        assert db.execute('SELECT post_count FROM "user" WHERE id = 1').fetchone()[0] == 1
+
+    # Nothing is left to do the second time.
+    assert 'Applied 0 migration(s)' in runner.invoke(args=['db', 'upgrade']).output
+
+
+def test_downgrade_asks_first(runner):
+    result = runner.invoke(args=['db', 'downgrade'], input='n\n')
+    assert result.exit_code == 1
+    assert 'Schema version {0}.'.format(LATEST) in runner.invoke(args=['db', 'status']).output
+
+
+def test_upgrade_adopts_an_old_database(tmp_path):
+    path = str(tmp_path / 'old.sqlite')
+    old = sqlite3.connect(path)
+    old.executescript(OLD_SCHEMA)
+    old.close()
+
+    app = create_app({'TESTING': True, 'DATABASE': path, 'MIGRATION_BATCH_SIZE': 2, 'MIGRATION_BATCH_PAUSE': 0})
+    result = app.test_cli_runner().invoke(args=['db', 'upgrade'])
+    assert result.exit_code == 0, result.output
+
+    with app.app_context():
+        db = get_db()
+        assert [tuple(row) for row in db.execute('SELECT author_name FROM post ORDER BY id')] == [('a',), ('a',), ('b',)]
+        assert [tuple(row) for row in db.execute('SELECT post_count FROM user ORDER BY id')] == [(2,), (1,)]
+        assert db.execute("SELECT COUNT(*) FROM post_fts WHERE post_fts MATCH 'hello'").fetchone()[0] == 1
+
+
+def test_reading_the_version_does_not_write(tmp_path):
+    path = str(tmp_path / 'empty.sqlite')
+    sqlite3.connect(path).close()
+    app = create_app({'TESTING': True, 'DATABASE': path})
+
+    with app.app_context():
+        assert len(pending_migrations()) == LATEST
+        assert not get_migrator().table_exists('schema_version')
+        assert get_db().total_changes == 0
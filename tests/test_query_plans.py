@@ -0,0 +1,12 @@
+from flaskr.blog import check_query_plans
+
+
+def test_listing_queries_use_indexes(app, sqlite):
+    with app.app_context():
+        assert check_query_plans() == []
+
+
+def test_check_plans_command(runner, sqlite):
+    result = runner.invoke(args=['blog', 'check-plans'])
+    assert result.exit_code == 0
+    assert 'Every listing query uses an index.' in result.output
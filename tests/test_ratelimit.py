@@ -0,0 +1,115 @@
+import pytest
+
+from flaskr.ratelimit import MemoryStore, SQLiteStore, take, take_all
+
+
+def test_take_refills_over_time():
+    tokens, wait = take(None, None, 0, limit=2, period=10)
+    assert (tokens, wait) == (1, 0)
+
+    tokens, wait = take(tokens, 0, 0, limit=2, period=10)
+    assert (tokens, wait) == (0, 0)
+
+    tokens, wait = take(tokens, 0, 1, limit=2, period=10)
+    assert wait == pytest.approx(4)
+
+    tokens, wait = take(tokens, 1, 5, limit=2, period=10)
+    assert wait == 0
+
+
+def test_memory_store_evicts_quiet_clients():
+    store = MemoryStore(maxsize=2)
+
+    for key in ('a', 'b', 'c'):
+        store.consume([key], 1, 60, 0)
+
+    assert store.stats() == {'buckets': 2, 'maxsize': 2, 'evictions': 1}
+    # 'a' was evicted, so it comes back with a full bucket.
+    assert store.consume(['a'], 1, 60, 0) == 0
+    assert store.consume(['c'], 1, 60, 0) > 0
+
+
+@pytest.fixture
+def limited(make_app):
+    return make_app(RATELIMIT_ENABLED=True, RATELIMIT_BUDGETS={'POST auth.login': (2, 60), 'POST blog.create': (1, 60)})
+
+
+def login(client, remote_addr='10.0.0.1'):
+    return client.post(
+        '/auth/login', data={'username': 'test', 'password': 'test'}, environ_base={'REMOTE_ADDR': remote_addr}
+    )
+
+
+def test_too_many_requests(limited):
+    client = limited.test_client()
+
+    assert login(client).status_code == 302
+    assert login(client).status_code == 302
+
+    response = login(client)
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) == 30
+
+    # Another client has its own budget (this one is logged in now, so its user's bucket would count too), and a
+    # GET of the same endpoint has none.
+    assert login(limited.test_client(), '10.0.0.2').status_code == 302
+    assert client.get('/auth/login', environ_base={'REMOTE_ADDR': '10.0.0.1'}).status_code == 200
+
+    stats = limited.extensions['flaskr.ratelimit'].stats()
+    assert stats['allowed']['POST auth.login'] == 3
+    assert stats['rejected']['POST auth.login'] == 1
+
+
+def test_logged_in_user_is_limited_across_addresses(limited):
+    client = limited.test_client()
+    login(client)
+
+    def create(remote_addr):
+        return client.post('/create', data={'title': 't', 'body': ''}, environ_base={'REMOTE_ADDR': remote_addr})
+
+    assert create('10.0.0.1').status_code == 302
+    assert create('10.0.0.2').status_code == 429
+
+
+def test_rejected_requests_do_not_use_up_the_shared_address(make_app):
+    app = make_app(RATELIMIT_ENABLED=True, RATELIMIT_BUDGETS={'POST blog.create': (2, 60)})
+    greedy, neighbour = app.test_client(), app.test_client()
+    greedy.post('/auth/login', data={'username': 'test', 'password': 'test'})
+    neighbour.post('/auth/login', data={'username': 'other', 'password': 'other'})
+
+    def create(client, remote_addr):
+        return client.post('/create', data={'title': 't', 'body': ''}, environ_base={'REMOTE_ADDR': remote_addr})
+
+    # test spends their own budget elsewhere, then keeps trying from the address they share with other.
+    assert [create(greedy, '10.0.0.9').status_code for _ in range(2)] == [302, 302]
+    assert [create(greedy, '10.0.0.1').status_code for _ in range(3)] == [429, 429, 429]
+
+    # The shared address still has its whole budget.
+    assert [create(neighbour, '10.0.0.1').status_code for _ in range(3)] == [302, 302, 429]
+
+
+def test_take_all_takes_from_every_bucket_or_none():
+    left, wait = take_all([(None, None), (0.0, 0)], 0, limit=2, period=10)
+    assert wait == pytest.approx(5)
+    assert left == [2, 0]
+
+    left, wait = take_all([(None, None), (1.0, 0)], 0, limit=2, period=10)
+    assert (left, wait) == ([1, 0], 0)
+
+
+def test_health_checks_are_not_limited(make_app):
+    app = make_app(RATELIMIT_ENABLED=True, RATELIMIT_DEFAULT=(1, 60))
+    client = app.test_client()
+
+    assert [client.get('/readyz').status_code for _ in range(3)] == [200, 200, 200]
+    assert [client.get('/hello').status_code for _ in range(2)] == [200, 429]
+
+
+def test_sqlite_store_is_shared(tmp_path):
+    path = str(tmp_path / 'ratelimit.sqlite')
+    first, second = SQLiteStore(path), SQLiteStore(path)
+
+    assert first.consume(['ip:1:login'], 2, 60, 0) == 0
+    assert second.consume(['ip:1:login'], 2, 60, 0) == 0
+    assert first.consume(['ip:1:login'], 2, 60, 0) == pytest.approx(30)
+    assert second.stats() == {'buckets': 1}
@@ -0,0 +1,45 @@
+import json
+
+from flaskr.db import get_db
+
+
+def search(client, query):
+    return client.get('/search', query_string={'q': query}).data
+
+
+def test_search_marks_the_matches(client):
+    data = search(client, 'body')
+    assert b'<mark>body</mark>' in data
+    assert b'No posts match' in search(client, 'nothing')
+
+
+def test_saved_posts_cannot_carry_marks(app, client, auth, tmp_path):
+    auth.login()
+    client.post('/create', data={'title': 'sneaky \x02one\x03', 'body': 'hello \x02evil\x03 and \x02open'})
+
+    (tmp_path / 'posts.jsonl').write_text(json.dumps({'author_id': 1, 'title': 'imported', 'body': 'hello \x02bulk\x03'}))
+    result = app.test_cli_runner().invoke(args=['import', 'posts', str(tmp_path / 'posts.jsonl')])
+    assert result.exit_code == 0, result.output
+
+    with app.app_context():
+        for title, body in get_db().execute('SELECT title, body FROM post WHERE id > 1'):
+            assert '\x02' not in title + body and '\x03' not in title + body
+
+    data = search(client, 'hello')
+    assert data.count(b'<mark>hello</mark>') == 2
+    assert b'hello evil and open' in data.replace(b'<mark>hello</mark>', b'hello')
+
+
+def test_upgrade_strips_marks_from_old_posts(app, runner):
+    runner.invoke(args=['db', 'downgrade', '--to', '5', '--yes'])
+
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE post SET body = 'hello ' || char(2) || 'evil' || char(3) WHERE id = 1")
+        db.commit()
+
+    result = runner.invoke(args=['db', 'upgrade'])
+    assert result.exit_code == 0, result.output
+
+    with app.app_context():
+        assert get_db().execute('SELECT body FROM post WHERE id = 1').fetchone()[0] == 'hello evil'
@@ -0,0 +1,123 @@
+import pytest
+from flask import session
+
+from flaskr.sessions import get_store
+
+
+@pytest.fixture
+def server_app(make_app, tmp_path):
+    return make_app(SESSION_STORE='sqlite', SESSION_STORE_PATH=str(tmp_path / 'sessions.sqlite'), SESSION_MAX_PER_USER=2)
+
+
+def login(client):
+    client.post('/auth/login', data={'username': 'test', 'password': 'test'})
+    return client.get_cookie('session').value
+
+
+def logged_in(client):
+    return b'Log Out' in client.get('/').data
+
+
+def test_cookie_only_carries_the_id(server_app):
+    client = server_app.test_client()
+    sid = login(client)
+
+    assert len(sid) > 40 and '.' not in sid
+    assert logged_in(client)
+
+    with server_app.app_context():
+        assert get_store().count(1) == 1
+
+
+def test_login_gets_a_new_id_and_logout_deletes_it(server_app):
+    client = server_app.test_client()
+    first = login(client)
+    client.get('/auth/logout')
+
+    assert client.get_cookie('session') is None
+    assert login(client) != first
+
+    with server_app.app_context():
+        assert get_store().count(1) == 1
+
+
+def test_oldest_sessions_are_ended_over_the_cap(server_app):
+    clients = [server_app.test_client() for _ in range(3)]
+
+    for client in clients:
+        login(client)
+
+    with server_app.app_context():
+        assert get_store().count(1) == 2
+
+    assert [logged_in(client) for client in clients] == [False, True, True]
+
+
+def test_revoke_command(server_app):
+    client = server_app.test_client()
+    login(client)
+
+    result = server_app.test_cli_runner().invoke(args=['sessions', 'revoke', 'test'])
+    assert 'Ended 1 session(s) of test.' in result.output
+    assert not logged_in(client)
+
+
+def test_user_row_is_cached_with_the_session(server_app):
+    client = server_app.test_client()
+    sid = login(client)
+
+    with server_app.app_context():
+        store = get_store()
+        assert store.load(sid, 0).user == {'id': 1, 'username': 'test'}
+
+        store.forget_user(1)
+        assert store.load(sid, 0).user is None
+
+    # The next request reads the row again and caches it once more.
+    assert logged_in(client)
+
+    with server_app.app_context():
+        assert get_store().load(sid, 0).user == {'id': 1, 'username': 'test'}
+
+
+def test_sweep_deletes_expired_sessions(server_app):
+    login(server_app.test_client())
+
+    with server_app.app_context():
+        store = get_store()
+        assert store.sweep(now=0) == 0
+        assert store.sweep(now=float('inf')) == 1
+        assert store.count() == 0
+
+
+def test_revoking_a_session_in_use_ends_it(server_app):
+    @server_app.route('/revoked-meanwhile')
+    def revoked_meanwhile():
+        # The session was loaded before `flask sessions revoke` ran, and the request changes it afterwards.
+        get_store().revoke_user(1)
+        session['seen'] = True
+        return ''
+
+    client = server_app.test_client()
+    sid = login(client)
+    client.get('/revoked-meanwhile')
+
+    assert client.get_cookie('session') is None
+    assert not logged_in(client)
+
+    with server_app.app_context():
+        assert get_store().load(sid, 0) is None
+        assert get_store().count() == 0
+
+
+def test_saving_a_revoked_session_does_not_bring_it_back(server_app):
+    sid = login(server_app.test_client())
+
+    with server_app.app_context():
+        store = get_store()
+        session = store.load(sid, 0)
+        store.revoke_user(1)
+        session['seen'] = True
+
+        assert store.save(session, float('inf'), 0) is None
+        assert store.load(sid, 0) is None
@@ -0,0 +1,70 @@
+import sqlite3
+
+import pytest
+
+from flaskr.db import ConnectionPool, get_db
+from flaskr.writer import GroupCommitWriter, get_writer
+
+
+@pytest.fixture
+def writer(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'writer.sqlite'))
+    db = pool.connect()
+    db.execute('CREATE TABLE t (id INTEGER PRIMARY KEY, value TEXT UNIQUE)')
+    db.close()
+    writer = GroupCommitWriter(pool, batch_size=8, batch_delay_ms=1, timeout=2)
+    yield writer
+    writer.shutdown()
+
+
+def test_failing_job_does_not_fail_the_batch(writer):
+    assert writer.submit([('INSERT INTO t (value) VALUES (?)', ('a',))]).lastrowid == 1
+
+    with pytest.raises(sqlite3.IntegrityError):
+        writer.submit([('INSERT INTO t (value) VALUES (?)', ('a',))])
+
+    assert writer.submit([('INSERT INTO t (value) VALUES (?)', ('b',))]).lastrowid == 2
+    assert writer.stats()['failed'] == 1
+
+
+def test_writer_reconnects_after_a_failed_connect(writer, monkeypatch):
+    connect = writer.pool.connect
+    failures = [sqlite3.OperationalError('database is locked')]
+
+    def flaky_connect():
+        if failures:
+            raise failures.pop()
+        return connect()
+
+    monkeypatch.setattr(writer.pool, 'connect', flaky_connect)
+
+    with pytest.raises(sqlite3.OperationalError):
+        writer.submit([('INSERT INTO t (value) VALUES (?)', ('a',))])
+
+    assert writer.alive
+    assert writer.submit([('INSERT INTO t (value) VALUES (?)', ('a',))]).rowcount == 1
+
+
+def test_get_writer_replaces_a_dead_writer(make_app):
+    app = make_app(WRITE_BEHIND=True)
+
+    with app.app_context():
+        writer = get_writer()
+        writer.shutdown()
+        assert not writer.alive
+
+        assert get_writer() is not writer
+        get_writer().submit([('UPDATE post SET title = ? WHERE id = ?', ('changed', 1))])
+        assert get_db().execute('SELECT title FROM post WHERE id = 1').fetchone()[0] == 'changed'
+
+
+def test_create_goes_through_the_writer(make_app):
+    app = make_app(WRITE_BEHIND=True)
+    client = app.test_client()
+    client.post('/auth/login', data={'username': 'test', 'password': 'test'})
+
+    assert client.post('/create', data={'title': 'batched', 'body': ''}).status_code == 302
+
+    with app.app_context():
+        assert get_db().execute("SELECT COUNT(*) FROM post WHERE title = 'batched'").fetchone()[0] == 1
+        assert get_writer().stats()['jobs'] == 1